@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.RequestMetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -132,3 +134,86 @@ STATIC_ROOT = '/vol/web/static/'
 MEDIA_ROOT = '/vol/web/media/'
 
 AUTH_USER_MODEL = 'core.User'
+
+# Resolved auth tokens are cached in process for AUTH_TOKEN_CACHE_TTL
+# seconds. Set AUTH_TOKEN_CACHE_ALIAS to a CACHES alias to share them
+# between workers instead.
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 300
+AUTH_TOKEN_CACHE_ALIAS = None
+
+# When enabled, CreateTokenView issues short-lived signed access tokens and
+# refresh tokens instead of database tokens. Both kinds are always accepted.
+AUTH_SIGNED_TOKENS = False
+AUTH_SIGNED_ACCESS_TTL = 300
+AUTH_SIGNED_REFRESH_TTL = 7 * 24 * 3600
+AUTH_SIGNED_REVOCATION_RELOAD = 30
+
+# Password hashing runs on a bounded thread pool. Requests that would queue
+# more than PASSWORD_HASHING_MAX_PENDING hashes get a 503 straight away.
+PASSWORD_HASHING_WORKERS = 4
+PASSWORD_HASHING_MAX_PENDING = 32
+
+# Worker processes for image processing after uploads
+IMAGE_WORKERS = 2
+
+# Threads recording rendered image variants in the database
+IMAGE_STORE_WORKERS = 2
+
+# Size bound for on-demand image transforms cached under MEDIA_ROOT
+IMAGE_CACHE_MAX_BYTES = 1024 ** 3
+
+# Largest image accepted through resumable upload sessions, in bytes
+UPLOAD_SESSION_MAX_SIZE = 100 * 1024 ** 2
+
+# Seconds an upload session stays open before expire_upload_sessions
+# deletes it and its partial file
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# 'content-addressed' stores each distinct gallery item image once, named by
+# its SHA-256 digest and served with immutable cache headers
+GALLERY_ITEM_IMAGE_STORAGE = 'default'
+
+# Per-user image hash indexes for similar image lookups, kept in process
+SIMILARITY_INDEX_MAX_USERS = 1000
+SIMILARITY_INDEX_TTL = 300
+
+# Palette colours covering less than this share of an image are ignored
+# when searching gallery items by colour
+COLOR_MIN_SHARE = 0.05
+
+# Requests under these paths get a Server-Timing header and a log line with
+# their query count and DB, serializer and view times
+REQUEST_METRICS_PATHS = ('/api/user/', '/api/gallery/')
+
+# Directory shared by worker processes to aggregate /metrics across them.
+# Without it each process serves only its own metrics. It must be local to
+# the host; files of exited workers are folded into one archive file.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1.0
+# Addresses or networks allowed to scrape /metrics, as seen in REMOTE_ADDR
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+# Sampled API request profiles are written here; None disables profiling.
+# One in PROFILING_SAMPLE_RATE requests is profiled (0 for none), as are
+# staff requests with an X-Profile header holding PROFILING_SECRET.
+PROFILING_DIR = None
+PROFILING_SAMPLE_RATE = 0
+PROFILING_INTERVAL = 0.005
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET')
+
+# API queries slower than this many seconds are logged with their plan
+SLOW_QUERY_THRESHOLD = 0.2
+
+# Query count and DB seconds allowed per request, keyed by URL name with an
+# optional '.action' suffix, or 'default'. Overruns are logged; the test
+# runner fails requests over their query count. List budgets leave room
+# for a token lookup and the plan of ?estimate_total=1 on Postgres.
+QUERY_BUDGETS = {
+    'default': {'queries': 20, 'db_time': 0.5},
+    'gallery:tag-list.list': {'queries': 3, 'db_time': 0.05},
+    'gallery:galleryitem-list.list': {'queries': 5, 'db_time': 0.1},
+    'gallery:gallery-list.list': {'queries': 5, 'db_time': 0.1},
+    'gallery:gallery-detail.retrieve': {'queries': 6, 'db_time': 0.1},
+}
+TEST_RUNNER = 'core.watchdog.TestRunner'
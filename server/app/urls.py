@@ -14,12 +14,26 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from core.metrics import metrics_view
+from gallery.views import GalleryItemImageView, image_blob
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/user/', include('user.urls')),
     path('api/gallery/', include('gallery.urls')),
+    path(
+        'media/gallery-items/<int:pk>/',
+        GalleryItemImageView.as_view(),
+        name='gallery-item-image'
+    ),
+    re_path(
+        r'^media/blobs/(?P<path>[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+)$',
+        image_blob,
+        name='image-blob'
+    ),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -26,4 +26,9 @@ class UserAdmin(BaseUserAdmin):
 admin.site.register(models.User, UserAdmin)
 admin.site.register(models.Tag)
 admin.site.register(models.GalleryItem)
+admin.site.register(models.GalleryItemVariant)
+admin.site.register(models.UploadSession)
 admin.site.register(models.Gallery)
+admin.site.register(models.RevokedToken)
+admin.site.register(models.ImageBlob)
+admin.site.register(models.ImportJob)
@@ -0,0 +1,49 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, status
+
+
+class HashingPoolBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many login requests, try again shortly.')
+    default_code = 'hashing_pool_busy'
+
+
+class HashingPool:
+    """Bounded thread pool for password hashing
+
+    PBKDF2 releases the GIL, so hashing on a few worker threads keeps a
+    burst of logins from starving the threads serving other requests. Once
+    max_pending hashes are queued or running, new work is rejected at once
+    instead of waiting.
+    """
+
+    def __init__(self, workers, max_pending):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='password-hashing'
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def run(self, fn, *args):
+        """Run fn on the pool and return its result"""
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+
+        return future.result()
+
+
+hashing_pool = HashingPool(
+    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 4),
+    max_pending=getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', 32),
+)
@@ -0,0 +1,165 @@
+"""Per-request query, serializer and view timings
+
+RequestMetricsMiddleware collects the timings of API requests and reports
+them in a Server-Timing header, a log line and the metrics registry, then
+passes them to the query watchdog. Queries are timed through
+execute_wrapper, so nothing depends on DEBUG query capture. Views using
+TimedSerializationMixin report the time their serializers take.
+"""
+import contextvars
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from core import watchdog
+from core.metrics import observe_request
+
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings collected while handling one request, in seconds"""
+
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.slow_queries = []
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.total = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        """Time a query; used as a database execute wrapper"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.db += elapsed
+            self.queries += 1
+            if self.slow_threshold is not None and not many and \
+                    elapsed > self.slow_threshold:
+                self.slow_queries.append(
+                    (context['connection'].alias, sql, params, elapsed)
+                )
+
+    @property
+    def view(self):
+        """Time spent outside the database and serializers"""
+        return max(0.0, self.total - self.db - self.serialize)
+
+    def server_timing(self):
+        """Return the Server-Timing header value, durations in ms"""
+        return ', '.join((
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize * 1000:.1f}',
+            f'view;dur={self.view * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ))
+
+
+def current_metrics():
+    """Return the metrics of the request being handled, if any"""
+    return _current.get()
+
+
+@contextmanager
+def timed_serialization():
+    """Add the time spent in the block, less its queries, to serialize"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    db = metrics.db
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (metrics.db - db)
+        metrics.serialize += elapsed
+
+
+class TimedSerializationMixin:
+    """View mixin counting serializer output as serialize time
+
+    Only the serializer get_serializer returns is timed; it builds the
+    output of its list children and nested serializers itself, so each
+    response is timed once.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        to_representation = serializer.to_representation
+
+        def timed_to_representation(instance):
+            with timed_serialization():
+                return to_representation(instance)
+
+        serializer.to_representation = timed_to_representation
+        return serializer
+
+
+class RequestMetricsMiddleware:
+    """Report query count and DB, serializer and view time of API requests
+
+    Only paths under REQUEST_METRICS_PATHS are instrumented.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(getattr(
+            settings, 'REQUEST_METRICS_PATHS', ('/api/',)
+        ))
+        self.slow_threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD', None)
+
+    def __call__(self, request):
+        if not request.path_info.startswith(self.paths):
+            return self.get_response(request)
+
+        metrics = RequestMetrics(self.slow_threshold)
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query)
+                    )
+                start = time.perf_counter()
+                response = self.get_response(request)
+                metrics.total = time.perf_counter() - start
+        finally:
+            _current.reset(token)
+
+        response['Server-Timing'] = metrics.server_timing()
+        observe_request(request, response, metrics)
+        watchdog.inspect(request, metrics)
+        logger.info(
+            'method=%s path=%s status=%s queries=%d db_ms=%.1f '
+            'serialize_ms=%.1f view_ms=%.1f total_ms=%.1f',
+            request.method,
+            request.path_info,
+            response.status_code,
+            metrics.queries,
+            metrics.db * 1000,
+            metrics.serialize * 1000,
+            metrics.view * 1000,
+            metrics.total * 1000,
+            extra={
+                'method': request.method,
+                'path': request.path_info,
+                'status': response.status_code,
+                'queries': metrics.queries,
+                'db_ms': metrics.db * 1000,
+                'serialize_ms': metrics.serialize * 1000,
+                'view_ms': metrics.view * 1000,
+                'total_ms': metrics.total * 1000,
+            }
+        )
+        return response
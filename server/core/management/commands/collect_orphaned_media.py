@@ -0,0 +1,199 @@
+import hashlib
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import (
+    GalleryItem, GalleryItemVariant, ImageBlob, UploadSession
+)
+from core.storage import gallery_item_image_storage as storage
+
+
+# Models and fields holding storage names, with the rows that count
+REFERENCES = (
+    (GalleryItem, 'image', {}),
+    (GalleryItemVariant, 'image', {}),
+    (ImageBlob, 'name', {'references__gt': 0}),
+)
+SESSION_DIR = 'uploads/sessions/'
+
+
+def _key(name):
+    """Return a compact hash of a storage name for the referenced set"""
+    return int.from_bytes(
+        hashlib.blake2b(name.encode(), digest_size=8).digest(),
+        'big'
+    )
+
+
+def _session_ids(names):
+    """Return the upload session IDs named by partial upload files"""
+    ids = []
+    for name in names:
+        if name.startswith(SESSION_DIR) and name.endswith('.part'):
+            try:
+                ids.append(uuid.UUID(name[len(SESSION_DIR):-len('.part')]))
+            except ValueError:
+                continue
+    return ids
+
+
+class Command(BaseCommand):
+    """Delete media files that nothing in the database refers to
+
+    Every referenced name is streamed from the database into a set of
+    64 bit hashes, then the media tree is walked. Files missing from the
+    set and older than the grace period are checked against the database
+    once more in batches before they are deleted, so files referenced
+    during the walk are kept.
+    """
+    # Managed by the on-demand transform cache
+    skip_dirs = ('cache',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--grace-hours', type=float, default=24)
+        parser.add_argument(
+            '--max-deletes-per-second',
+            type=float,
+            default=0,
+            help='Limit on deletions per second, 0 for none'
+        )
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--progress-every', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        self.options = options
+        self.root = settings.MEDIA_ROOT
+        self.cutoff = time.time() - options['grace_hours'] * 3600
+        # Partial files of expired upload sessions are orphans too
+        self.session_cutoff = UploadSession.expiry_cutoff()
+        self.interval = 0
+        if options['max_deletes_per_second'] > 0:
+            self.interval = 1 / options['max_deletes_per_second']
+        self.next_delete = time.monotonic()
+        self.stats = dict.fromkeys(
+            ('scanned', 'orphaned', 'deleted', 'bytes'), 0
+        )
+
+        referenced = self._referenced_keys()
+        self.stdout.write(f'Loaded {len(referenced)} referenced files')
+
+        candidates = []
+        for name, entry in self._walk():
+            self.stats['scanned'] += 1
+            if self.stats['scanned'] % options['progress_every'] == 0:
+                self._report('Progress')
+            if _key(name) in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > self.cutoff:
+                continue
+            candidates.append((name, entry.path, stat.st_size))
+            if len(candidates) >= options['batch_size']:
+                self._collect(candidates)
+                candidates = []
+        self._collect(candidates)
+
+        self._report('Dry run' if options['dry_run'] else 'Done')
+
+    def _referenced_names(self):
+        """Yield the storage name of every file the database refers to"""
+        chunk_size = self.options['chunk_size']
+        for model, field, filters in REFERENCES:
+            yield from model.objects.filter(**filters).exclude(
+                **{field: ''}
+            ).exclude(
+                **{f'{field}__isnull': True}
+            ).values_list(field, flat=True).iterator(chunk_size=chunk_size)
+        for session_id in UploadSession.objects.filter(
+            created__gte=self.session_cutoff
+        ).values_list('id', flat=True).iterator(chunk_size=chunk_size):
+            yield f'{SESSION_DIR}{session_id}.part'
+
+    def _referenced_keys(self):
+        return {_key(name) for name in self._referenced_names()}
+
+    def _walk(self):
+        """Yield (storage name, DirEntry) for every file under MEDIA_ROOT"""
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        name = f'{rel_dir}{entry.name}'
+                        if entry.is_dir(follow_symlinks=False):
+                            if name not in self.skip_dirs:
+                                stack.append(f'{name}/')
+                        elif entry.is_file(follow_symlinks=False):
+                            yield name, entry
+            except FileNotFoundError:
+                continue
+
+    def _still_referenced(self, names):
+        """Return which of names the database refers to right now"""
+        found = set()
+        for model, field, filters in REFERENCES:
+            found.update(model.objects.filter(
+                **filters,
+                **{f'{field}__in': names}
+            ).values_list(field, flat=True))
+        session_ids = _session_ids(names)
+        if session_ids:
+            found.update(
+                f'{SESSION_DIR}{session_id}.part'
+                for session_id in UploadSession.objects.filter(
+                    id__in=session_ids,
+                    created__gte=self.session_cutoff
+                ).values_list('id', flat=True)
+            )
+        return found
+
+    def _collect(self, candidates):
+        """Delete the candidates that are still unreferenced"""
+        if not candidates:
+            return
+        found = self._still_referenced([name for name, _, _ in candidates])
+        for name, path, size in candidates:
+            if name in found:
+                continue
+            self.stats['orphaned'] += 1
+            self.stats['bytes'] += size
+            if self.options['verbosity'] > 1:
+                self.stdout.write(name)
+            if self.options['dry_run']:
+                continue
+
+            self._throttle()
+            if storage.is_blob(name):
+                # Blobs are deleted under their row lock, which keeps one
+                # stored again since the check
+                if not storage.collect_blob(name):
+                    continue
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            self.stats['deleted'] += 1
+
+    def _throttle(self):
+        """Sleep as needed to respect --max-deletes-per-second"""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_delete > now:
+            time.sleep(self.next_delete - now)
+        self.next_delete = max(now, self.next_delete) + self.interval
+
+    def _report(self, label):
+        self.stdout.write(
+            '{}: scanned {scanned}, orphaned {orphaned} ({bytes} bytes), '
+            'deleted {deleted}'.format(label, **self.stats)
+        )
@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import (
+    GalleryItem, GalleryItemVariant, GALLERY_ITEM_IMAGE_DIR,
+    GALLERY_ITEM_VARIANT_DIR, fan_out_path, gallery_item_variant_file_path
+)
+
+
+# Models with images in a flat directory, and the new name of each file
+TARGETS = (
+    (
+        GalleryItem,
+        GALLERY_ITEM_IMAGE_DIR,
+        lambda filename: fan_out_path(GALLERY_ITEM_IMAGE_DIR, filename)
+    ),
+    (
+        GalleryItemVariant,
+        GALLERY_ITEM_VARIANT_DIR,
+        lambda filename: gallery_item_variant_file_path(None, filename)
+    ),
+)
+
+
+class Command(BaseCommand):
+    """Move flat gallery item images and variants into fan-out directories
+
+    Rows still pointing into a flat directory are processed in batches of
+    files moved in parallel, then renamed in one query per batch. Rows
+    already moved no longer match, so an interrupted run can simply be
+    started again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model, directory, new_name in TARGETS:
+                self.storage = model._meta.get_field('image').storage
+                moved = self._fan_out(
+                    executor, model, directory, new_name,
+                    options['batch_size']
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    f'Moved {moved} {model._meta.verbose_name} images'
+                ))
+
+    def _fan_out(self, executor, model, directory, new_name, batch_size):
+        """Move the images of model out of directory and return how many"""
+        pending = model.objects.filter(
+            image__regex=rf'^{directory}[^/]+$'
+        ).order_by('id')
+
+        moved = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).values_list(
+                'id', 'image'
+            )[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            names = {
+                row_id: new_name(os.path.basename(name))
+                for row_id, name in batch
+            }
+            done = executor.map(
+                self._move,
+                [name for _, name in batch],
+                [names[row_id] for row_id, _ in batch]
+            )
+            moves = {
+                row_id: (old, names[row_id])
+                for (row_id, old), ok in zip(batch, done) if ok
+            }
+            moved += self._rename(model, moves)
+            self.stdout.write(f'Moved {moved} images...')
+
+        return moved
+
+    def _move(self, old, new):
+        """Move an image file, returning False if it cannot be found"""
+        src, dest = self.storage.path(old), self.storage.path(new)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(src, dest)
+        except FileNotFoundError:
+            # Moved by a run that stopped before renaming the row
+            return os.path.exists(dest)
+        return True
+
+    def _rename(self, model, moves):
+        """Point moved rows at their new files and return how many were"""
+        with transaction.atomic():
+            rows = list(model.objects.select_for_update().filter(
+                id__in=moves
+            ).only('id', 'image'))
+            renamed = []
+            for row in rows:
+                old, new = moves.pop(row.id)
+                if row.image.name == old:
+                    row.image.name = new
+                    renamed.append(row)
+                else:
+                    moves[row.id] = (old, new)
+            model.objects.bulk_update(renamed, ['image'])
+
+        # Rows replaced or deleted since the batch was read keep nothing
+        # in the new location
+        for old, new in moves.values():
+            os.replace(self.storage.path(new), self.storage.path(old))
+
+        return len(renamed)
@@ -0,0 +1,88 @@
+import os
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    """List, merge and export request profiles in PROFILING_DIR
+
+    merge folds each endpoint's profiles into one file. export writes
+    collapsed stacks for flamegraph tools; with several endpoints each
+    stack starts with its endpoint's name.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('list', 'merge', 'export'))
+        parser.add_argument(
+            'endpoints',
+            nargs='*',
+            help='Endpoints to act on, all by default'
+        )
+        parser.add_argument(
+            '--output',
+            help='File to export to instead of standard output'
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        directory = getattr(settings, 'PROFILING_DIR', None)
+        if not directory:
+            raise CommandError('PROFILING_DIR is not set')
+
+        profiles = profiling.profile_files(directory)
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - set(profiles)
+            if unknown:
+                raise CommandError(
+                    f'No profiles for {", ".join(sorted(unknown))}'
+                )
+            profiles = {name: profiles[name] for name in options['endpoints']}
+
+        getattr(self, f'_{options["action"]}')(directory, profiles, options)
+
+    def _list(self, directory, profiles, options):
+        for name, paths in profiles.items():
+            samples = sum(
+                sum(profiling.read_profile(path).values()) for path in paths
+            )
+            self.stdout.write(
+                f'{name} profiles={len(paths)} samples={samples}'
+            )
+
+    def _merge(self, directory, profiles, options):
+        for name, paths in profiles.items():
+            if len(paths) < 2:
+                continue
+            stacks = Counter()
+            for path in paths:
+                stacks.update(profiling.read_profile(path))
+            profiling.write_profile(
+                os.path.join(
+                    directory,
+                    name,
+                    f'merged-{uuid.uuid4().hex}{profiling.SUFFIX}'
+                ),
+                stacks
+            )
+            for path in paths:
+                os.remove(path)
+            self.stdout.write(f'{name} merged {len(paths)} profiles')
+
+    def _export(self, directory, profiles, options):
+        prefix = len(profiles) > 1
+        stacks = Counter()
+        for name, paths in profiles.items():
+            for path in paths:
+                for stack, count in profiling.read_profile(path).items():
+                    stacks[f'{name};{stack}' if prefix else stack] += count
+
+        if options['output']:
+            profiling.write_profile(options['output'], stacks)
+        else:
+            for stack, count in stacks.most_common():
+                self.stdout.write(f'{stack} {count}')
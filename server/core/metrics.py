@@ -0,0 +1,335 @@
+"""Counters and histograms rendered in the Prometheus text format
+
+Each process keeps its own values. With METRICS_DIR set, every process
+also writes them to its own file in that directory at most once per
+METRICS_FLUSH_INTERVAL, and /metrics sums the files of all processes, so
+any worker can answer a scrape. Only counters and histograms are kept,
+since those can be summed across processes.
+
+Files of processes that have exited are folded into one archive file by
+the next scrape, so restarted workers neither leave files behind nor
+reset the totals. The directory must therefore be local to the host, as
+processes are told apart by pid. Deleting it while no worker runs, such
+as before a deploy starts them, resets every total.
+"""
+import fcntl
+import glob
+import ipaddress
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = 'collect.lock'
+PROCESS_FILE = re.compile(r'([0-9]+)-[0-9a-f]+\.json')
+
+
+class Metric:
+    """A named family of values, one per combination of label values"""
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+
+class Counter(Metric):
+    """Monotonically increasing total"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the total for the label values"""
+        self.registry.update(self, self._key(labels), amount)
+
+    def empty(self):
+        return 0
+
+    def merge(self, value, amount):
+        return value + amount
+
+    def samples(self, key, value):
+        yield self.name, key, value
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Record one observation for the label values"""
+        counts = [0] * (len(self.buckets) + 1)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] = 1
+                break
+        else:
+            counts[-1] = 1
+        self.registry.update(self, self._key(labels), counts + [value])
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 2)
+
+    def merge(self, value, amount):
+        return [a + b for a, b in zip(value, amount)]
+
+    def samples(self, key, value):
+        cumulative = 0
+        bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, value):
+            cumulative += count
+            yield f'{self.name}_bucket', key + (('le', bound),), cumulative
+        yield f'{self.name}_sum', key, value[-1]
+        yield f'{self.name}_count', key, cumulative
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _running(pid):
+    """Return whether a process with the pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _dump(values):
+    return json.dumps({
+        name: [[list(key), value] for key, value in rows.items()]
+        for name, rows in values.items()
+    })
+
+
+def _write(path, data):
+    """Replace a file's content at once, so readers never see it partial"""
+    partial = f'{path}.partial'
+    with open(partial, 'w') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+class Registry:
+    """The metrics of this process, optionally shared through files"""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._file = None
+        self._values = {}
+        self._next_flush = 0
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), **kwargs):
+        return self._register(
+            Histogram(self, name, documentation, labels, **kwargs)
+        )
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Values and the file copied into a forked worker belong to
+            # its parent
+            self._reset()
+
+    def update(self, metric, key, amount):
+        """Merge amount into a metric's value for a key"""
+        with self._lock:
+            self._check_pid()
+            values = self._values.setdefault(metric.name, {})
+            values[key] = metric.merge(
+                values.get(key, metric.empty()),
+                amount
+            )
+            flush = self.directory and time.monotonic() >= self._next_flush
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to its file in the directory"""
+        with self._lock:
+            self._check_pid()
+            self._next_flush = time.monotonic() + self.flush_interval
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = os.path.join(
+                    self.directory,
+                    f'{self._pid}-{uuid.uuid4().hex}.json'
+                )
+            path, data = self._file, _dump(self._values)
+        _write(path, data)
+
+    def collect(self):
+        """Return {metric name: {label values: value}} for every process"""
+        if not self.directory:
+            with self._lock:
+                return {
+                    name: dict(values)
+                    for name, values in self._values.items()
+                }
+
+        self.flush()
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._archive_exited()
+            return self._sum(
+                glob.glob(os.path.join(self.directory, '*.json'))
+            )
+
+    def _archive_exited(self):
+        """Fold the files of exited processes into the archive file"""
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            match = PROCESS_FILE.fullmatch(os.path.basename(path))
+            if match and not _running(int(match.group(1))):
+                exited.append(path)
+        if not exited:
+            return
+
+        archive = os.path.join(self.directory, ARCHIVE_FILE)
+        _write(archive, _dump(self._sum([archive] + exited)))
+        for path in exited:
+            os.remove(path)
+
+    def _sum(self, paths):
+        """Return the values of the files at paths summed"""
+        totals = {}
+        for path in paths:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, rows in data.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                values = totals.setdefault(name, {})
+                for key, value in rows:
+                    key = tuple(key)
+                    values[key] = metric.merge(
+                        values.get(key, metric.empty()),
+                        value
+                    )
+        return totals
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        collected = self.collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(collected.get(name, {}).items()):
+                labeled = tuple(zip(metric.labels, key))
+                for sample, labels, number in metric.samples(labeled, value):
+                    label_text = ','.join(
+                        f'{label}="{_escape(str(v))}"' for label, v in labels
+                    )
+                    if label_text:
+                        sample = f'{sample}{{{label_text}}}'
+                    lines.append(f'{sample} {number}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(
+    directory=getattr(settings, 'METRICS_DIR', None),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+)
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds',
+    'API request latency by view and action.',
+    labels=('view', 'action')
+)
+requests_total = registry.counter(
+    'http_requests_total',
+    'API requests by view, action and response status.',
+    labels=('view', 'action', 'status')
+)
+request_queries = registry.histogram(
+    'http_request_db_queries',
+    'Database queries per API request by view and action.',
+    labels=('view', 'action'),
+    buckets=QUERY_BUCKETS
+)
+auth_cache_requests = registry.counter(
+    'auth_token_cache_requests_total',
+    'Auth token cache lookups by result.',
+    labels=('result',)
+)
+upload_bytes = registry.counter(
+    'upload_bytes_total',
+    'Bytes of gallery item images received by upload kind.',
+    labels=('kind',)
+)
+
+
+def endpoint(request):
+    """Return the (URL name, viewset action) a handled request went to"""
+    method = request.method.lower()
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched', method
+    actions = getattr(match.func, 'actions', None) or {}
+    return match.view_name, actions.get(method, method)
+
+
+def observe_request(request, response, request_metrics):
+    """Record the latency, status and queries of an API request"""
+    view, action = endpoint(request)
+    request_duration.observe(request_metrics.total, view=view, action=action)
+    request_queries.observe(request_metrics.queries, view=view, action=action)
+    requests_total.inc(view=view, action=action, status=response.status_code)
+
+
+def metrics_view(request):
+    """Serve the metrics of every process for Prometheus to scrape"""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return HttpResponseForbidden()
+    if not any(address in ipaddress.ip_network(ip) for ip in allowed):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
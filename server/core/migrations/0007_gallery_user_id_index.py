@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-18 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_galleryitem_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gallery',
+            index=models.Index(fields=['user', '-id'], name='core_galler_user_id_6fa3fd_idx'),
+        ),
+    ]
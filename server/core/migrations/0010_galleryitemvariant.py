@@ -0,0 +1,31 @@
+# Generated by Django 2.2 on 2026-10-18 02:07
+
+import core.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleryItemVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('format', models.CharField(max_length=8)),
+                ('image', models.ImageField(upload_to=core.models.gallery_item_variant_file_path)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('gallery_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='core.GalleryItem')),
+            ],
+            options={
+                'unique_together': {('gallery_item', 'name', 'format')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2 on 2026-10-18 02:12
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='galleryitem',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.GalleryItemImageStorage(), upload_to=core.models.gallery_item_image_file_path),
+        ),
+    ]
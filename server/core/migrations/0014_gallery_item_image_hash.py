@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_gallery_item_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='galleryitem',
+            name='image_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_gallery_item_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='galleryitem',
+            name='image_palette',
+            field=models.BinaryField(blank=True, default=b'', max_length=32),
+        ),
+    ]
@@ -1,11 +1,28 @@
+import hashlib
 import uuid
 import os
+from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.models import BaseUserManager
+from django.contrib.auth import hashers
 from django.conf import settings
+from django.utils import timezone
+
+from core import hashing
+from core.storage import gallery_item_image_storage
+
+
+GALLERY_ITEM_IMAGE_DIR = 'uploads/gallery-items/'
+GALLERY_ITEM_VARIANT_DIR = 'uploads/gallery-items/variants/'
+
+
+def fan_out_path(directory, filename):
+    """Return a path for filename two hash-prefixed levels below directory"""
+    digest = hashlib.md5(filename.encode()).hexdigest()
+    return os.path.join(directory, digest[:2], digest[2:4], filename)
 
 
 def gallery_item_image_file_path(instance, filename):
@@ -13,7 +30,7 @@ def gallery_item_image_file_path(instance, filename):
     ext = filename.split('.')[-1]
     filename = f'{uuid.uuid4()}.{ext}'
 
-    return os.path.join('uploads/gallery-items/', filename)
+    return fan_out_path(GALLERY_ITEM_IMAGE_DIR, filename)
 
 
 class UserManager(BaseUserManager):
@@ -48,6 +65,31 @@ class User(AbstractBaseUser, PermissionsMixin):
     objects = UserManager()
     USERNAME_FIELD = 'email'
 
+    def set_password(self, raw_password):
+        """Hash the password on the shared hashing pool"""
+        self.password = hashing.hashing_pool.run(
+            hashers.make_password, raw_password
+        )
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Check the password on the shared hashing pool"""
+        outdated = []
+        verified = hashing.hashing_pool.run(
+            hashers.check_password,
+            raw_password,
+            self.password,
+            outdated.append
+        )
+        if outdated:
+            # Re-hash with the current hasher outside the worker thread,
+            # as AbstractBaseUser.check_password does in its setter
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+
+        return verified
+
 
 class Tag(models.Model):
     """Tag to be used for a recipe"""
@@ -57,9 +99,22 @@ class Tag(models.Model):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-name', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not gallery_item_image_storage.content_addressed:
+            return super().save(*args, **kwargs)
+        # A new image's blob row stays locked from storing the file until
+        # post_save has taken its reference
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class GalleryItem(models.Model):
     """Description for a gallery item"""
@@ -70,12 +125,123 @@ class GalleryItem(models.Model):
         on_delete=models.CASCADE
     )
     image = models.ImageField(null=True,
-                              upload_to=gallery_item_image_file_path)
+                              upload_to=gallery_item_image_file_path,
+                              storage=gallery_item_image_storage)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_format = models.CharField(max_length=8, blank=True)
+    image_size = models.PositiveIntegerField(null=True, blank=True)
+    image_placeholder = models.TextField(blank=True)
+    image_hash = models.BigIntegerField(null=True, blank=True)
+    image_palette = models.BinaryField(max_length=32, blank=True, default=b'')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-name', 'id']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+def gallery_item_variant_dir(stem):
+    """Return the directory of the variants named stem-<variant>.<ext>"""
+    return os.path.dirname(fan_out_path(GALLERY_ITEM_VARIANT_DIR, stem))
+
+
+def gallery_item_variant_file_path(instance, filename):
+    """Generate file path for a gallery item image variant
+
+    Variants of one image share a stem and so a directory.
+    """
+    stem = filename.split('-', 1)[0]
+    return os.path.join(gallery_item_variant_dir(stem), filename)
+
+
+class ImageBlob(models.Model):
+    """Content addressed image file shared by gallery items"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    references = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
 
+class GalleryItemVariant(models.Model):
+    """Resized copy of a gallery item image"""
+    gallery_item = models.ForeignKey(
+        GalleryItem,
+        on_delete=models.CASCADE,
+        related_name='variants'
+    )
+    name = models.CharField(max_length=32)
+    format = models.CharField(max_length=8)
+    image = models.ImageField(upload_to=gallery_item_variant_file_path)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('gallery_item', 'name', 'format')
+
+    def __str__(self):
+        return f'{self.gallery_item_id} {self.name} {self.format}'
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload of a gallery item image"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    gallery_item = models.ForeignKey(GalleryItem, on_delete=models.CASCADE)
+    size = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def file_name(self):
+        """Storage name of the partially uploaded file"""
+        return os.path.join('uploads/sessions/', f'{self.id}.part')
+
+    @staticmethod
+    def expiry_cutoff():
+        """Return the creation time before which sessions have expired"""
+        return timezone.now() - timedelta(
+            seconds=getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 3600)
+        )
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ImportJob(models.Model):
+    """Bulk import of a user's library, committed in resumable chunks"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    records = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ImportedObject(models.Model):
+    """Object created by an import job, by its ID in the source data"""
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16)
+    external_id = models.CharField(max_length=255)
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('job', 'kind', 'external_id')
+
+
 class Gallery(models.Model):
     """Gallery for a user"""
     user = models.ForeignKey(
@@ -87,5 +253,26 @@ class Gallery(models.Model):
     gallery_items = models.ManyToManyField(GalleryItem)
     tags = models.ManyToManyField(Tag)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id']),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class RevokedToken(models.Model):
+    """Revocation of a signed token, or of every token issued to a user"""
+    # Kept after the user is deleted, so their unexpired tokens stay revoked
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+    jti = models.CharField(max_length=32, null=True, unique=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti or f'all tokens for {self.user_id}'
@@ -0,0 +1,162 @@
+"""Sampling profiler for API requests
+
+ProfilingMiddleware profiles one in PROFILING_SAMPLE_RATE API requests, and
+requests from staff users sending PROFILING_SECRET in an X-Profile header.
+A profiled request has a background thread read its stack every
+PROFILING_INTERVAL seconds, so the request itself runs untraced. The
+samples are written in the collapsed stack format flamegraph tools read,
+one file per request under a directory per view and action in
+PROFILING_DIR; the profiles command lists, merges and exports them.
+"""
+import glob
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.metrics import endpoint
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+SUFFIX = '.folded'
+
+
+def collapse(frame, root=None):
+    """Return the stack from root down to frame as module:function;..."""
+    names = []
+    while frame is not None and frame is not root:
+        module = frame.f_globals.get('__name__', '?')
+        names.append(f'{module}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """Count the stacks of a thread sampled at an interval"""
+
+    def __init__(self, interval, thread_id=None, root=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.root = root
+        self.stacks = Counter()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame, self.root)] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+
+
+def endpoint_name(view, action):
+    """Return the directory name of a view and action's profiles"""
+    return f'{view}.{action}'.replace(':', '.')
+
+
+def read_profile(path):
+    """Return the stack counts of a collapsed stack file"""
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def write_profile(path, stacks):
+    """Write stack counts to a collapsed stack file, busiest first"""
+    partial = f'{path}.partial'
+    with open(partial, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    os.replace(partial, path)
+
+
+def profile_files(directory):
+    """Return {endpoint: [profile paths]} for every profiled endpoint"""
+    profiles = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*', '*' + SUFFIX))):
+        name = os.path.basename(os.path.dirname(path))
+        profiles.setdefault(name, []).append(path)
+    return profiles
+
+
+def new_profile_path(directory, name):
+    """Return an unused path for a profile of an endpoint"""
+    directory = os.path.join(directory, name)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(
+        directory,
+        f'{int(time.time())}-{os.getpid()}-{uuid.uuid4().hex}{SUFFIX}'
+    )
+
+
+class ProfilingMiddleware:
+    """Profile sampled and requested API requests into PROFILING_DIR
+
+    Only paths under REQUEST_METRICS_PATHS are profiled. Whether the user
+    is staff is only known once DRF has authenticated them, so the header
+    must also carry PROFILING_SECRET before a sampler is started for it,
+    and the samples are dropped for other users.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.directory = getattr(settings, 'PROFILING_DIR', None)
+        if not self.directory:
+            raise MiddlewareNotUsed
+        self.rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.interval = getattr(settings, 'PROFILING_INTERVAL', 0.005)
+        secret = getattr(settings, 'PROFILING_SECRET', None)
+        self.secret = secret.encode() if secret else None
+        self.paths = tuple(getattr(
+            settings, 'REQUEST_METRICS_PATHS', ('/api/',)
+        ))
+
+    def _requested(self, request):
+        """Return whether the request's X-Profile header has the secret"""
+        value = request.META.get(PROFILE_HEADER)
+        return self.secret is not None and value is not None and \
+            hmac.compare_digest(value.encode(), self.secret)
+
+    def __call__(self, request):
+        requested = self._requested(request)
+        sampled = self.rate > 0 and random.randrange(self.rate) == 0
+        if not (requested or sampled) or \
+                not request.path_info.startswith(self.paths):
+            return self.get_response(request)
+
+        with Sampler(self.interval, root=sys._getframe()) as sampler:
+            response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        staff = user is not None and user.is_staff
+        if not sampled and not staff:
+            return response
+        if requested and staff:
+            response['X-Profile-Samples'] = sum(sampler.stacks.values())
+        if sampler.stacks:
+            write_profile(
+                new_profile_path(self.directory, endpoint_name(
+                    *endpoint(request)
+                )),
+                sampler.stacks
+            )
+        return response
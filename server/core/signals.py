@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.models import GalleryItem
+from core.storage import gallery_item_image_storage as storage
+
+
+def _tracks_image(update_fields):
+    return storage.content_addressed and (
+        update_fields is None or 'image' in update_fields
+    )
+
+
+@receiver(pre_save, sender=GalleryItem)
+def remember_image_blob(sender, instance, update_fields, **kwargs):
+    """Note a gallery item's stored image name before it is saved"""
+    if not _tracks_image(update_fields) or instance.pk is None:
+        return
+    instance._stored_image_name = GalleryItem.objects.filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=GalleryItem)
+def track_image_blob_references(sender, instance, update_fields, **kwargs):
+    """Move a blob reference when a gallery item's image changes"""
+    if not _tracks_image(update_fields):
+        return
+    old_name = instance.__dict__.pop('_stored_image_name', None)
+    new_name = instance.image.name
+    if old_name == new_name:
+        return
+
+    if storage.is_blob(new_name):
+        storage.acquire(new_name)
+    if storage.is_blob(old_name):
+        storage.release(old_name)
+
+
+@receiver(post_delete, sender=GalleryItem)
+def release_image_blob(sender, instance, **kwargs):
+    """Drop the blob reference of a deleted gallery item"""
+    if storage.is_blob(instance.image.name):
+        storage.release(instance.image.name)
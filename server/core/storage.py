@@ -0,0 +1,147 @@
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class GalleryItemImageStorage(FileSystemStorage):
+    """Storage for gallery item images
+
+    With GALLERY_ITEM_IMAGE_STORAGE set to 'content-addressed', each file is
+    hashed as it is written and stored once under its SHA-256 digest, so
+    identical uploads share one immutable blob. Blobs are reference counted
+    through ImageBlob rows and deleted once the last reference has gone,
+    with the row locked whenever a blob file is placed or deleted.
+
+    Storing a blob takes no reference: the gallery item saved with it takes
+    one, in the same transaction that placed the file so the row stays
+    locked until then.
+    """
+    blob_dir = 'blobs'
+
+    @property
+    def content_addressed(self):
+        mode = getattr(settings, 'GALLERY_ITEM_IMAGE_STORAGE', 'default')
+        return mode == 'content-addressed'
+
+    def is_blob(self, name):
+        """Return True if name is a content addressed blob"""
+        return bool(name) and name.startswith(f'{self.blob_dir}/')
+
+    def get_available_name(self, name, max_length=None):
+        if self.content_addressed:
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not self.content_addressed:
+            return super()._save(name, content)
+
+        temp_dir = self.path(os.path.join(self.blob_dir, 'tmp'))
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        digest = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                f.write(chunk)
+
+        ext = os.path.splitext(name)[1].lower()
+        return self._store_blob(temp_path, digest.hexdigest(), ext)
+
+    def ingest(self, path, name):
+        """Move a file already on this volume into storage as name
+
+        In content addressed mode the file is hashed in place and renamed
+        to its blob name instead, so the name should be saved to a gallery
+        item in the same transaction. Returns the stored name.
+        """
+        if not self.content_addressed:
+            dest = self.path(name)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(path, dest)
+            return name
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        ext = os.path.splitext(name)[1].lower()
+        return self._store_blob(path, digest.hexdigest(), ext)
+
+    def _store_blob(self, path, digest, ext):
+        """Rename path to the blob for digest, creating its row if needed
+
+        The blob row is locked while the file is placed, so a concurrent
+        release of the same blob cannot delete the file in between.
+        """
+        name = '/'.join((self.blob_dir, digest[:2], digest[2:4], digest + ext))
+        dest = self.path(name)
+        size = os.path.getsize(path)
+
+        ImageBlob = apps.get_model('core', 'ImageBlob')
+        with transaction.atomic():
+            ImageBlob.objects.select_for_update().get_or_create(
+                name=name,
+                defaults={'size': size}
+            )
+            if os.path.exists(dest):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(path, dest)
+
+        return name
+
+    def acquire(self, name):
+        """Add a reference to a blob"""
+        ImageBlob = apps.get_model('core', 'ImageBlob')
+        ImageBlob.objects.filter(name=name).update(
+            references=F('references') + 1
+        )
+
+    def release(self, name):
+        """Drop a reference to a blob, deleting it with the last one"""
+        ImageBlob = apps.get_model('core', 'ImageBlob')
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(
+                name=name
+            ).first()
+            if blob is None:
+                return
+            blob.references = max(0, blob.references - 1)
+            blob.save(update_fields=['references'])
+            if not blob.references:
+                transaction.on_commit(lambda: self.collect_blob(name))
+
+    def collect_blob(self, name):
+        """Delete a blob if nothing refers to it, returning True if deleted
+
+        The row is locked while the file is deleted, so a blob stored again
+        in the meantime is kept.
+        """
+        ImageBlob = apps.get_model('core', 'ImageBlob')
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(
+                name=name
+            ).first()
+            if blob is not None and blob.references:
+                return False
+            self.delete(name)
+            if blob is not None:
+                blob.delete()
+        return True
+
+
+gallery_item_image_storage = GalleryItemImageStorage()
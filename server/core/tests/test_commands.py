@@ -1,8 +1,21 @@
+import os
+import time
+from datetime import timedelta
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import (
+    GalleryItem, GalleryItemVariant, ImageBlob, UploadSession, fan_out_path,
+    gallery_item_variant_file_path
+)
 
 
 class CommandTests(TestCase):
@@ -21,3 +34,219 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class FanOutGalleryImagesTests(TestCase):
+    """Test moving gallery item images into the fan-out layout"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.items = []
+        for i in range(3):
+            name = default_storage.save(
+                f'uploads/gallery-items/image-{i}.jpg',
+                ContentFile(b'image')
+            )
+            self.items.append(GalleryItem.objects.create(
+                user=self.user,
+                image=name
+            ))
+
+    def tearDown(self):
+        for variant in GalleryItemVariant.objects.all():
+            variant.image.delete()
+        for item in GalleryItem.objects.all():
+            item.image.delete()
+
+    def call_command(self):
+        call_command(
+            'fan_out_gallery_images',
+            batch_size=2,
+            workers=2,
+            stdout=StringIO()
+        )
+
+    def test_images_moved(self):
+        """Test that images and their names are moved together"""
+        self.call_command()
+
+        for item in self.items:
+            old_path = item.image.path
+            item.refresh_from_db()
+            self.assertEqual(item.image.name, fan_out_path(
+                'uploads/gallery-items/',
+                os.path.basename(old_path)
+            ))
+            self.assertTrue(os.path.exists(item.image.path))
+            self.assertFalse(os.path.exists(old_path))
+
+    def test_resumes_after_interruption(self):
+        """Test that files moved before an item was renamed are picked up"""
+        item = self.items[0]
+        new_name = fan_out_path(
+            'uploads/gallery-items/',
+            os.path.basename(item.image.name)
+        )
+        os.makedirs(
+            os.path.dirname(default_storage.path(new_name)),
+            exist_ok=True
+        )
+        os.replace(item.image.path, default_storage.path(new_name))
+
+        self.call_command()
+        self.call_command()
+
+        item.refresh_from_db()
+        self.assertEqual(item.image.name, new_name)
+        self.assertFalse(GalleryItem.objects.filter(
+            image__regex=r'^uploads/gallery-items/[^/]+$'
+        ).exists())
+
+    def test_variants_moved(self):
+        """Test that variants move into their image's fan-out directory"""
+        variants = []
+        for i, name in enumerate(('small', 'large')):
+            filename = f'{"ab" * 16}-{name}.webp'
+            variants.append(GalleryItemVariant.objects.create(
+                gallery_item=self.items[0],
+                name=name,
+                format='webp',
+                image=default_storage.save(
+                    f'uploads/gallery-items/variants/{filename}',
+                    ContentFile(b'variant')
+                ),
+                width=i + 1,
+                height=i + 1,
+                size=7
+            ))
+
+        self.call_command()
+
+        for variant in variants:
+            old_path = variant.image.path
+            variant.refresh_from_db()
+            self.assertEqual(
+                variant.image.name,
+                gallery_item_variant_file_path(
+                    None, os.path.basename(old_path)
+                )
+            )
+            self.assertTrue(os.path.exists(variant.image.path))
+            self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(
+            os.path.dirname(variants[0].image.name),
+            os.path.dirname(variants[1].image.name)
+        )
+
+
+class CollectOrphanedMediaTests(TestCase):
+    """Test deleting media files nothing refers to"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.item = GalleryItem.objects.create(
+            user=self.user,
+            image=self.save_file('uploads/gallery-items/kept.jpg')
+        )
+        self.session = UploadSession.objects.create(
+            user=self.user,
+            gallery_item=self.item,
+            size=10
+        )
+        self.save_file(self.session.file_name)
+        self.orphan = self.save_file('uploads/gallery-items/orphan.jpg')
+        self.recent = self.save_file(
+            'uploads/gallery-items/recent.jpg',
+            age=0
+        )
+
+    def tearDown(self):
+        for name in (
+            self.item.image.name,
+            self.session.file_name,
+            self.orphan,
+            self.recent
+        ):
+            default_storage.delete(name)
+
+    def save_file(self, name, age=2 * 24 * 3600):
+        """Save a file to media storage, last modified age seconds ago"""
+        name = default_storage.save(name, ContentFile(b'image'))
+        mtime = time.time() - age
+        os.utime(default_storage.path(name), (mtime, mtime))
+        return name
+
+    def call_command(self, **options):
+        call_command(
+            'collect_orphaned_media',
+            grace_hours=1,
+            stdout=StringIO(),
+            **options
+        )
+
+    def test_orphans_deleted(self):
+        """Test that only old unreferenced files are deleted"""
+        self.call_command(batch_size=1)
+
+        self.assertFalse(default_storage.exists(self.orphan))
+        self.assertTrue(default_storage.exists(self.recent))
+        self.assertTrue(default_storage.exists(self.item.image.name))
+        self.assertTrue(default_storage.exists(self.session.file_name))
+
+    def test_null_image_ignored(self):
+        """Test that items without an image do not stop the collection"""
+        item = GalleryItem.objects.create(user=self.user)
+        # Saving a model stores an empty image as '', so set NULL directly
+        GalleryItem.objects.filter(id=item.id).update(image=None)
+
+        self.call_command()
+
+        self.assertFalse(default_storage.exists(self.orphan))
+        self.assertTrue(default_storage.exists(self.item.image.name))
+
+    def test_dry_run(self):
+        """Test that a dry run deletes nothing"""
+        self.call_command(dry_run=True)
+
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_referenced_during_walk_kept(self):
+        """Test that a file referenced after names were loaded is kept"""
+        command = 'core.management.commands.collect_orphaned_media.Command'
+        with patch(f'{command}._referenced_keys', return_value=set()):
+            self.call_command()
+
+        self.assertTrue(default_storage.exists(self.item.image.name))
+        self.assertTrue(default_storage.exists(self.session.file_name))
+        self.assertFalse(default_storage.exists(self.orphan))
+
+    @override_settings(UPLOAD_SESSION_TTL=3600)
+    def test_expired_session_file_deleted(self):
+        """Test that partial files of expired upload sessions are orphans"""
+        UploadSession.objects.filter(id=self.session.id).update(
+            created=timezone.now() - timedelta(hours=2)
+        )
+
+        self.call_command()
+
+        self.assertFalse(default_storage.exists(self.session.file_name))
+
+    def test_unreferenced_blob_deleted(self):
+        """Test that blobs left without references are collected"""
+        unused = self.save_file('blobs/ab/cd/unused.jpg')
+        used = self.save_file('blobs/ab/cd/used.jpg')
+        ImageBlob.objects.create(name=unused, size=5, references=0)
+        ImageBlob.objects.create(name=used, size=5, references=1)
+        self.addCleanup(default_storage.delete, used)
+
+        self.call_command()
+
+        self.assertFalse(default_storage.exists(unused))
+        self.assertFalse(ImageBlob.objects.filter(name=unused).exists())
+        self.assertTrue(default_storage.exists(used))
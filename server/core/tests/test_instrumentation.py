@@ -0,0 +1,64 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+
+from core.models import Tag
+
+
+TAGS_URL = reverse('gallery:tag-list')
+
+SERVER_TIMING = re.compile(
+    r'^db;dur=[\d.]+;desc="(\d+) queries", serialize;dur=[\d.]+, '
+    r'view;dur=[\d.]+, total;dur=[\d.]+$'
+)
+
+
+class RequestMetricsTests(TestCase):
+    """Test per-request timing instrumentation"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Tag')
+
+    def test_server_timing_header(self):
+        """Test that API responses report their query count and timings"""
+        with self.assertLogs('core.instrumentation', 'INFO') as logs:
+            with self.assertNumQueries(1):
+                res = self.client.get(TAGS_URL)
+
+        match = SERVER_TIMING.match(res['Server-Timing'])
+        self.assertIsNotNone(match)
+        self.assertEqual(match.group(1), '1')
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(record.path, TAGS_URL)
+        self.assertEqual(record.status, 200)
+        self.assertEqual(record.queries, 1)
+        self.assertGreater(record.serialize_ms, 0)
+
+    def test_serializers_not_patched(self):
+        """Test that serializer time is taken without patching DRF"""
+        with self.assertLogs('core.instrumentation', 'INFO') as logs:
+            self.client.get(reverse('user:me'))
+
+        self.assertEqual(
+            BaseSerializer.data.fget.__module__,
+            BaseSerializer.__module__
+        )
+        self.assertGreater(logs.records[0].serialize_ms, 0)
+
+    def test_other_paths_not_instrumented(self):
+        """Test that paths outside the API are skipped"""
+        res = self.client.get('/admin/login/')
+
+        self.assertFalse(res.has_header('Server-Timing'))
@@ -0,0 +1,158 @@
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.metrics import Registry
+
+
+def sample_registry(directory=None):
+    """Return a registry with a counter and a histogram"""
+    registry = Registry(directory=directory, flush_interval=0)
+    counter = registry.counter('jobs_total', 'Jobs.', labels=('kind',))
+    histogram = registry.histogram(
+        'job_seconds',
+        'Job time.',
+        buckets=(0.1, 1)
+    )
+    return registry, counter, histogram
+
+
+class RegistryTests(SimpleTestCase):
+    """Test the metrics registry"""
+
+    def test_render(self):
+        """Test rendering counters and histograms in text format"""
+        registry, counter, histogram = sample_registry()
+        counter.inc(kind='a"b')
+        counter.inc(2, kind='a"b')
+        histogram.observe(0.05)
+        histogram.observe(5)
+
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP job_seconds Job time.',
+            '# TYPE job_seconds histogram',
+            'job_seconds_bucket{le="0.1"} 1',
+            'job_seconds_bucket{le="1.0"} 1',
+            'job_seconds_bucket{le="+Inf"} 2',
+            'job_seconds_sum 5.05',
+            'job_seconds_count 2',
+            '# HELP jobs_total Jobs.',
+            '# TYPE jobs_total counter',
+            'jobs_total{kind="a\\"b"} 3',
+        ]) + '\n')
+
+    def test_processes_aggregated(self):
+        """Test that registries sharing a directory sum their values"""
+        with tempfile.TemporaryDirectory() as directory:
+            first, first_counter, _ = sample_registry(directory)
+            second, second_counter, _ = sample_registry(directory)
+            first_counter.inc(kind='a')
+            second_counter.inc(2, kind='a')
+            second_counter.inc(kind='b')
+
+            collected = first.collect()
+
+        self.assertEqual(
+            collected['jobs_total'],
+            {('a',): 3, ('b',): 1}
+        )
+
+    def test_forked_process_starts_empty(self):
+        """Test that a forked worker does not repeat its parent's values"""
+        registry, counter, _ = sample_registry()
+        counter.inc(kind='a')
+
+        with patch('os.getpid', return_value=-1):
+            counter.inc(kind='b')
+            collected = registry.collect()
+
+        self.assertEqual(collected['jobs_total'], {('b',): 1})
+
+    def test_forked_process_flushes_own_file(self):
+        """Test that a forked worker does not overwrite its parent's file"""
+        with tempfile.TemporaryDirectory() as directory:
+            registry, counter, _ = sample_registry(directory)
+            counter.inc(kind='a')
+            parent_files = glob.glob(os.path.join(directory, '*.json'))
+
+            with patch('os.getpid', return_value=os.getpid() + 1):
+                registry.flush()
+            child_files = set(
+                glob.glob(os.path.join(directory, '*.json'))
+            ) - set(parent_files)
+            collected = registry.collect()
+
+        self.assertEqual(len(child_files), 1)
+        self.assertTrue(os.path.basename(child_files.pop()).startswith(
+            f'{os.getpid() + 1}-'
+        ))
+        self.assertEqual(collected['jobs_total'], {('a',): 1})
+
+    def test_exited_processes_archived(self):
+        """Test that files of exited processes are folded into one file"""
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+
+        with tempfile.TemporaryDirectory() as directory:
+            for amount in (1, 2):
+                with patch('os.getpid', return_value=exited.pid):
+                    _, old_counter, _ = sample_registry(directory)
+                    old_counter.inc(amount, kind='a')
+            registry, counter, _ = sample_registry(directory)
+            counter.inc(kind='b')
+
+            first = registry.collect()
+            second = registry.collect()
+            files = sorted(
+                os.path.basename(path)
+                for path in glob.glob(os.path.join(directory, '*.json'))
+            )
+
+        self.assertEqual(first['jobs_total'], {('a',): 3, ('b',): 1})
+        self.assertEqual(second, first)
+        self.assertEqual(len(files), 2)
+        self.assertIn('archive.json', files)
+
+
+class MetricsEndpointTests(TestCase):
+    """Test the metrics endpoint"""
+
+    def test_api_requests_counted(self):
+        """Test that API requests are counted by view and action"""
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        client.force_authenticate(user)
+        client.get(reverse('gallery:tag-list'))
+
+        res = self.client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        self.assertIn(
+            'http_requests_total{view="gallery:tag-list",action="list",'
+            'status="200"}',
+            res.content.decode()
+        )
+
+    def test_other_addresses_forbidden(self):
+        """Test that only allowed addresses can scrape the metrics"""
+        res = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+
+        self.assertEqual(res.status_code, 403)
+
+        with override_settings(METRICS_ALLOWED_IPS=('10.0.0.0/8',)):
+            res = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+
+        self.assertEqual(res.status_code, 200)
@@ -1,7 +1,7 @@
 from unittest.mock import patch
 
-from django.test import TestCase
-from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model, hashers
 
 from core import models
 
@@ -79,5 +79,30 @@ class ModelTests(TestCase):
         mock_uuid.return_value = uuid
         file_path = models.gallery_item_image_file_path(None, 'myimage.jpg')
 
-        exp_path = f'uploads/gallery-items/{uuid}.jpg'
+        exp_path = models.fan_out_path(
+            'uploads/gallery-items/',
+            f'{uuid}.jpg'
+        )
         self.assertEqual(file_path, exp_path)
+        self.assertRegex(
+            file_path,
+            rf'^uploads/gallery-items/[0-9a-f]{{2}}/[0-9a-f]{{2}}/{uuid}\.jpg$'
+        )
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.SHA1PasswordHasher',
+    ])
+    def test_password_rehashed_when_outdated(self):
+        """Test an outdated password hash is upgraded on a successful check"""
+        user = sample_user()
+        user.password = hashers.make_password(
+            'testpass',
+            hasher='sha1'
+        )
+        user.save()
+
+        self.assertTrue(user.check_password('testpass'))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256'))
+        self.assertTrue(user.check_password('testpass'))
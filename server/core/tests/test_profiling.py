@@ -0,0 +1,189 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core import profiling
+
+
+TAGS_URL = reverse('gallery:tag-list')
+
+render = JSONRenderer.render
+
+
+def slow_render(renderer, *args, **kwargs):
+    """Render slowly enough to be sampled"""
+    time.sleep(0.05)
+    return render(renderer, *args, **kwargs)
+
+
+def busy():
+    time.sleep(0.05)
+
+
+class SamplerTests(SimpleTestCase):
+    """Test the stack sampler"""
+
+    def test_samples_below_root(self):
+        """Test that stacks are collapsed from below the root frame"""
+        with profiling.Sampler(0.001, root=sys._getframe()) as sampler:
+            busy()
+
+        self.assertGreater(sampler.stacks[f'{__name__}:busy'], 0)
+
+    def test_read_write_profile(self):
+        """Test that collapsed stack files round trip"""
+        stacks = Counter({'a:f;b:g': 3, 'a:f': 1})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'p.folded')
+            profiling.write_profile(path, stacks)
+
+            self.assertEqual(profiling.read_profile(path), stacks)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Test profiling API requests"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(
+            PROFILING_DIR=self.directory,
+            PROFILING_INTERVAL=0.001,
+            PROFILING_SECRET='secret'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = patch.object(
+            JSONRenderer, 'render', autospec=True, side_effect=slow_render
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_staff_header_profiles(self):
+        """Test that staff users can ask for a request to be profiled"""
+        self.user.is_staff = True
+        self.user.save()
+
+        res = self.client.get(TAGS_URL, HTTP_X_PROFILE='secret')
+
+        self.assertGreater(int(res['X-Profile-Samples']), 0)
+        profiles = profiling.profile_files(self.directory)
+        self.assertEqual(list(profiles), ['gallery.tag-list.list'])
+        stacks = profiling.read_profile(profiles['gallery.tag-list.list'][0])
+        self.assertTrue(any(
+            stack.endswith(f'{__name__}:slow_render') for stack in stacks
+        ))
+
+    def test_header_ignored_for_other_users(self):
+        """Test that the header does not profile non-staff requests"""
+        res = self.client.get(TAGS_URL, HTTP_X_PROFILE='secret')
+
+        self.assertFalse(res.has_header('X-Profile-Samples'))
+        self.assertEqual(profiling.profile_files(self.directory), {})
+
+    def test_header_without_secret_not_sampled(self):
+        """Test that no sampler starts for a header without the secret"""
+        self.user.is_staff = True
+        self.user.save()
+
+        with patch('core.profiling.Sampler') as sampler:
+            APIClient().get(TAGS_URL, HTTP_X_PROFILE='1')
+            self.client.get(TAGS_URL, HTTP_X_PROFILE='secre')
+            with override_settings(PROFILING_SECRET=None):
+                client = APIClient()
+                client.force_authenticate(self.user)
+                client.get(TAGS_URL, HTTP_X_PROFILE='')
+
+        sampler.assert_not_called()
+
+    def test_sampled_requests_profiled(self):
+        """Test that one in PROFILING_SAMPLE_RATE requests is profiled"""
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            res = APIClient().get(TAGS_URL)
+
+        self.assertFalse(res.has_header('X-Profile-Samples'))
+        self.assertEqual(
+            list(profiling.profile_files(self.directory)),
+            ['gallery.tag-list.list']
+        )
+
+    def test_unsampled_requests_not_profiled(self):
+        """Test that requests are only profiled when sampled or asked"""
+        self.client.get(TAGS_URL)
+
+        self.assertEqual(profiling.profile_files(self.directory), {})
+
+
+class ProfilesCommandTests(SimpleTestCase):
+    """Test the profiles command"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(PROFILING_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name, stacks in (
+            ('gallery.tag-list.list', {'a:f;b:g': 2}),
+            ('gallery.tag-list.list', {'a:f;b:g': 1, 'a:f': 1}),
+            ('gallery.gallery-list.list', {'a:h': 5}),
+        ):
+            profiling.write_profile(
+                profiling.new_profile_path(self.directory, name),
+                Counter(stacks)
+            )
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('profiles', *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_list(self):
+        """Test listing profile and sample counts per endpoint"""
+        self.assertEqual(self.call('list'), [
+            'gallery.gallery-list.list profiles=1 samples=5',
+            'gallery.tag-list.list profiles=2 samples=4',
+        ])
+
+    def test_merge(self):
+        """Test merging each endpoint's profiles into one"""
+        self.call('merge')
+
+        profiles = profiling.profile_files(self.directory)
+        self.assertEqual(len(profiles['gallery.tag-list.list']), 1)
+        self.assertEqual(
+            profiling.read_profile(profiles['gallery.tag-list.list'][0]),
+            {'a:f;b:g': 3, 'a:f': 1}
+        )
+
+    def test_export(self):
+        """Test exporting one endpoint, or all prefixed by endpoint"""
+        self.assertEqual(
+            self.call('export', 'gallery.tag-list.list'),
+            ['a:f;b:g 3', 'a:f 1']
+        )
+        self.assertEqual(self.call('export'), [
+            'gallery.gallery-list.list;a:h 5',
+            'gallery.tag-list.list;a:f;b:g 3',
+            'gallery.tag-list.list;a:f 1',
+        ])
@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import watchdog
+from core.instrumentation import RequestMetrics
+from core.models import Tag
+
+
+TAGS_URL = reverse('gallery:tag-list')
+
+
+class BudgetTests(TestCase):
+    """Test looking up query budgets"""
+
+    @override_settings(QUERY_BUDGETS={
+        'default': {'queries': 10},
+        'gallery:tag-list': {'queries': 5, 'db_time': 0.5},
+        'gallery:tag-list.create': {'queries': 3},
+    })
+    def test_most_specific_budget_used(self):
+        """Test that action budgets win over view and default budgets"""
+        self.assertEqual(
+            watchdog.budget('gallery:tag-list', 'create'),
+            (3, None)
+        )
+        self.assertEqual(
+            watchdog.budget('gallery:tag-list', 'list'),
+            (5, 0.5)
+        )
+        self.assertEqual(watchdog.budget('user:me', 'get'), (10, None))
+
+    @override_settings(QUERY_BUDGETS={})
+    def test_no_budget(self):
+        """Test that endpoints without a budget are unlimited"""
+        self.assertEqual(watchdog.budget('user:me', 'get'), (None, None))
+
+
+class WatchdogTests(TestCase):
+    """Test slow query logging and budget checks on API requests"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Tag')
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_query_logged_with_plan(self):
+        """Test that slow queries are logged with their plan and view"""
+        with self.assertLogs('core.watchdog', 'WARNING') as logs:
+            self.client.get(TAGS_URL)
+
+        record = logs.records[0]
+        self.assertEqual(record.view, 'gallery:tag-list')
+        self.assertEqual(record.action, 'list')
+        self.assertIn('core_tag', record.sql)
+        plan = record.getMessage().split('\n')[-1]
+        self.assertNotEqual(plan, 'None')
+
+    def test_slow_query_explained_after_response(self):
+        """Test that plans are only fetched once the request has finished"""
+        metrics = RequestMetrics()
+        metrics.slow_queries.append(('default', 'SELECT 1', (), 1.0))
+
+        with patch('core.watchdog.endpoint', return_value=('view', 'list')), \
+                patch('core.watchdog.explain', return_value='Plan') as explain:
+            watchdog.inspect(None, metrics)
+            explain.assert_not_called()
+
+            with self.assertLogs('core.watchdog', 'WARNING') as logs:
+                request_finished.send(sender=None)
+            request_finished.send(sender=None)
+
+        explain.assert_called_once_with('default', 'SELECT 1', ())
+        self.assertTrue(logs.output[0].endswith('Plan'))
+
+    @override_settings(
+        QUERY_BUDGETS={'gallery:tag-list': {'queries': 0}},
+        QUERY_BUDGETS_STRICT=True
+    )
+    def test_budget_fails_when_strict(self):
+        """Test that going over budget raises when budgets are strict"""
+        with self.assertRaises(watchdog.QueryBudgetExceeded):
+            self.client.get(TAGS_URL)
+
+    @override_settings(
+        QUERY_BUDGETS={'gallery:tag-list': {'queries': 0, 'db_time': 0}},
+        QUERY_BUDGETS_STRICT=False
+    )
+    def test_budget_logged(self):
+        """Test that going over budget is logged when not strict"""
+        with self.assertLogs('core.watchdog', 'WARNING') as logs:
+            res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('over query budget', logs.output[0])
+
+    @override_settings(QUERY_BUDGETS_STRICT=True)
+    def test_only_query_count_strict(self):
+        """Test that DB time overruns are logged even when strict"""
+        with override_settings(
+            QUERY_BUDGETS={'gallery:tag-list': {'db_time': 0}}
+        ):
+            with self.assertLogs('core.watchdog', 'WARNING'):
+                res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, 200)
@@ -0,0 +1,140 @@
+"""Slow query plans and per-endpoint query budgets for API requests
+
+RequestMetricsMiddleware hands each request's metrics to inspect(). Queries
+slower than SLOW_QUERY_THRESHOLD seconds are logged with their plan and the
+view that issued them once the response has been sent, and requests over
+their endpoint's QUERY_BUDGETS entry are logged. Where budgets are strict,
+as under the test runner, going over the query count raises
+QueryBudgetExceeded instead.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, connections
+from django.dispatch import receiver
+from django.test.runner import DiscoverRunner
+
+from core.metrics import endpoint
+
+
+logger = logging.getLogger(__name__)
+
+# Slow queries of the thread's request waiting for it to finish
+_slow = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request made more or slower queries than its endpoint allows"""
+
+
+def budget(view, action):
+    """Return the (queries, db seconds) budget of a view and action
+
+    QUERY_BUDGETS is keyed by 'view name.action', view name or 'default'
+    and either limit may be None.
+    """
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    for key in (f'{view}.{action}', view, 'default'):
+        if key in budgets:
+            limits = budgets[key]
+            return limits.get('queries'), limits.get('db_time')
+    return None, None
+
+
+def explain(alias, sql, params):
+    """Return the plan of a SELECT as text, without running it"""
+    if not sql.lstrip()[:6].upper() == 'SELECT':
+        return None
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+    except DatabaseError:
+        return None
+
+
+@receiver(request_finished)
+def log_slow_queries(**kwargs):
+    """Log the slow queries of the finished request with their plans"""
+    queries = getattr(_slow, 'queries', None)
+    if not queries:
+        return
+    _slow.queries = []
+
+    # The request may already have closed connections it does not keep
+    closed = {
+        alias for _, _, (alias, *_) in queries
+        if connections[alias].connection is None
+    }
+    for view, action, (alias, sql, params, duration) in queries:
+        logger.warning(
+            'Slow query view=%s action=%s db_ms=%.1f\n%s\n%s',
+            view,
+            action,
+            duration * 1000,
+            sql,
+            explain(alias, sql, params),
+            extra={
+                'view': view,
+                'action': action,
+                'db_ms': duration * 1000,
+                'sql': sql,
+            }
+        )
+    for alias in closed:
+        connections[alias].close()
+
+
+def inspect(request, request_metrics):
+    """Queue the slow queries of a request and check its query budget
+
+    Explaining a slow query takes another round trip, so the queries are
+    logged by log_slow_queries() once the response has been sent.
+    """
+    view, action = endpoint(request)
+    if request_metrics.slow_queries:
+        if not hasattr(_slow, 'queries'):
+            _slow.queries = []
+        _slow.queries.extend(
+            (view, action, query) for query in request_metrics.slow_queries
+        )
+
+    max_queries, max_db_time = budget(view, action)
+    over_count = max_queries is not None and \
+        request_metrics.queries > max_queries
+    over_time = max_db_time is not None and \
+        request_metrics.db > max_db_time
+    if not (over_count or over_time):
+        return
+
+    exceeded = []
+    if over_count:
+        exceeded.append(f'{request_metrics.queries} queries > {max_queries}')
+    if over_time:
+        exceeded.append(f'{request_metrics.db:.3f}s db > {max_db_time}s')
+    message = f'{view} {action} over query budget: {", ".join(exceeded)}'
+    # Test database timings say little about production, so only the
+    # query count is enforced
+    if over_count and getattr(settings, 'QUERY_BUDGETS_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message, extra={'view': view, 'action': action})
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner failing requests that exceed their query budget"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._strict = getattr(settings, 'QUERY_BUDGETS_STRICT', False)
+        settings.QUERY_BUDGETS_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_BUDGETS_STRICT = self._strict
+        super().teardown_test_environment(**kwargs)
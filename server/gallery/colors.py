@@ -0,0 +1,125 @@
+import threading
+
+import numpy as np
+
+from django.conf import settings
+
+from core.models import GalleryItem
+
+from gallery.imaging import PALETTE_SIZE
+from gallery.similarity import UserIndexes
+
+
+# Palette colours covering less of an image than this are not matched
+MIN_SHARE = getattr(settings, 'COLOR_MIN_SHARE', 0.05) * 255
+
+RGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+], dtype=np.float32)
+D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+
+def rgb_to_lab(rgb):
+    """Convert an array of sRGB colours in 0-255 to CIELAB"""
+    linear = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(
+        linear > 0.04045,
+        ((linear + 0.055) / 1.055) ** 2.4,
+        linear / 12.92
+    )
+    xyz = linear @ RGB_TO_XYZ.T / D65_WHITE
+    f = np.where(
+        xyz > (6 / 29) ** 3,
+        np.cbrt(xyz),
+        xyz / (3 * (6 / 29) ** 2) + 4 / 29
+    )
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def parse_hex(color):
+    """Return the (r, g, b) of a #rrggbb colour"""
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+class PaletteIndex:
+    """Palettes of one user's gallery items as CIELAB arrays
+
+    Rows are kept in arrays that grow by doubling, so a search is a few
+    vectorized operations over every item. A removed item leaves a row
+    with ID -1 behind.
+    """
+
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._ids = np.empty(0, dtype=np.int64)
+        self._labs = np.empty((0, PALETTE_SIZE, 3), dtype=np.float32)
+        self._valid = np.empty((0, PALETTE_SIZE), dtype=bool)
+        self._size = 0
+        self._lock = threading.Lock()
+        for item_id, palette in rows:
+            self.set(item_id, palette)
+
+    def set(self, item_id, palette):
+        """Record an item's packed palette, empty or None removing it"""
+        with self._lock:
+            row = self._rows.pop(item_id, None)
+            if row is not None:
+                self._ids[row] = -1
+            if not palette:
+                return
+
+            entries = np.frombuffer(bytes(palette), dtype=np.uint8)
+            entries = entries.reshape(-1, 4)[:PALETTE_SIZE]
+            if row is None:
+                row = self._append()
+            self._ids[row] = item_id
+            self._labs[row, :len(entries)] = rgb_to_lab(entries[:, :3])
+            self._valid[row] = False
+            self._valid[row, :len(entries)] = entries[:, 3] >= MIN_SHARE
+            self._rows[item_id] = row
+
+    def _append(self):
+        if self._size == len(self._ids):
+            capacity = max(64, 2 * self._size)
+            self._ids = np.resize(self._ids, capacity)
+            self._labs = np.resize(self._labs, (capacity, PALETTE_SIZE, 3))
+            self._valid = np.resize(self._valid, (capacity, PALETTE_SIZE))
+        self._size += 1
+        return self._size - 1
+
+    def search(self, rgb, tolerance):
+        """Return (distance, id) of items with a colour within tolerance
+
+        Distances are CIE76 delta E to the closest palette colour, nearest
+        first.
+        """
+        target = rgb_to_lab(rgb)
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            distances = np.linalg.norm(self._labs[:size] - target, axis=2)
+            distances[~self._valid[:size]] = np.inf
+            best = distances.min(axis=1, initial=np.inf)
+            matched = np.flatnonzero((best <= tolerance) & (ids >= 0))
+            order = matched[np.argsort(best[matched], kind='stable')]
+            return list(zip(best[order].tolist(), ids[order].tolist()))
+
+
+def _build_palette_index(user_id):
+    return PaletteIndex(GalleryItem.objects.filter(
+        user_id=user_id
+    ).exclude(image_palette=b'').values_list('id', 'image_palette'))
+
+
+indexes = UserIndexes(
+    _build_palette_index,
+    max_users=getattr(settings, 'SIMILARITY_INDEX_MAX_USERS', 1000),
+    ttl=getattr(settings, 'SIMILARITY_INDEX_TTL', 300)
+)
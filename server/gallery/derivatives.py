@@ -0,0 +1,211 @@
+import logging
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core.models import (
+    GalleryItem, GalleryItemVariant, gallery_item_variant_dir,
+    gallery_item_variant_file_path
+)
+
+from gallery import imaging
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = getattr(settings, 'IMAGE_VARIANT_SIZES', {
+    'thumb': (320, 320),
+    'web': (1600, 1600),
+})
+VARIANT_FORMATS = getattr(settings, 'IMAGE_VARIANT_FORMATS', ('JPEG', 'WEBP'))
+VARIANT_QUALITY = getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+
+METADATA_FIELDS = [
+    'image_width',
+    'image_height',
+    'image_format',
+    'image_size',
+    'image_placeholder',
+    'image_hash',
+    'image_palette',
+]
+
+_executor = None
+_store_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process pool shared by image processing jobs"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _executor
+
+
+def get_store_executor():
+    """Return the threads that record rendered variants in the database"""
+    global _store_executor
+    with _executor_lock:
+        if _store_executor is None:
+            _store_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_STORE_WORKERS', 2)
+            )
+    return _store_executor
+
+
+def describe(gallery_item, image_file):
+    """Set a gallery item's image metadata fields from its image file"""
+    metadata = {
+        'width': None,
+        'height': None,
+        'format': '',
+        'size': None,
+        'placeholder': '',
+        'hash': None,
+        'palette': b'',
+    }
+    if image_file:
+        image_file.seek(0)
+        metadata.update(imaging.read_metadata(image_file))
+        image_file.seek(0)
+        metadata['size'] = image_file.size
+    set_metadata(gallery_item, metadata)
+
+
+def set_metadata(gallery_item, metadata):
+    """Copy read_metadata results onto a gallery item"""
+    for key, value in metadata.items():
+        setattr(gallery_item, f'image_{key}', value)
+
+
+def _render_args(gallery_item):
+    """Return the render_variants arguments for a gallery item"""
+    stem = uuid.uuid4().hex
+    return (
+        gallery_item.image.path,
+        default_storage.path(gallery_item_variant_dir(stem)),
+        stem,
+        VARIANT_SIZES,
+        VARIANT_FORMATS,
+        VARIANT_QUALITY
+    )
+
+
+def render(gallery_item):
+    """Render the variants of a gallery item's current image"""
+    return imaging.render_variants(*_render_args(gallery_item))
+
+
+def store(gallery_item_id, image_name, rendered):
+    """Replace a gallery item's variants with newly rendered files
+
+    The files are discarded if the item's image changed while they were
+    being rendered.
+    """
+    names = [
+        gallery_item_variant_file_path(None, variant['filename'])
+        for variant in rendered
+    ]
+    with transaction.atomic():
+        current = GalleryItem.objects.select_for_update().filter(
+            id=gallery_item_id,
+            image=image_name
+        ).exists()
+        if not current:
+            _delete_files(names)
+            return
+
+        old = GalleryItemVariant.objects.filter(
+            gallery_item_id=gallery_item_id
+        )
+        old_names = [variant.image.name for variant in old]
+        old.delete()
+        GalleryItemVariant.objects.bulk_create(
+            GalleryItemVariant(
+                gallery_item_id=gallery_item_id,
+                name=variant['name'],
+                format=variant['format'],
+                image=name,
+                width=variant['width'],
+                height=variant['height'],
+                size=variant['size']
+            )
+            for variant, name in zip(rendered, names)
+        )
+        transaction.on_commit(lambda: _delete_files(old_names))
+
+
+def clear(gallery_item_id):
+    """Delete the variants of a gallery item whose image was cleared
+
+    Variants are kept if the item has been given a new image since, which
+    replaces them once rendered.
+    """
+    with transaction.atomic():
+        cleared = GalleryItem.objects.select_for_update().filter(
+            Q(image='') | Q(image__isnull=True),
+            id=gallery_item_id
+        ).exists()
+        if not cleared:
+            return
+
+        old = GalleryItemVariant.objects.filter(
+            gallery_item_id=gallery_item_id
+        )
+        old_names = [variant.image.name for variant in old]
+        old.delete()
+        transaction.on_commit(lambda: _delete_files(old_names))
+
+
+def _delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def schedule(gallery_item):
+    """Render a gallery item's variants in the background after commit
+
+    Rendered variants are stored on a thread of their own rather than in
+    the pool's done callback, which runs on the thread that delivers every
+    pool result. A cleared image has its variants deleted instead.
+    """
+    gallery_item_id = gallery_item.id
+    if not gallery_item.image:
+        transaction.on_commit(lambda: clear(gallery_item_id))
+        return
+
+    image_name = gallery_item.image.name
+    args = _render_args(gallery_item)
+
+    def submit():
+        future = get_executor().submit(imaging.render_variants, *args)
+        future.add_done_callback(
+            lambda f: get_store_executor().submit(
+                _finish, gallery_item_id, image_name, f
+            )
+        )
+
+    transaction.on_commit(submit)
+
+
+def _finish(gallery_item_id, image_name, future):
+    """Record rendered variants once they have been rendered"""
+    try:
+        store(gallery_item_id, image_name, future.result())
+    except Exception:
+        logger.exception(
+            'Rendering variants failed for gallery item %s', gallery_item_id
+        )
+    finally:
+        connection.close()
@@ -0,0 +1,73 @@
+import json
+from collections import defaultdict
+
+from core.models import Gallery, GalleryItem, Tag
+
+
+CHUNK_SIZE = 2000
+
+TAG_FIELDS = ('id', 'name')
+GALLERY_ITEM_FIELDS = (
+    'id', 'name', 'blurb', 'image', 'image_width', 'image_height',
+    'image_format', 'image_size'
+)
+GALLERY_FIELDS = ('id', 'title', 'description')
+
+
+def _line(record_type, record):
+    return json.dumps({'type': record_type, **record}).encode() + b'\n'
+
+
+def _chunks(queryset, chunk_size):
+    """Yield lists of rows read through a server-side cursor"""
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _related_ids(relation, gallery_ids):
+    """Return {gallery ID: [related IDs]} for a gallery M2M relation"""
+    through = getattr(Gallery, relation).through
+    column = getattr(Gallery, relation).field.m2m_reverse_field_name()
+    related = defaultdict(list)
+    rows = through.objects.filter(
+        gallery_id__in=gallery_ids
+    ).order_by(column).values_list('gallery_id', column)
+    for gallery_id, related_id in rows:
+        related[gallery_id].append(related_id)
+    return related
+
+
+def export_library(user, chunk_size=CHUNK_SIZE):
+    """Yield a user's tags, gallery items and galleries as NDJSON lines
+
+    Rows are read in chunks through server-side cursors and the gallery
+    relations are looked up once per chunk, so memory use does not grow
+    with the size of the library.
+    """
+    for model, record_type, fields in (
+        (Tag, 'tag', TAG_FIELDS),
+        (GalleryItem, 'gallery_item', GALLERY_ITEM_FIELDS),
+    ):
+        rows = model.objects.filter(user=user).order_by('id').values(*fields)
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield _line(record_type, row)
+
+    galleries = Gallery.objects.filter(
+        user=user
+    ).order_by('id').values(*GALLERY_FIELDS)
+    for chunk in _chunks(galleries, chunk_size):
+        gallery_ids = [gallery['id'] for gallery in chunk]
+        tags = _related_ids('tags', gallery_ids)
+        gallery_items = _related_ids('gallery_items', gallery_ids)
+        for gallery in chunk:
+            yield _line('gallery', {
+                **gallery,
+                'tags': tags[gallery['id']],
+                'gallery_items': gallery_items[gallery['id']],
+            })
@@ -0,0 +1,101 @@
+import fcntl
+import hashlib
+import os
+import threading
+
+
+class DiskLRUCache:
+    """Size-bounded cache of generated files on local disk
+
+    Every hit bumps the file's mtime and, once the cache grows past
+    max_bytes, the least recently used files are deleted. Generating a
+    missing entry holds a file lock, so concurrent misses for the same key
+    across threads and processes produce the file only once.
+    """
+    lock_stripes = 64
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._size_lock = threading.Lock()
+
+    def _path(self, key, ext):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], f'{digest}.{ext}')
+
+    def _lock_path(self, path):
+        stripe = int(os.path.basename(path)[:8], 16) % self.lock_stripes
+        return os.path.join(self.root, '.locks', str(stripe))
+
+    def _open(self, path):
+        """Mark path as recently used and open it, or return None"""
+        try:
+            os.utime(path)
+            return open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def get_or_create(self, key, ext, create):
+        """Return an open file for key, calling create(path) on a miss"""
+        path = self._path(key, ext)
+        cached = self._open(path)
+        if cached is not None:
+            return cached
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_path = self._lock_path(path)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                cached = self._open(path)
+                if cached is not None:
+                    return cached
+                size = create(path)
+                cached = open(path, 'rb')
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self._grow(size)
+        return cached
+
+    def _scan(self):
+        """Return (mtime, size, path) for every cached file"""
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith('.'):
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.partial'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _grow(self, size):
+        with self._size_lock:
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._scan())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used files down to 90% of max_bytes"""
+        entries = sorted(self._scan())
+        total = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
@@ -0,0 +1,161 @@
+"""Pillow image processing run in worker processes
+
+Nothing here touches Django models or settings, so the functions can be
+pickled to and imported by spawned worker processes.
+"""
+import base64
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+FORMAT_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+}
+
+EXIF_ORIENTATION = 0x0112
+
+PLACEHOLDER_SIZE = (16, 16)
+
+HASH_SIZE = 8
+
+PALETTE_SIZE = 5
+PALETTE_SAMPLE = (64, 64)
+
+
+def _open_upright(source_path):
+    """Open an image rotated to its EXIF orientation, as RGB"""
+    image = Image.open(source_path)
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def dhash(image):
+    """Return the 64 bit difference hash of an image
+
+    Each bit records whether a pixel of a small greyscale copy is brighter
+    than its right neighbour, so re-encoded or resized copies of a photo
+    hash to nearby values.
+    """
+    small = image.convert('L').resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS
+    )
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            i = row * (HASH_SIZE + 1) + col
+            value = value << 1 | (pixels[i] > pixels[i + 1])
+    return value
+
+
+def extract_palette(image, size=PALETTE_SIZE):
+    """Return the dominant colours of an RGB image as packed bytes
+
+    Pixels of a small copy are binned on the top four bits of each channel.
+    Each of the fullest bins gives four bytes: the mean colour of its pixels
+    and its share of the image scaled to 0-255.
+    """
+    sample = image.resize(PALETTE_SAMPLE, Image.NEAREST)
+    pixels = np.asarray(sample, dtype=np.uint8).reshape(-1, 3)
+    levels = (pixels >> 4).astype(np.int32)
+    bins = levels[:, 0] << 8 | levels[:, 1] << 4 | levels[:, 2]
+
+    counts = np.bincount(bins, minlength=4096)
+    top = np.argsort(counts, kind='stable')[::-1][:size]
+    top = top[counts[top] > 0]
+    sums = np.stack([
+        np.bincount(bins, weights=pixels[:, channel], minlength=4096)
+        for channel in range(3)
+    ], axis=1)
+    colors = np.rint(sums[top] / counts[top, None])
+    shares = np.rint(counts[top] * 255 / len(bins))
+
+    return np.column_stack([colors, shares]).astype(np.uint8).tobytes()
+
+
+def read_metadata(source):
+    """Return the upright dimensions, format and summaries of an image
+
+    source is a path or file. The placeholder is a tiny JPEG data URI for
+    clients to show blurred while the image loads. JPEGs are decoded at a
+    reduced scale to make it, the palette and the hash, which is signed to
+    fit a 64 bit database column.
+    """
+    with Image.open(source) as image:
+        fmt = image.format
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+
+        box = tuple(side * 4 for side in PLACEHOLDER_SIZE)
+        image.draft('RGB', box)
+        thumb = ImageOps.exif_transpose(image)
+        if thumb.mode != 'RGB':
+            thumb = thumb.convert('RGB')
+        value = dhash(thumb)
+        palette = extract_palette(thumb)
+        thumb.thumbnail(PLACEHOLDER_SIZE)
+
+    buffer = io.BytesIO()
+    thumb.save(buffer, 'JPEG', quality=50)
+    placeholder = base64.b64encode(buffer.getvalue()).decode()
+
+    return {
+        'width': width,
+        'height': height,
+        'format': fmt.lower(),
+        'hash': value - (1 << 64) if value >> 63 else value,
+        'palette': palette,
+        'placeholder': f'data:image/jpeg;base64,{placeholder}',
+    }
+
+
+def render_variants(source_path, dest_dir, stem, sizes, formats, quality):
+    """Write a resized copy of source_path per size and format
+
+    sizes maps a variant name to its (width, height) bounding box. Returns a
+    dict for each file written, with its file name relative to dest_dir.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    with _open_upright(source_path) as image:
+        rendered = []
+        for name, box in sizes.items():
+            variant = image.copy()
+            variant.thumbnail(box, Image.LANCZOS)
+            for fmt in formats:
+                filename = f'{stem}-{name}.{FORMAT_EXTENSIONS[fmt]}'
+                path = os.path.join(dest_dir, filename)
+                variant.save(path, fmt, quality=quality, optimize=True)
+                rendered.append({
+                    'name': name,
+                    'format': fmt.lower(),
+                    'filename': filename,
+                    'width': variant.width,
+                    'height': variant.height,
+                    'size': os.path.getsize(path),
+                })
+
+    return rendered
+
+
+def render_transform(source_path, dest_path, width, fmt, quality):
+    """Write source_path scaled down to width and encoded as fmt
+
+    The file is written beside dest_path and moved into place, so readers
+    never see a partial image. Returns the size of the written file.
+    """
+    with _open_upright(source_path) as image:
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        partial_path = f'{dest_path}.partial'
+        image.save(partial_path, fmt, quality=quality)
+    os.replace(partial_path, dest_path)
+
+    return os.path.getsize(dest_path)
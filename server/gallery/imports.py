@@ -0,0 +1,359 @@
+import csv
+import io
+import json
+import logging
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from core.models import Gallery, GalleryItem, ImportedObject, Tag
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+
+# Multi-valued CSV columns hold references separated by this
+CSV_SEPARATOR = ';'
+
+# Record fields holding one value, and those holding a list of references
+SCALAR_FIELDS = ('id', 'name', 'title', 'blurb', 'description')
+LIST_FIELDS = ('tags', 'gallery_items')
+
+
+class ImportFailed(Exception):
+    """A record that cannot be imported"""
+
+    def __init__(self, message, record=None):
+        if record is not None:
+            message = f'Record {record}: {message}'
+        super().__init__(message)
+
+
+def _is_scalar(value):
+    """Return whether a value can be imported as a single reference"""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def check_record(record, number):
+    """Raise ImportFailed unless a record's fields have usable types"""
+    for name in SCALAR_FIELDS:
+        value = record.get(name)
+        if value is not None and not _is_scalar(value):
+            raise ImportFailed(f'{name} must be a string or integer.', number)
+    for name in LIST_FIELDS:
+        value = record.get(name)
+        if value is not None and not (
+            isinstance(value, list) and all(map(_is_scalar, value))
+        ):
+            raise ImportFailed(
+                f'{name} must be a list of strings or integers.', number
+            )
+
+
+def _lines(stream):
+    """Yield the lines of a UTF-8 byte stream as text"""
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8')
+
+
+def read_ndjson(stream):
+    """Yield the records of an NDJSON byte stream"""
+    for number, line in enumerate(_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ImportFailed('Invalid JSON.', number)
+        if not isinstance(record, dict):
+            raise ImportFailed('Expected an object.', number)
+        yield record
+
+
+def read_csv(stream):
+    """Yield the records of a CSV byte stream with a header row"""
+    for record in csv.DictReader(_lines(stream)):
+        for key in ('tags', 'gallery_items'):
+            value = record.get(key)
+            record[key] = value.split(CSV_SEPARATOR) if value else []
+        yield record
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def _csv_value(value):
+    """Format a value for COPY in CSV format, which reads NULL unquoted"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, (bytes, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    value = str(value).replace('"', '""')
+    return f'"{value}"'
+
+
+def _copy(model, objs, fields):
+    """Insert objects with a Postgres COPY of the given fields"""
+    buffer = io.StringIO()
+    for obj in objs:
+        buffer.write(','.join(
+            _csv_value(field.get_prep_value(getattr(obj, field.attname)))
+            for field in fields
+        ))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {quote(model._meta.db_table)} ({columns}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+
+
+def insert(model, objs, returning=True):
+    """Insert objects in bulk, setting their IDs if returning
+
+    Postgres gets a COPY, with IDs drawn from the table's sequence up
+    front when they are needed. Backends that cannot return IDs from a
+    bulk insert save objects one at a time when IDs are needed.
+    """
+    if not objs:
+        return
+    fields = [
+        field for field in model._meta.concrete_fields
+        if returning or not field.primary_key
+    ]
+
+    can_return = connection.features.can_return_ids_from_bulk_insert
+    if connection.vendor == 'postgresql':
+        if returning:
+            table = model._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                    'FROM generate_series(1, %s)',
+                    [table, model._meta.pk.column, len(objs)]
+                )
+                for obj, (pk,) in zip(objs, cursor.fetchall()):
+                    obj.pk = pk
+        _copy(model, objs, fields)
+    elif returning and not can_return:
+        for obj in objs:
+            obj.save(force_insert=True)
+    else:
+        model.objects.bulk_create(objs, batch_size=500)
+
+
+class LibraryImporter:
+    """Import tags, gallery items and galleries into a user's library
+
+    Records are read in chunks and each chunk is written in one
+    transaction that also advances the job, so a failed import can be run
+    again with the same job and picks up after the last full chunk. Tags
+    are matched by name; galleries refer to tags by import ID or name and
+    to gallery items by import ID.
+    """
+
+    def __init__(self, job, chunk_size=CHUNK_SIZE):
+        self.job = job
+        self.user = job.user
+        self.chunk_size = chunk_size
+        self.created = dict.fromkeys(('tag', 'gallery_item', 'gallery'), 0)
+        self.tag_names = dict(
+            Tag.objects.filter(user=self.user).values_list('name', 'id')
+        )
+        self.ids = {'tag': {}, 'gallery_item': {}}
+        for kind, external_id, object_id in ImportedObject.objects.filter(
+            job=job
+        ).values_list('kind', 'external_id', 'object_id'):
+            self.ids[kind][external_id] = object_id
+
+    def run(self, records):
+        """Import records, skipping those committed by an earlier run"""
+        skip = self.job.records
+        chunk = []
+        for number, record in enumerate(records, 1):
+            if number <= skip:
+                continue
+            chunk.append((number, record))
+            if len(chunk) == self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        self._import_chunk(chunk)
+
+        self.job.finished = timezone.now()
+        self.job.save(update_fields=['finished'])
+
+    def _import_chunk(self, chunk):
+        if not chunk:
+            return
+        records = {'tag': [], 'gallery_item': [], 'gallery': []}
+        external_ids = {kind: set() for kind in self.ids}
+        for number, record in chunk:
+            kind = record.get('type')
+            if not isinstance(kind, str) or kind not in records:
+                raise ImportFailed(f'Unknown type {kind!r}.', number)
+            check_record(record, number)
+            records[kind].append((number, record))
+
+            external_id = str(record.get('id') or '')
+            if external_id and kind in external_ids:
+                self._text(
+                    external_id, 'id', ImportedObject, 'external_id', number
+                )
+                if external_id in self.ids[kind] or \
+                        external_id in external_ids[kind]:
+                    raise ImportFailed(
+                        f'Duplicate id {external_id!r}.', number
+                    )
+                external_ids[kind].add(external_id)
+
+        done = self.job.records
+        try:
+            with transaction.atomic():
+                mapped = self._import_tags(records['tag'], records['gallery'])
+                mapped += self._import_items(records['gallery_item'])
+                self._import_galleries(records['gallery'])
+                insert(ImportedObject, [
+                    ImportedObject(job=self.job, **mapping)
+                    for mapping in mapped
+                ], returning=False)
+
+                self.job.records = chunk[-1][0]
+                self.job.save(update_fields=['records'])
+        except DatabaseError:
+            self.job.records = done
+            logger.exception(
+                'Import job %s failed after record %s', self.job.id, done
+            )
+            raise ImportFailed(
+                f'Records {chunk[0][0]} to {chunk[-1][0]} could not be saved.'
+            )
+
+    def _text(self, value, name, model, field, number):
+        """Return value as text, rejecting text too long for the field"""
+        value = str(value)
+        max_length = model._meta.get_field(field).max_length
+        if max_length is not None and len(value) > max_length:
+            raise ImportFailed(
+                f'{name} is longer than {max_length} characters.', number
+            )
+        return value
+
+    def _field(self, record, name, model, number):
+        value = record.get(name)
+        if value is None or value == '':
+            raise ImportFailed(f'Missing {name}.', number)
+        return self._text(value, name, model, name, number)
+
+    def _mapped(self, records, kind, object_ids):
+        """Remember the IDs objects were given under their import IDs"""
+        mapped = []
+        for (_, record), object_id in zip(records, object_ids):
+            external_id = str(record.get('id') or '')
+            if external_id:
+                self.ids[kind][external_id] = object_id
+                mapped.append({
+                    'kind': kind,
+                    'external_id': external_id,
+                    'object_id': object_id,
+                })
+        return mapped
+
+    def _import_tags(self, tags, galleries):
+        """Create the tags named by tag records or gallery references"""
+        names = [
+            self._field(record, 'name', Tag, number)
+            for number, record in tags
+        ]
+        external_ids = {str(record.get('id') or '') for _, record in tags}
+        for number, record in galleries:
+            names.extend(
+                self._text(ref, 'tag', Tag, 'name', number)
+                for ref in map(str, record.get('tags') or [])
+                if ref not in self.ids['tag'] and ref not in external_ids
+            )
+
+        new = [
+            Tag(user=self.user, name=name)
+            for name in dict.fromkeys(names) if name not in self.tag_names
+        ]
+        insert(Tag, new)
+        self.tag_names.update((tag.name, tag.id) for tag in new)
+        self.created['tag'] += len(new)
+
+        return self._mapped(
+            tags,
+            'tag',
+            [self.tag_names[name] for name in names[:len(tags)]]
+        )
+
+    def _import_items(self, items):
+        objs = [
+            GalleryItem(
+                user=self.user,
+                name=self._field(record, 'name', GalleryItem, number),
+                blurb=str(record.get('blurb') or '')
+            )
+            for number, record in items
+        ]
+        insert(GalleryItem, objs)
+        self.created['gallery_item'] += len(objs)
+
+        return self._mapped(items, 'gallery_item', [obj.id for obj in objs])
+
+    def _related_ids(self, kind, refs, number):
+        """Return the IDs of the objects a gallery refers to"""
+        object_ids = []
+        for ref in refs or []:
+            ref = str(ref)
+            object_id = self.ids[kind].get(ref)
+            if object_id is None and kind == 'tag':
+                object_id = self.tag_names[ref]
+            elif object_id is None:
+                raise ImportFailed(f'Unknown gallery item {ref!r}.', number)
+            object_ids.append(object_id)
+        return dict.fromkeys(object_ids)
+
+    def _import_galleries(self, galleries):
+        objs = []
+        links = []
+        for number, record in galleries:
+            objs.append(Gallery(
+                user=self.user,
+                title=self._field(record, 'title', Gallery, number),
+                description=str(record.get('description') or '')
+            ))
+            links.append((
+                self._related_ids('tag', record.get('tags'), number),
+                self._related_ids(
+                    'gallery_item', record.get('gallery_items'), number
+                )
+            ))
+        insert(Gallery, objs)
+        self.created['gallery'] += len(objs)
+
+        tag_links, item_links = [], []
+        for gallery, (tag_ids, item_ids) in zip(objs, links):
+            tag_links.extend(
+                Gallery.tags.through(gallery_id=gallery.id, tag_id=tag_id)
+                for tag_id in tag_ids
+            )
+            item_links.extend(
+                Gallery.gallery_items.through(
+                    gallery_id=gallery.id,
+                    galleryitem_id=item_id
+                )
+                for item_id in item_ids
+            )
+        insert(Gallery.tags.through, tag_links, returning=False)
+        insert(Gallery.gallery_items.through, item_links, returning=False)
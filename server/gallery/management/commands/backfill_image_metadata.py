@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import GalleryItem
+
+from gallery import derivatives, imaging
+
+
+class Command(BaseCommand):
+    """Record image metadata for gallery items uploaded without it
+
+    Images are read in parallel on the image processing pool, one batch at
+    a time. Items that are done no longer match, so an interrupted run can
+    simply be started again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        storage = GalleryItem._meta.get_field('image').storage
+        pending = GalleryItem.objects.exclude(image='').filter(
+            Q(image_width__isnull=True) | Q(image_hash__isnull=True) |
+            Q(image_palette=b''),
+            image__isnull=False
+        ).order_by('id')
+        executor = derivatives.get_executor()
+
+        described = failed = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).values_list(
+                'id', 'image'
+            )[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            futures = [
+                executor.submit(imaging.read_metadata, storage.path(name))
+                for _, name in batch
+            ]
+            results = {}
+            for (item_id, name), future in zip(batch, futures):
+                try:
+                    metadata = future.result()
+                    metadata['size'] = storage.size(name)
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'Gallery item {item_id}: {error}')
+                    continue
+                results[item_id] = (name, metadata)
+
+            described += self._save(results)
+            self.stdout.write(f'Described {described} images...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Described {described} images, {failed} failed'
+        ))
+
+    def _save(self, results):
+        """Store metadata for items whose image is unchanged"""
+        with transaction.atomic():
+            items = GalleryItem.objects.select_for_update().filter(
+                id__in=results
+            ).only('id', 'image')
+            described = []
+            for item in items:
+                name, metadata = results[item.id]
+                if item.image.name == name:
+                    derivatives.set_metadata(item, metadata)
+                    described.append(item)
+            GalleryItem.objects.bulk_update(
+                described,
+                derivatives.METADATA_FIELDS
+            )
+
+        return len(described)
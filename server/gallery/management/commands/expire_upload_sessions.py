@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.models import UploadSession
+
+from gallery import uploads
+
+
+class Command(BaseCommand):
+    """Delete upload sessions older than UPLOAD_SESSION_TTL
+
+    Each expired session's partial file is deleted along with it.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        expired = UploadSession.objects.filter(
+            created__lt=UploadSession.expiry_cutoff()
+        ).order_by('created')
+
+        deleted = 0
+        while True:
+            batch = list(expired[:options['batch_size']])
+            if not batch:
+                break
+            for session in batch:
+                uploads.discard(session)
+            UploadSession.objects.filter(
+                id__in=[session.id for session in batch]
+            ).delete()
+            deleted += len(batch)
+
+        self.stdout.write(f'Deleted {deleted} expired upload sessions')
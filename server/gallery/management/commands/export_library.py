@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery import export
+
+
+class Command(BaseCommand):
+    """Write a user's whole library as NDJSON"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument(
+            '--output',
+            help='File to write to instead of standard output'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=export.CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        lines = export.export_library(user, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line.decode(), ending='')
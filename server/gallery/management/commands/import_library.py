@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import ImportJob
+
+from gallery import imports
+
+
+class Command(BaseCommand):
+    """Import a library from an NDJSON or CSV file into a user's account"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(imports.READERS))
+        parser.add_argument('--job', help='ID of an import job to resume')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=imports.CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        if options['job']:
+            job = ImportJob.objects.get(id=options['job'], user=user)
+        else:
+            job = ImportJob.objects.create(user=user)
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'csv' if options['path'].endswith('.csv') else 'ndjson'
+
+        importer = imports.LibraryImporter(job, options['chunk_size'])
+        try:
+            with open(options['path'], 'rb') as f:
+                importer.run(imports.READERS[fmt](f))
+        except (imports.ImportFailed, ValueError) as error:
+            raise CommandError(
+                f'{error}. Resume with --job {job.id} after '
+                f'{job.records} records.'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {records} records as job {job}: {tag} tags, '
+            '{gallery_item} gallery items, {gallery} galleries'.format(
+                records=job.records,
+                job=job.id,
+                **importer.created
+            )
+        ))
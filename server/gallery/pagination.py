@@ -0,0 +1,152 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor, CursorPagination, _reverse_ordering
+)
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Cursor pagination keyed on every ordering field
+
+    DRF's cursor only filters on the first ordering field and falls back to
+    offsets for ties. Here the cursor holds a value for every field and the
+    last field must be unique, so each page is a single indexed range scan
+    and no COUNT(*) is ever issued.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    estimate_query_param = 'estimate_total'
+    estimate_header = 'X-Estimated-Total'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        self.estimated_total = None
+        if request.query_params.get(self.estimate_query_param):
+            self.estimated_total = self.get_estimated_total(queryset)
+
+        reverse, current_position = False, None
+        if self.cursor is not None:
+            reverse, current_position = self.cursor[1:]
+
+        ordering = self.ordering
+        if reverse:
+            ordering = _reverse_ordering(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(
+                self._after_position(
+                    queryset.model, ordering, current_position
+                )
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        position = self._get_position_from_instance(
+            self.page[-1], self.ordering
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        position = self._get_position_from_instance(
+            self.page[0], self.ordering
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position)
+        )
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.estimated_total is not None:
+            response[self.estimate_header] = str(self.estimated_total)
+
+        return response
+
+    def get_estimated_total(self, queryset):
+        """Return the planner's row estimate for the queryset, if available"""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            getattr(instance, field.lstrip('-')) for field in ordering
+        ]
+        return json.dumps(values, default=str)
+
+    def _after_position(self, model, ordering, position):
+        """Return a filter for rows strictly after position in ordering"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            attr = field.lstrip('-')
+            try:
+                value = model._meta.get_field(attr).to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            condition |= Q(**equal, **{attr + lookup: value})
+            equal[attr] = value
+
+        return condition
+
+
+class GalleryAttrPagination(KeysetCursorPagination):
+    """Pagination for tags and gallery items"""
+    ordering = ('-name', 'id')
+
+
+class GalleryPagination(KeysetCursorPagination):
+    """Pagination for galleries"""
+    ordering = ('-id',)
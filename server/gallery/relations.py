@@ -0,0 +1,53 @@
+from core.models import Gallery
+
+
+def _through(field_name):
+    """Return the through model and related column for a gallery M2M"""
+    field = getattr(Gallery, field_name).field
+    return field.remote_field.through, f'{field.m2m_reverse_field_name()}_id'
+
+
+def _clear_prefetch(gallery, field_name):
+    """Drop a relation's prefetched objects, which no longer match"""
+    prefetched = getattr(gallery, '_prefetched_objects_cache', {})
+    prefetched.pop(field_name, None)
+
+
+def add_related(gallery, field_name, ids):
+    """Link ids to the gallery with one INSERT, skipping existing links"""
+    through, column = _through(field_name)
+    through.objects.bulk_create(
+        [through(gallery_id=gallery.pk, **{column: pk}) for pk in ids],
+        ignore_conflicts=True
+    )
+    _clear_prefetch(gallery, field_name)
+
+
+def remove_related(gallery, field_name, ids):
+    """Unlink ids from the gallery with one DELETE"""
+    through, column = _through(field_name)
+    through.objects.filter(
+        gallery_id=gallery.pk,
+        **{f'{column}__in': ids}
+    ).delete()
+    _clear_prefetch(gallery, field_name)
+
+
+def set_related(gallery, field_name, ids):
+    """Make ids the gallery's only links, touching only the rows that differ
+
+    Unlike RelatedManager.set() this does not send m2m_changed signals.
+    The links are read and then changed, so callers should hold the
+    gallery's row lock in the same transaction.
+    """
+    through, column = _through(field_name)
+    current = set(
+        through.objects.filter(
+            gallery_id=gallery.pk
+        ).values_list(column, flat=True)
+    )
+    ids = set(ids)
+    if ids - current:
+        add_related(gallery, field_name, ids - current)
+    if current - ids:
+        remove_related(gallery, field_name, current - ids)
@@ -1,6 +1,97 @@
+import re
+
+from django.conf import settings
+from django.db import transaction
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from core.models import (
+    Tag, GalleryItem, GalleryItemVariant, Gallery, UploadSession
+)
+
+from gallery import derivatives, relations, similarity, uploads
+
+
+# str.isdigit() also accepts digits int() cannot parse, such as '²'
+DIGITS = re.compile(r'[0-9]+')
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """Serializer for creating many objects with a single bulk insert"""
+    batch_size = 500
+
+    def create(self, validated_data):
+        """Insert every object in one transaction and return them"""
+        model = self.child.Meta.model
+        with transaction.atomic():
+            objs = model.objects.bulk_create(
+                [model(**attrs) for attrs in validated_data],
+                batch_size=self.batch_size
+            )
+
+        # New objects have no related rows yet, so the nested relations
+        # rendered in the response are marked as prefetched and empty
+        empty = {
+            field.source: model._meta.get_field(
+                field.source
+            ).related_model.objects.none()
+            for field in self.child.fields.values()
+            if isinstance(field, serializers.ListSerializer)
+        }
+        for obj in objs:
+            obj._prefetched_objects_cache = dict(empty)
+        return objs
+
+
+class BatchedManyRelatedField(serializers.ManyRelatedField):
+    """Many related field that looks up every submitted PK in one query"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
 
-from core.models import Tag, GalleryItem, Gallery
+        child = self.child_relation
+        errors = []
+        pks = []
+        for item in data:
+            if isinstance(item, bool) or \
+                    not DIGITS.fullmatch(str(item)):
+                errors.append(child.error_messages['incorrect_type'].format(
+                    data_type=type(item).__name__
+                ))
+            else:
+                pks.append(int(item))
+
+        pks = list(dict.fromkeys(pks))
+        objs = child.get_queryset().only('pk').in_bulk(pks)
+        errors.extend(
+            child.error_messages['does_not_exist'].format(pk_value=pk)
+            for pk in pks if pk not in objs
+        )
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return [objs[pk] for pk in pks]
+
+
+class UserOwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field limited to objects owned by the requesting user"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchedManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            user=self.context['request'].user
+        )
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -10,24 +101,48 @@ class TagSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ('id', 'name')
         read_only_fields = ('id',)
+        list_serializer_class = BulkCreateListSerializer
+
+
+class GalleryItemVariantSerializer(serializers.ModelSerializer):
+    """Serializer for gallery item image variant object"""
+
+    class Meta:
+        model = GalleryItemVariant
+        fields = ('name', 'format', 'image', 'width', 'height', 'size')
+        read_only_fields = fields
 
 
 class GalleryItemSerializer(serializers.ModelSerializer):
     """Serializer for gallery item blurb object"""
+    variants = GalleryItemVariantSerializer(many=True, read_only=True)
 
     class Meta:
         model = GalleryItem
-        fields = ('id', 'name', 'blurb')
-        read_only_fields = ('id',)
+        fields = (
+            'id', 'name', 'blurb', 'image_width', 'image_height',
+            'image_format', 'image_size', 'image_placeholder', 'variants'
+        )
+        read_only_fields = (
+            'id', 'image_width', 'image_height', 'image_format',
+            'image_size', 'image_placeholder'
+        )
+        list_serializer_class = BulkCreateListSerializer
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """Load only the columns and relations the serializer renders"""
+        columns = [field for field in cls.Meta.fields if field != 'variants']
+        return queryset.only(*columns).prefetch_related('variants')
 
 
 class GallerySerializer(serializers.ModelSerializer):
     """Serializer for gallery object"""
-    gallery_items = serializers.PrimaryKeyRelatedField(
+    gallery_items = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=GalleryItem.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -37,6 +152,39 @@ class GallerySerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'description', 'gallery_items', 'tags')
         read_only_fields = ('id',)
 
+    related_fields = ('gallery_items', 'tags')
+
+    def _pop_related(self, validated_data):
+        """Remove the M2M values from validated_data as sets of IDs"""
+        return {
+            name: {obj.pk for obj in validated_data.pop(name)}
+            for name in self.related_fields if name in validated_data
+        }
+
+    def create(self, validated_data):
+        """Create a gallery and link its relations with bulk inserts"""
+        related = self._pop_related(validated_data)
+        with transaction.atomic():
+            gallery = super().create(validated_data)
+            for name, ids in related.items():
+                relations.add_related(gallery, name, ids)
+
+        return gallery
+
+    def update(self, instance, validated_data):
+        """Update a gallery, changing only the relation rows that differ
+
+        Saving the gallery first locks its row until the relations are
+        set, so concurrent updates of one gallery do not interleave.
+        """
+        related = self._pop_related(validated_data)
+        with transaction.atomic():
+            gallery = super().update(instance, validated_data)
+            for name, ids in related.items():
+                relations.set_related(gallery, name, ids)
+
+        return gallery
+
 
 class GalleryDetailSerializer(GallerySerializer):
     """Serializer for gallery object with detail"""
@@ -51,3 +199,71 @@ class GalleryItemImageSerializer(serializers.ModelSerializer):
         model = GalleryItem
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+    def update(self, instance, validated_data):
+        """Record the new image's metadata along with it"""
+        derivatives.describe(instance, validated_data.get('image'))
+        return super().update(instance, validated_data)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable image upload session object"""
+    offset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'gallery_item', 'size', 'offset', 'created')
+        read_only_fields = ('id', 'gallery_item', 'created')
+        extra_kwargs = {
+            'size': {
+                'min_value': 1,
+                'max_value': getattr(
+                    settings, 'UPLOAD_SESSION_MAX_SIZE', 100 * 1024 ** 2
+                ),
+            },
+        }
+
+    def get_offset(self, obj):
+        """Return the number of bytes received so far"""
+        return uploads.get_offset(obj)
+
+
+class GalleryRelationSerializer(serializers.Serializer):
+    """Serializer for adding or removing gallery relations by ID"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000
+    )
+
+
+class SimilarityQuerySerializer(serializers.Serializer):
+    """Serializer for the hash distance of a similar image query"""
+    distance = serializers.IntegerField(min_value=0, max_value=32)
+
+
+class DuplicateQuerySerializer(serializers.Serializer):
+    """Serializer for the hash distance of a duplicate image query"""
+    distance = serializers.IntegerField(
+        min_value=0,
+        max_value=similarity.MAX_DUPLICATE_DISTANCE,
+        error_messages={'max_value': (
+            'Duplicates can be searched up to a distance of '
+            '{max_value}; use similar for wider searches.'
+        )}
+    )
+
+
+class ColorQuerySerializer(serializers.Serializer):
+    """Serializer for a search by colour"""
+    color = serializers.RegexField(r'^#?[0-9a-fA-F]{6}$')
+    tolerance = serializers.FloatField(
+        min_value=0,
+        max_value=100,
+        default=20
+    )
+
+
+class ImportQuerySerializer(serializers.Serializer):
+    """Serializer for the import job to resume"""
+    job = serializers.UUIDField(required=False)
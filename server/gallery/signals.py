@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import GalleryItem
+
+from gallery import colors, similarity
+
+
+@receiver(post_save, sender=GalleryItem)
+def update_image_indexes(sender, instance, update_fields, **kwargs):
+    """Keep loaded image indexes in step with a saved gallery item"""
+    for indexes, field in (
+        (similarity.indexes, 'image_hash'),
+        (colors.indexes, 'image_palette'),
+    ):
+        if update_fields is None or field in update_fields:
+            indexes.update(
+                instance.user_id,
+                instance.id,
+                getattr(instance, field)
+            )
+
+
+@receiver(post_delete, sender=GalleryItem)
+def remove_from_image_indexes(sender, instance, **kwargs):
+    """Drop a deleted gallery item from loaded image indexes"""
+    similarity.indexes.update(instance.user_id, instance.id, None)
+    colors.indexes.update(instance.user_id, instance.id, None)
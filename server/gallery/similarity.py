@@ -0,0 +1,257 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+
+import numpy as np
+
+from django.conf import settings
+
+from core.models import GalleryItem
+
+
+HASH_MASK = (1 << 64) - 1
+
+# Default hash distances for similar images and for duplicates
+SIMILAR_DISTANCE = getattr(settings, 'SIMILARITY_DISTANCE', 10)
+DUPLICATE_DISTANCE = getattr(settings, 'SIMILARITY_DUPLICATE_DISTANCE', 4)
+# Largest duplicate distance whose chunks still rule out most pairs; past
+# it the pair search turns quadratic in the number of items
+MAX_DUPLICATE_DISTANCE = 8
+
+
+def hamming(a, b):
+    """Return the number of bits that differ between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+# Set bits of every byte value
+BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Return the number of set bits of each value of a uint64 array"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(
+        axis=1, dtype=np.int64
+    )
+
+
+def _chunking(count, radius):
+    """Return the cheapest (chunks, chunk radius) to pair count hashes
+
+    Split into chunks, two hashes within radius of each other are within
+    radius // chunks in at least one chunk. Each chunk then takes a probe
+    per bit mask within the chunk radius, and pairs every hash with about
+    count / 2 ** chunk bits others to verify.
+    """
+    best = None
+    for chunks in range(1, radius + 2):
+        bits = 64 // chunks
+        chunk_radius = radius // chunks
+        masks, term = 0, 1
+        for ones in range(chunk_radius + 1):
+            masks += term
+            term = term * (bits - ones) // (ones + 1)
+        cost = chunks * masks * (count + count * count / 2 ** (bits + 1))
+        if best is None or cost < best[0]:
+            best = (cost, chunks, chunk_radius)
+    return best[1:]
+
+
+def _masks(bits, radius):
+    """Yield every mask of up to radius set bits among the low bits"""
+    for ones in range(radius + 1):
+        for positions in combinations(range(bits), ones):
+            yield sum(1 << position for position in positions)
+
+
+def close_pairs(values, radius, batch_size=1 << 20):
+    """Yield (a, b) index arrays of the values within radius of each other
+
+    This is multi-index hashing: the hashes are split into chunks, and
+    each chunk is sorted so the hashes close in that chunk can be found by
+    binary search and then checked in full, at most batch_size candidates
+    at a time. A pair close in several chunks is yielded more than once.
+    """
+    chunks, chunk_radius = _chunking(len(values), radius)
+    bounds = [64 * k // chunks for k in range(chunks + 1)]
+    positions = np.arange(len(values))
+    for start, end in zip(bounds, bounds[1:]):
+        keys = (values >> np.uint64(start)) & np.uint64((1 << end - start) - 1)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        for mask in _masks(end - start, chunk_radius):
+            targets = keys ^ np.uint64(mask)
+            # Each pair is reached from both ends, so keep the later one
+            low = np.maximum(
+                np.searchsorted(keys, targets, 'left'), positions + 1
+            )
+            counts = np.maximum(
+                np.searchsorted(keys, targets, 'right') - low, 0
+            )
+            totals = np.cumsum(counts)
+            first = 0
+            while first < len(counts):
+                last = np.searchsorted(
+                    totals, totals[first] - counts[first] + batch_size,
+                    'right'
+                )
+                last = max(last, first + 1)
+                span = counts[first:last]
+                a = np.repeat(positions[first:last], span)
+                b = np.repeat(low[first:last] - np.cumsum(span) + span, span)
+                b += np.arange(len(b))
+                a, b = order[a], order[b]
+                close = popcount(values[a] ^ values[b]) <= radius
+                if close.any():
+                    yield a[close], b[close]
+                first = last
+
+
+class HashIndex:
+    """Image hashes of one user's gallery items
+
+    Hashes are kept in arrays that grow by doubling, and queries work on a
+    copy taken under the lock so signals updating the index are not held
+    up by them. A removed item leaves a row with ID -1 behind.
+    """
+
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._ids = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=np.uint64)
+        self._size = 0
+        self._lock = threading.Lock()
+        for item_id, value in rows:
+            self.set(item_id, value)
+
+    def set(self, item_id, value):
+        """Record an item's hash, None removing the item"""
+        with self._lock:
+            row = self._rows.pop(item_id, None)
+            if row is not None:
+                self._ids[row] = -1
+            if value is None:
+                return
+
+            if row is None:
+                row = self._append()
+            self._ids[row] = item_id
+            self._values[row] = value & HASH_MASK
+            self._rows[item_id] = row
+
+    def _append(self):
+        if self._size == len(self._ids):
+            capacity = max(64, 2 * self._size)
+            self._ids = np.resize(self._ids, capacity)
+            self._values = np.resize(self._values, capacity)
+        self._size += 1
+        return self._size - 1
+
+    def _snapshot(self):
+        """Return copies of the IDs and hashes of the indexed items"""
+        with self._lock:
+            ids = self._ids[:self._size]
+            valid = ids >= 0
+            return ids[valid], self._values[:self._size][valid]
+
+    def similar(self, item_id, radius):
+        """Return (distance, id) of the items within radius of an item"""
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is None:
+                return []
+            value = self._values[row]
+        ids, values = self._snapshot()
+
+        distances = popcount(values ^ value)
+        matched = np.flatnonzero((distances <= radius) & (ids != item_id))
+        order = matched[np.lexsort((ids[matched], distances[matched]))]
+        return list(zip(distances[order].tolist(), ids[order].tolist()))
+
+    def duplicates(self, radius):
+        """Return groups of item IDs linked by hashes within radius"""
+        ids, values = self._snapshot()
+        # Items with the same hash always group, so only distinct hashes
+        # are paired up
+        values, items = np.unique(values, return_inverse=True)
+        parents = list(range(len(values)))
+
+        def find(value):
+            root = value
+            while parents[root] != root:
+                root = parents[root]
+            parents[value] = root
+            return root
+
+        for a, b in close_pairs(values, radius):
+            for value, other in zip(a.tolist(), b.tolist()):
+                parents[find(other)] = find(value)
+
+        groups = {}
+        for item_id, value in zip(ids.tolist(), items.ravel().tolist()):
+            groups.setdefault(find(value), []).append(item_id)
+        return sorted(
+            sorted(group) for group in groups.values() if len(group) > 1
+        )
+
+
+class UserIndexes:
+    """Bounded LRU of per-user in-memory indexes with a TTL
+
+    An index is built by build(user_id) the first time a user needs it and
+    kept current through update(), which gallery item signals call in this
+    process. Entries expire after the TTL so changes made by other
+    processes are picked up.
+    """
+
+    def __init__(self, build, max_users, ttl):
+        self.build = build
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the index of a user's gallery items"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        index = self.build(user_id)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+        return index
+
+    def update(self, user_id, item_id, value):
+        """Apply a changed item value to the user's index if it is loaded"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[1].set(item_id, value)
+
+    def clear(self):
+        """Forget every index"""
+        with self._lock:
+            self._entries.clear()
+
+
+def _build_hash_index(user_id):
+    return HashIndex(GalleryItem.objects.filter(
+        user_id=user_id,
+        image_hash__isnull=False
+    ).values_list('id', 'image_hash'))
+
+
+indexes = UserIndexes(
+    _build_hash_index,
+    max_users=getattr(settings, 'SIMILARITY_INDEX_MAX_USERS', 1000),
+    ttl=getattr(settings, 'SIMILARITY_INDEX_TTL', 300)
+)
@@ -0,0 +1,61 @@
+import numpy as np
+from PIL import Image
+
+from django.test import SimpleTestCase
+
+from gallery import imaging
+from gallery.colors import PaletteIndex, parse_hex, rgb_to_lab
+
+
+def palette(*colors):
+    """Return a packed palette of (r, g, b, share) tuples"""
+    return bytes(value for color in colors for value in color)
+
+
+class PaletteTests(SimpleTestCase):
+    """Test dominant colour extraction and search"""
+
+    def test_extract_palette(self):
+        """Test that the largest areas of colour come first"""
+        image = Image.new('RGB', (100, 100), (200, 10, 10))
+        image.paste((10, 10, 200), (0, 0, 100, 25))
+
+        entries = np.frombuffer(imaging.extract_palette(image), np.uint8)
+
+        self.assertEqual(entries.reshape(-1, 4).tolist(), [
+            [200, 10, 10, 191],
+            [10, 10, 200, 64],
+        ])
+
+    def test_rgb_to_lab(self):
+        """Test converting colours to CIELAB"""
+        lab = rgb_to_lab([[255, 255, 255], [255, 0, 0]])
+
+        np.testing.assert_allclose(
+            lab,
+            [[100, 0, 0], [53.24, 80.09, 67.20]],
+            atol=0.1
+        )
+
+    def test_search_ranks_by_distance(self):
+        """Test that items are ranked by their closest colour"""
+        index = PaletteIndex([
+            (1, palette((250, 0, 0, 200), (0, 0, 255, 55))),
+            (2, palette((0, 0, 255, 255))),
+            (3, palette((0, 255, 0, 250), (255, 0, 0, 5))),
+        ])
+        for item_id in range(4, 80):
+            index.set(item_id, palette((128, 128, 128, 255)))
+        index.set(2, palette((255, 0, 0, 255)))
+
+        matches = index.search(parse_hex('#ff0000'), 10)
+
+        self.assertEqual([item_id for _, item_id in matches], [2, 1])
+        self.assertEqual(matches[0][0], 0)
+
+    def test_removed_items_not_found(self):
+        """Test that removed items are not returned"""
+        index = PaletteIndex([(1, palette((255, 0, 0, 255)))])
+        index.set(1, None)
+
+        self.assertEqual(index.search((255, 0, 0), 10), [])
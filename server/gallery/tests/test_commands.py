@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from core.models import Gallery, GalleryItem, ImportJob, Tag
+
+
+class BackfillImageMetadataTests(TestCase):
+    """Test recording metadata for existing gallery item images"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        image = ContentFile(b'')
+        Image.new('RGB', (30, 20)).save(image, format='PNG')
+        self.item = GalleryItem.objects.create(
+            user=self.user,
+            image=default_storage.save('uploads/gallery-items/a.png', image)
+        )
+        self.broken = GalleryItem.objects.create(
+            user=self.user,
+            image=default_storage.save(
+                'uploads/gallery-items/b.png',
+                ContentFile(b'notimage')
+            )
+        )
+
+    def tearDown(self):
+        for item in GalleryItem.objects.all():
+            item.image.delete()
+
+    def test_backfill(self):
+        """Test that readable images are described and others skipped"""
+        stderr = StringIO()
+        with patch('gallery.derivatives.get_executor',
+                   return_value=ThreadPoolExecutor(2)):
+            call_command(
+                'backfill_image_metadata',
+                batch_size=1,
+                stdout=StringIO(),
+                stderr=stderr
+            )
+
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (self.item.image_width, self.item.image_height), (30, 20)
+        )
+        self.assertEqual(self.item.image_format, 'png')
+        self.assertEqual(self.item.image_size, self.item.image.size)
+        self.broken.refresh_from_db()
+        self.assertIsNone(self.broken.image_width)
+        self.assertIn(f'Gallery item {self.broken.id}', stderr.getvalue())
+
+
+class ExportLibraryTests(TestCase):
+    """Test writing a user's library as NDJSON"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        Gallery.objects.create(
+            user=self.user,
+            title='Gallery',
+            description='Description'
+        )
+
+    def test_export_to_stdout(self):
+        """Test that records are written to standard output"""
+        out = StringIO()
+        call_command('export_library', 'test@email.com', stdout=out)
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r['title'] for r in records], ['Gallery'])
+
+    def test_export_to_file(self):
+        """Test that records are written to an output file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.ndjson')
+            call_command('export_library', 'test@email.com', output=path)
+            with open(path) as f:
+                self.assertEqual(json.loads(f.read())['type'], 'gallery')
+
+
+class ImportLibraryTests(TestCase):
+    """Test importing a library file in resumable chunks"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'library.ndjson')
+
+    def write(self, *records):
+        with open(self.path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+
+    def call_command(self, **options):
+        call_command(
+            'import_library',
+            'test@email.com',
+            self.path,
+            chunk_size=2,
+            stdout=StringIO(),
+            **options
+        )
+
+    def test_resume_after_failure(self):
+        """Test that a failed import resumes after its last chunk"""
+        records = [
+            {'type': 'tag', 'id': 't1', 'name': 'One'},
+            {'type': 'gallery_item', 'id': 'i1', 'name': 'Item'},
+            {'type': 'tag', 'id': 't2', 'name': 'Two'},
+            {'type': 'gallery', 'title': 'G', 'tags': ['t1', 't2']},
+            {'type': 'gallery', 'title': 'H', 'gallery_items': ['i1']},
+        ]
+        self.write(*records[:4], {'type': 'gallery'})
+
+        with self.assertRaises(CommandError):
+            self.call_command()
+        job = ImportJob.objects.get()
+        self.assertEqual(job.records, 4)
+        self.assertIsNone(job.finished)
+
+        self.write(*records)
+        self.call_command(job=str(job.id))
+
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertEqual(GalleryItem.objects.count(), 1)
+        galleries = Gallery.objects.order_by('title')
+        self.assertEqual(
+            [g.title for g in galleries],
+            ['G', 'H']
+        )
+        self.assertEqual(galleries[0].tags.count(), 2)
+        self.assertEqual(
+            list(galleries[1].gallery_items.values_list('name', flat=True)),
+            ['Item']
+        )
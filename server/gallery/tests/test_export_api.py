@@ -0,0 +1,94 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Gallery, GalleryItem, Tag
+
+from gallery import export
+
+
+EXPORT_URL = reverse('gallery:export')
+
+
+def read_lines(lines):
+    """Return the records of NDJSON lines"""
+    return [json.loads(line) for line in lines]
+
+
+class ExportApiTests(TestCase):
+    """Test streaming a user's library"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Tag')
+        self.item = GalleryItem.objects.create(
+            user=self.user,
+            name='Item',
+            blurb='Blurb'
+        )
+        self.galleries = []
+        for i in range(5):
+            gallery = Gallery.objects.create(
+                user=self.user,
+                title=f'Gallery {i}',
+                description='Description'
+            )
+            gallery.tags.add(self.tag)
+            if i % 2:
+                gallery.gallery_items.add(self.item)
+            self.galleries.append(gallery)
+
+        other = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        Tag.objects.create(user=other, name='Other')
+
+    def test_login_required(self):
+        """Test that the export requires authentication"""
+        res = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export(self):
+        """Test that the library is streamed one record per line"""
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        records = read_lines(b''.join(res.streaming_content).splitlines())
+        self.assertEqual(records[0], {
+            'type': 'tag',
+            'id': self.tag.id,
+            'name': 'Tag',
+        })
+        self.assertEqual(records[1]['type'], 'gallery_item')
+        self.assertEqual(records[1]['name'], 'Item')
+        galleries = records[2:]
+        self.assertEqual(len(galleries), 5)
+        self.assertEqual(galleries[1], {
+            'type': 'gallery',
+            'id': self.galleries[1].id,
+            'title': 'Gallery 1',
+            'description': 'Description',
+            'tags': [self.tag.id],
+            'gallery_items': [self.item.id],
+        })
+        self.assertEqual(galleries[0]['gallery_items'], [])
+
+    def test_relations_looked_up_per_chunk(self):
+        """Test that the query count grows with chunks, not galleries"""
+        with self.assertNumQueries(3 + 2 * 3):
+            records = read_lines(export.export_library(self.user, 2))
+
+        self.assertEqual(len(records), 7)
@@ -1,6 +1,10 @@
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection
 from django.urls import reverse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -17,6 +21,16 @@ def detail_url(gallery_id):
     return reverse('gallery:gallery-detail', args=[gallery_id])
 
 
+def add_items_url(gallery_id):
+    """Return URL for adding gallery items to a gallery"""
+    return reverse('gallery:gallery-add-items', args=[gallery_id])
+
+
+def remove_items_url(gallery_id):
+    """Return URL for removing gallery items from a gallery"""
+    return reverse('gallery:gallery-remove-items', args=[gallery_id])
+
+
 def sample_tag(user, **params):
     """Create and return a sample tag"""
     defaults = {
@@ -86,7 +100,7 @@ class PrivateGalleryApiTests(TestCase):
         galleries = Gallery.objects.all().order_by('-id')
         serializer = GallerySerializer(galleries, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_galleries_limited_to_user(self):
         """Test that galleries returned are for authenticated user"""
@@ -103,8 +117,8 @@ class PrivateGalleryApiTests(TestCase):
         serializer = GallerySerializer(galleries, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_view_gallery_detail(self):
         """Test viewing a gallery detail"""
@@ -227,9 +241,9 @@ class PrivateGalleryApiTests(TestCase):
         serializer1 = GallerySerializer(gallery1)
         serializer2 = GallerySerializer(gallery2)
         serializer3 = GallerySerializer(gallery3)
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     def test_filter_galleries_by_gallery_items(self):
         """Test returning galleries with specific gallery items"""
@@ -251,6 +265,188 @@ class PrivateGalleryApiTests(TestCase):
         serializer1 = GallerySerializer(gallery1)
         serializer2 = GallerySerializer(gallery2)
         serializer3 = GallerySerializer(gallery3)
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
+
+    def test_filter_galleries_returns_unique(self):
+        """Test that a gallery matching several filter IDs is listed once"""
+        gallery = sample_gallery(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        gallery_item = sample_gallery_item(user=self.user)
+        gallery.tags.add(tag1, tag2)
+        gallery.gallery_items.add(gallery_item)
+
+        res = self.client.get(
+            GALLERY_URL,
+            {'tags': f'{tag1.id},{tag2.id}', 'gallery_items': gallery_item.id}
+        )
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_filter_galleries_match_all(self):
+        """Test returning only galleries that have every given tag"""
+        gallery1 = sample_gallery(user=self.user, title='Gallery 1')
+        gallery2 = sample_gallery(user=self.user, title='Gallery 2')
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        gallery1.tags.add(tag1, tag2)
+        gallery2.tags.add(tag1)
+
+        res = self.client.get(
+            GALLERY_URL,
+            {'tags': f'{tag1.id},{tag2.id}', 'match': 'all'}
+        )
+
+        ids = [gallery['id'] for gallery in res.data['results']]
+        self.assertEqual(ids, [gallery1.id])
+
+    def test_filter_galleries_invalid_params(self):
+        """Test that malformed filter parameters are rejected"""
+        for params in ({'tags': '1,a'}, {'gallery_items': '1,,2'},
+                       {'tags': '\u00b2'}, {'tags': '1', 'match': 'some'}):
+            res = self.client.get(GALLERY_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_links_roll_back_gallery(self):
+        """Test that a gallery is not saved without its relations"""
+        gallery = sample_gallery(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        gallery.tags.add(tag1)
+
+        with patch('gallery.relations.add_related',
+                   side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(GALLERY_URL, {
+                    'title': 'New gallery',
+                    'description': 'Description',
+                    'tags': [tag1.id]
+                })
+            with self.assertRaises(DatabaseError):
+                self.client.patch(detail_url(gallery.id), {
+                    'title': 'Renamed',
+                    'tags': [tag2.id]
+                })
+
+        self.assertFalse(Gallery.objects.filter(title='New gallery').exists())
+        gallery.refresh_from_db()
+        self.assertNotEqual(gallery.title, 'Renamed')
+        self.assertEqual(list(gallery.tags.all()), [tag1])
+
+    def test_update_gallery_changes_only_differing_links(self):
+        """Test that updating keeps existing links and swaps the rest"""
+        gallery = sample_gallery(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        tag3 = sample_tag(user=self.user, name='Tag 3')
+        gallery.tags.add(tag1, tag2)
+        kept = Gallery.tags.through.objects.get(gallery=gallery, tag=tag1)
+
+        res = self.client.patch(
+            detail_url(gallery.id),
+            {'tags': [tag1.id, tag3.id]}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(res.data['tags']), [tag1.id, tag3.id])
+        self.assertTrue(
+            Gallery.tags.through.objects.filter(id=kept.id).exists()
+        )
+
+    def test_add_and_remove_gallery_items(self):
+        """Test adding and removing gallery items without the full list"""
+        gallery = sample_gallery(user=self.user)
+        item1 = sample_gallery_item(user=self.user)
+        item2 = sample_gallery_item(user=self.user)
+        gallery.gallery_items.add(item1)
+
+        res = self.client.post(
+            add_items_url(gallery.id),
+            {'ids': [item1.id, item2.id]},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(gallery.gallery_items.count(), 2)
+
+        res = self.client.post(
+            remove_items_url(gallery.id),
+            {'ids': [item1.id]},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(gallery.gallery_items.all()), [item2])
+
+    def test_add_gallery_items_of_other_user(self):
+        """Test that another user's gallery items cannot be added"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        gallery = sample_gallery(user=self.user)
+        item = sample_gallery_item(user=user2)
+
+        res = self.client.post(
+            add_items_url(gallery.id),
+            {'ids': [item.id]},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(gallery.gallery_items.count(), 0)
+
+    def test_create_gallery_with_other_users_tags(self):
+        """Test that tags of another user are rejected together"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        tag1 = sample_tag(user=user2, name='Tag 1')
+        tag2 = sample_tag(user=user2, name='Tag 2')
+        payload = {
+            'title': 'Test gallery',
+            'description': 'Test description',
+            'tags': [tag1.id, tag2.id, 0]
+        }
+
+        res = self.client.post(GALLERY_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(res.data['tags']), 3)
+        self.assertFalse(Gallery.objects.exists())
+
+    def test_create_gallery_with_malformed_ids(self):
+        """Test that IDs int() cannot parse are rejected"""
+        payload = {
+            'title': 'Test gallery',
+            'description': 'Test description',
+            'tags': ['\u00b2', True, 'a']
+        }
+
+        res = self.client.post(GALLERY_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(res.data['tags']), 3)
+        self.assertFalse(Gallery.objects.exists())
+
+    def test_create_gallery_related_lookup_batched(self):
+        """Test that submitted IDs are resolved in a single query"""
+        few = [sample_gallery_item(user=self.user).id for _ in range(2)]
+        many = [sample_gallery_item(user=self.user).id for _ in range(50)]
+
+        counts = []
+        for ids in (few, many):
+            payload = {
+                'title': 'Test gallery',
+                'description': 'Test description',
+                'gallery_items': ids,
+                'tags': []
+            }
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(GALLERY_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
@@ -1,17 +1,25 @@
+import io
+import shutil
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from core.models import GalleryItem, Gallery
+from core.models import GalleryItem, Gallery, gallery_item_variant_file_path
 
+from gallery import colors, derivatives, similarity, views
 from gallery.serializers import GalleryItemSerializer
 
 
@@ -23,6 +31,16 @@ def image_upload_url(gallery_item_id):
     return reverse('gallery:galleryitem-upload-image', args=[gallery_item_id])
 
 
+def similar_url(gallery_item_id):
+    """Return URL for gallery items similar to one"""
+    return reverse('gallery:galleryitem-similar', args=[gallery_item_id])
+
+
+def image_transform_url(gallery_item_id):
+    """Return URL for an on-demand image transform"""
+    return reverse('gallery-item-image', args=[gallery_item_id])
+
+
 class PublicGalleryItemApiTests(TestCase):
     """Test the public gallery item API"""
     def setUp(self):
@@ -60,7 +78,7 @@ class PrivateGalleryItemApiTests(TestCase):
         gallery_item = GalleryItem.objects.all().order_by('-name')
         serializer = GalleryItemSerializer(gallery_item, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_gallery_item_limited_to_user(self):
         """Test that gallery item returned are for authenticated user"""
@@ -79,8 +97,8 @@ class PrivateGalleryItemApiTests(TestCase):
         res = self.client.get(GALLERY_ITEM_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], gallery_item.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], gallery_item.name)
 
     def test_create_gallery_item_success(self):
         """Test creating a new gallery item"""
@@ -101,9 +119,56 @@ class PrivateGalleryItemApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_bulk_create_gallery_items(self):
+        """Test creating many gallery items from a list payload"""
+        payload = [
+            {'name': f'Item {i}', 'blurb': f'Blurb {i}'} for i in range(5)
+        ]
+
+        res = self.client.post(GALLERY_ITEM_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            GalleryItem.objects.filter(user=self.user).count(),
+            5
+        )
+        self.assertEqual(res.data[0]['variants'], [])
+
+    def test_bulk_create_gallery_items_query_count(self):
+        """Test that bulk creation queries do not grow with the items"""
+        counts = []
+        for size in (2, 30):
+            payload = [
+                {'name': f'Item {i}', 'blurb': 'Blurb'} for i in range(size)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    GALLERY_ITEM_URL,
+                    payload,
+                    format='json'
+                )
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
 
 class Gallery_Item_Image_Upload_Tests(TestCase):
     def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache = patch.object(
+            views, 'image_cache', views.DiskLRUCache(
+                root=os.path.join(media_root, 'cache', 'transforms'),
+                max_bytes=views.image_cache.max_bytes
+            )
+        )
+        cache.start()
+        self.addCleanup(cache.stop)
+
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             'test@email.com',
@@ -129,6 +194,27 @@ class Gallery_Item_Image_Upload_Tests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.gallery_item.image.path))
 
+    def test_upload_image_records_metadata(self):
+        """Test that upright dimensions and a placeholder are returned"""
+        url = image_upload_url(self.gallery_item.id)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (80, 40)).save(ntf, format='JPEG', exif=exif)
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+            size = os.path.getsize(ntf.name)
+
+        res = self.client.get(GALLERY_ITEM_URL)
+
+        item = res.data['results'][0]
+        self.assertEqual((item['image_width'], item['image_height']), (40, 80))
+        self.assertEqual(item['image_format'], 'jpeg')
+        self.assertEqual(item['image_size'], size)
+        self.assertTrue(
+            item['image_placeholder'].startswith('data:image/jpeg;base64,')
+        )
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
         url = image_upload_url(self.gallery_item.id)
@@ -136,6 +222,65 @@ class Gallery_Item_Image_Upload_Tests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_null_image(self):
+        """Test that clearing the image deletes its variants"""
+        self.upload_image()
+        rendered = derivatives.render(self.gallery_item)
+        derivatives.store(
+            self.gallery_item.id,
+            self.gallery_item.image.name,
+            rendered
+        )
+        names = [
+            variant.image.name for variant in self.gallery_item.variants.all()
+        ]
+        url = image_upload_url(self.gallery_item.id)
+
+        with patch('gallery.derivatives.get_executor') as get_executor, \
+                patch('gallery.derivatives.transaction.on_commit',
+                      side_effect=lambda func: func()):
+            res = self.client.post(url, {'image': None}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['image'])
+        get_executor.assert_not_called()
+        self.assertFalse(self.gallery_item.variants.exists())
+        self.assertEqual(len(names), 4)
+        for name in names:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_clear_keeps_variants_of_new_image(self):
+        """Test that a late clear does not delete a new image's variants"""
+        self.upload_image()
+        derivatives.store(
+            self.gallery_item.id,
+            self.gallery_item.image.name,
+            derivatives.render(self.gallery_item)
+        )
+
+        derivatives.clear(self.gallery_item.id)
+
+        self.assertEqual(self.gallery_item.variants.count(), 4)
+
+    def test_variants_stored_off_pool_thread(self):
+        """Test that rendered variants are stored on the store threads"""
+        self.upload_image()
+        pool = ThreadPoolExecutor(1)
+        with patch('gallery.derivatives.transaction.on_commit',
+                   side_effect=lambda func: func()), \
+                patch('gallery.derivatives.get_executor',
+                      return_value=pool), \
+                patch('gallery.derivatives.get_store_executor') as store:
+            derivatives.schedule(self.gallery_item)
+            pool.shutdown(wait=True)
+
+        (finish, item_id, image_name, future), _ = \
+            store.return_value.submit.call_args
+        self.assertIs(finish, derivatives._finish)
+        self.assertEqual(item_id, self.gallery_item.id)
+        self.assertEqual(image_name, self.gallery_item.image.name)
+        self.assertEqual(len(future.result()), 4)
+
     def test_retrieve_gallery_items_assigned_to_galleries(self):
         """Test filtering gallery items by those assigned to Galleries"""
         gallery_item1 = GalleryItem.objects.create(
@@ -159,8 +304,8 @@ class Gallery_Item_Image_Upload_Tests(TestCase):
 
         serializer1 = GalleryItemSerializer(gallery_item1)
         serializer2 = GalleryItemSerializer(gallery_item2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_retrieve_gallery_items_assigned_unique(self):
         """Test filtering gallery items by assigned returns unique items"""
@@ -190,4 +335,250 @@ class Gallery_Item_Image_Upload_Tests(TestCase):
 
         res = self.client.get(GALLERY_ITEM_URL, {'assigned_only': 1})
 
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def upload_image(self, size=(10, 10)):
+        """Upload a JPEG of the given size to the gallery item"""
+        url = image_upload_url(self.gallery_item.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', size).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+        self.gallery_item.refresh_from_db()
+        return res
+
+    def test_render_and_store_variants(self):
+        """Test that image variants are rendered and serialized"""
+        self.upload_image(size=(800, 400))
+        rendered = derivatives.render(self.gallery_item)
+        derivatives.store(
+            self.gallery_item.id,
+            self.gallery_item.image.name,
+            rendered
+        )
+
+        variants = self.gallery_item.variants.all()
+        self.addCleanup(lambda: [v.image.delete() for v in variants])
+        self.assertEqual(len(variants), 4)
+        thumb = variants.get(name='thumb', format='webp')
+        self.assertEqual((thumb.width, thumb.height), (320, 160))
+        self.assertTrue(os.path.exists(thumb.image.path))
+        serializer = GalleryItemSerializer(self.gallery_item)
+        self.assertEqual(len(serializer.data['variants']), 4)
+
+    def test_store_variants_for_replaced_image(self):
+        """Test that variants of a replaced image are discarded"""
+        self.upload_image()
+        rendered = derivatives.render(self.gallery_item)
+
+        derivatives.store(self.gallery_item.id, 'old.jpg', rendered)
+
+        self.assertFalse(self.gallery_item.variants.exists())
+        for variant in rendered:
+            self.assertFalse(default_storage.exists(
+                gallery_item_variant_file_path(None, variant['filename'])
+            ))
+
+    def test_transform_image(self):
+        """Test that a resized image is generated once and then cached"""
+        self.upload_image(size=(800, 400))
+        url = image_transform_url(self.gallery_item.id)
+
+        with patch('gallery.derivatives.get_executor',
+                   return_value=ThreadPoolExecutor(1)):
+            res = self.client.get(url, {'w': 300, 'fmt': 'webp'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        image = Image.open(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual(image.size, (320, 160))
+
+        with patch('gallery.derivatives.get_executor') as get_executor:
+            res = self.client.get(url, {'w': 300, 'fmt': 'webp'})
+            b''.join(res.streaming_content)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        get_executor.assert_not_called()
+
+    def test_transform_image_negotiates_format(self):
+        """Test that the format follows the Accept header"""
+        self.upload_image()
+        url = image_transform_url(self.gallery_item.id)
+
+        with patch('gallery.derivatives.get_executor',
+                   return_value=ThreadPoolExecutor(1)):
+            res = self.client.get(url, HTTP_ACCEPT='image/webp')
+            b''.join(res.streaming_content)
+
+        self.assertEqual(res['Content-Type'], 'image/webp')
+        self.assertEqual(res['Vary'], 'Accept')
+
+    def test_transform_image_negotiates_by_quality(self):
+        """Test that the format with the highest Accept q-value is chosen"""
+        self.upload_image()
+        url = image_transform_url(self.gallery_item.id)
+        cases = (
+            ('image/webp;q=0, image/*', 'image/jpeg'),
+            ('image/jpeg, image/webp;q=0.5', 'image/jpeg'),
+            ('image/jpeg;q=0.5, image/webp', 'image/webp'),
+            ('image/webp, */*;q=0.8', 'image/webp'),
+            ('*/*', 'image/jpeg'),
+            ('image/png', 'image/jpeg'),
+        )
+
+        with patch('gallery.derivatives.get_executor',
+                   return_value=ThreadPoolExecutor(1)):
+            for accept, content_type in cases:
+                res = self.client.get(url, HTTP_ACCEPT=accept)
+                b''.join(res.streaming_content)
+
+                self.assertEqual(res['Content-Type'], content_type, accept)
+
+    def test_transform_image_invalid_width(self):
+        """Test that widths that are not positive integers are rejected"""
+        self.upload_image()
+        url = image_transform_url(self.gallery_item.id)
+
+        for width in ('0', 'abc', '\u00b2', '-5'):
+            res = self.client.get(url, {'w': width})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transform_image_of_other_user(self):
+        """Test that another user's gallery item image is not served"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        self.upload_image()
+        self.client.force_authenticate(user2)
+
+        res = self.client.get(image_transform_url(self.gallery_item.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SimilarGalleryItemApiTests(TestCase):
+    """Test finding gallery items with similar images"""
+
+    def setUp(self):
+        similarity.indexes.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.items = [
+            GalleryItem.objects.create(user=self.user, image_hash=value)
+            for value in (0b0, 0b1, 0b111111, -1)
+        ]
+
+    def test_similar(self):
+        """Test listing items within a hash distance"""
+        res = self.client.get(similar_url(self.items[0].id), {'distance': 6})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': self.items[1].id, 'distance': 1},
+            {'id': self.items[2].id, 'distance': 6},
+        ])
+
+    def test_similar_follows_changes(self):
+        """Test that the loaded index sees new and deleted items"""
+        self.client.get(similar_url(self.items[0].id))
+        new = GalleryItem.objects.create(user=self.user, image_hash=0b10)
+        self.items[1].delete()
+
+        res = self.client.get(similar_url(self.items[0].id), {'distance': 1})
+
+        self.assertEqual(res.data, [{'id': new.id, 'distance': 1}])
+
+    def test_similar_other_user(self):
+        """Test that other users' items are not visible"""
+        user2 = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        item = GalleryItem.objects.create(user=user2, image_hash=0b0)
+
+        res = self.client.get(similar_url(item.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_similar_invalid_distance(self):
+        """Test that an invalid distance is rejected"""
+        res = self.client.get(similar_url(self.items[0].id), {'distance': 99})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_duplicates(self):
+        """Test grouping items with near identical images"""
+        res = self.client.get(reverse('gallery:galleryitem-duplicates'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [[self.items[0].id, self.items[1].id]])
+
+    def test_duplicates_distance_capped(self):
+        """Test that duplicate searches too wide to prune are rejected"""
+        url = reverse('gallery:galleryitem-duplicates')
+        res = self.client.get(url, {
+            'distance': similarity.MAX_DUPLICATE_DISTANCE + 1
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(
+            str(similarity.MAX_DUPLICATE_DISTANCE),
+            str(res.data['distance'][0])
+        )
+
+        res = self.client.get(url, {
+            'distance': similarity.MAX_DUPLICATE_DISTANCE
+        })
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class ColorSearchGalleryItemApiTests(TestCase):
+    """Test searching gallery items by colour"""
+
+    def setUp(self):
+        colors.indexes.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_search_by_color(self):
+        """Test that matching items are listed nearest first"""
+        red = GalleryItem.objects.create(
+            user=self.user,
+            name='Red',
+            image_palette=bytes((255, 0, 0, 255))
+        )
+        orange = GalleryItem.objects.create(
+            user=self.user,
+            name='Orange',
+            image_palette=bytes((255, 60, 0, 255))
+        )
+        GalleryItem.objects.create(
+            user=self.user,
+            name='Blue',
+            image_palette=bytes((0, 0, 255, 255))
+        )
+
+        res = self.client.get(
+            GALLERY_ITEM_URL,
+            {'color': '#ff0000', 'tolerance': 30}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in res.data['results']],
+            [red.id, orange.id]
+        )
+
+    def test_search_invalid_color(self):
+        """Test that a malformed colour is rejected"""
+        res = self.client.get(GALLERY_ITEM_URL, {'color': 'red'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
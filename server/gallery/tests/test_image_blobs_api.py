@@ -0,0 +1,163 @@
+import io
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import GalleryItem, ImageBlob
+from core.storage import gallery_item_image_storage
+
+
+def image_upload_url(gallery_item_id):
+    """Return URL for image upload"""
+    return reverse('gallery:galleryitem-upload-image', args=[gallery_item_id])
+
+
+def sample_image(color='red'):
+    """Return a small JPEG file"""
+    image = io.BytesIO()
+    Image.new('RGB', (10, 10), color).save(image, format='JPEG')
+    image.seek(0)
+    image.name = 'image.jpg'
+    return image
+
+
+@override_settings(GALLERY_ITEM_IMAGE_STORAGE='content-addressed')
+class ImageBlobApiTests(TestCase):
+    """Test content addressed gallery item image storage"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.items = [
+            GalleryItem.objects.create(user=self.user, name=f'Item {i}')
+            for i in range(2)
+        ]
+
+    def tearDown(self):
+        for name in ImageBlob.objects.values_list('name', flat=True):
+            gallery_item_image_storage.delete(name)
+
+    def upload(self, gallery_item, color='red'):
+        """Upload an image to a gallery item and return its stored name"""
+        res = self.client.post(
+            image_upload_url(gallery_item.id),
+            {'image': sample_image(color)},
+            format='multipart'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        gallery_item.refresh_from_db()
+        return gallery_item.image.name
+
+    def test_identical_uploads_share_blob(self):
+        """Test that identical images are stored once"""
+        name1 = self.upload(self.items[0])
+        name2 = self.upload(self.items[1])
+
+        self.assertEqual(name1, name2)
+        self.assertTrue(name1.startswith('blobs/'))
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.references, 2)
+        self.assertTrue(gallery_item_image_storage.exists(name1))
+
+    def test_replace_and_delete_release_blob(self):
+        """Test that blobs are dropped with their last reference"""
+        name = self.upload(self.items[0])
+        self.upload(self.items[1])
+
+        other = self.upload(self.items[0], color='blue')
+        self.assertNotEqual(other, name)
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 1)
+
+        with patch('core.storage.transaction.on_commit',
+                   side_effect=lambda func: func()):
+            self.items[1].delete()
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+        self.assertFalse(gallery_item_image_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=other).references, 1)
+
+    def test_blob_stored_again_before_collection_kept(self):
+        """Test that a released blob stored again is not deleted"""
+        name = self.upload(self.items[0])
+        self.items[0].delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 0)
+
+        self.upload(self.items[1])
+
+        self.assertFalse(gallery_item_image_storage.collect_blob(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 1)
+        self.assertTrue(gallery_item_image_storage.exists(name))
+
+    def test_failed_save_takes_no_reference(self):
+        """Test that a failed save's blob reference is rolled back"""
+        item = self.items[0]
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                item.image.save('image.jpg', File(sample_image()))
+                raise IntegrityError
+        self.addCleanup(gallery_item_image_storage.delete, item.image.name)
+
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_rolled_back_store_leaves_no_reference(self):
+        """Test that a blob stored in a rolled back save is not counted"""
+        name = self.upload(self.items[0])
+        item = self.items[1]
+        # As when the item's save fails after its image has been stored
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                gallery_item_image_storage.save(
+                    'image.jpg', File(sample_image())
+                )
+                raise IntegrityError
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 1)
+
+        item.refresh_from_db()
+        item.image = name
+        item.save()
+
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 2)
+
+    def test_assigned_blob_name_referenced(self):
+        """Test that assigning an existing blob name adds a reference"""
+        name = self.upload(self.items[0])
+
+        self.items[1].image = name
+        self.items[1].save()
+
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 2)
+
+    def test_serve_blob_immutable(self):
+        """Test that blobs are served with a strong ETag and cached forever"""
+        name = self.upload(self.items[0])
+        url = '/media/' + name
+        digest = name.rsplit('/', 1)[1].split('.')[0]
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['ETag'], f'"{digest}"')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+        res.close()
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{digest}"')
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_serve_missing_blob(self):
+        """Test that an unknown blob returns 404"""
+        res = self.client.get('/media/blobs/ab/cd/' + 'ab' * 32 + '.jpeg')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from gallery.image_cache import DiskLRUCache
+
+
+def write(data):
+    """Return a create callback writing data to the cache path"""
+    def create(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+        return len(data)
+    return create
+
+
+class DiskLRUCacheTests(SimpleTestCase):
+    """Test the on-disk LRU cache"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = DiskLRUCache(self.root, max_bytes=25)
+
+    def test_miss_creates_then_hits(self):
+        """Test that an entry is created once and then served"""
+        with self.cache.get_or_create('a', 'bin', write(b'data')) as f:
+            self.assertEqual(f.read(), b'data')
+
+        def fail(path):
+            raise AssertionError('entry was created again')
+        with self.cache.get_or_create('a', 'bin', fail) as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest unused entries are evicted over the limit"""
+        self.cache.get_or_create('a', 'bin', write(b'x' * 10)).close()
+        self.cache.get_or_create('b', 'bin', write(b'x' * 10)).close()
+        past = time.time() - 60
+        for key in ('a', 'b'):
+            path = self.cache._path(key, 'bin')
+            os.utime(path, (past, past))
+        self.cache.get_or_create('a', 'bin', write(b'')).close()
+
+        self.cache.get_or_create('c', 'bin', write(b'x' * 10)).close()
+
+        self.assertTrue(os.path.exists(self.cache._path('a', 'bin')))
+        self.assertFalse(os.path.exists(self.cache._path('b', 'bin')))
+        self.assertTrue(os.path.exists(self.cache._path('c', 'bin')))
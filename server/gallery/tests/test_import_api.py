@@ -0,0 +1,212 @@
+import csv
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import DataError
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Gallery, GalleryItem, ImportJob, Tag
+
+from gallery import export, imports
+
+
+IMPORT_URL = reverse('gallery:import')
+
+
+def ndjson(*records):
+    """Return records as NDJSON bytes"""
+    return b''.join(json.dumps(record).encode() + b'\n' for record in records)
+
+
+class ImportApiTests(TestCase):
+    """Test importing a library in bulk"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def post(self, body, content_type='application/x-ndjson', **params):
+        url = IMPORT_URL
+        if params:
+            url += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        return self.client.post(url, body, content_type=content_type)
+
+    def test_login_required(self):
+        """Test that importing requires authentication"""
+        res = APIClient().post(IMPORT_URL, b'', content_type='text/csv')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_import_export_round_trip(self):
+        """Test that an exported library imports into another account"""
+        other = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        tag = Tag.objects.create(user=other, name='Tag')
+        item = GalleryItem.objects.create(user=other, name='Item', blurb='B')
+        gallery = Gallery.objects.create(
+            user=other,
+            title='Gallery',
+            description='Description'
+        )
+        gallery.tags.add(tag)
+        gallery.gallery_items.add(item)
+
+        res = self.post(b''.join(export.export_library(other)))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['records'], 3)
+        self.assertEqual(
+            res.data['created'],
+            {'tag': 1, 'gallery_item': 1, 'gallery': 1}
+        )
+        imported = Gallery.objects.get(user=self.user)
+        self.assertEqual(imported.title, 'Gallery')
+        self.assertEqual(
+            list(imported.tags.values_list('name', 'user')),
+            [('Tag', self.user.id)]
+        )
+        self.assertEqual(
+            list(imported.gallery_items.values_list('name', 'blurb')),
+            [('Item', 'B')]
+        )
+
+    def test_import_csv(self):
+        """Test importing CSV with tags referenced by name"""
+        Tag.objects.create(user=self.user, name='Existing')
+        body = (
+            'type,id,name,blurb,title,description,tags,gallery_items\n'
+            'gallery_item,a,Item A,,,,,\n'
+            'gallery_item,b,Item B,,,,,\n'
+            'gallery,,,,Gallery,Text,Existing;New,a;b\n'
+        ).encode()
+
+        res = self.post(body, content_type='text/csv')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        gallery = Gallery.objects.get(user=self.user)
+        self.assertEqual(
+            sorted(gallery.tags.values_list('name', flat=True)),
+            ['Existing', 'New']
+        )
+        self.assertEqual(gallery.gallery_items.count(), 2)
+
+    def test_unknown_reference_rejected(self):
+        """Test that a gallery referring to a missing item fails"""
+        res = self.post(ndjson(
+            {'type': 'tag', 'id': 1, 'name': 'Tag'},
+            {'type': 'gallery', 'title': 'G', 'gallery_items': [9]},
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Record 2', res.data['detail'])
+        self.assertEqual(res.data['records'], 0)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_long_text_rejected(self):
+        """Test that names and tags too long to store are rejected"""
+        for record in (
+            {'type': 'gallery_item', 'name': 'x' * 256},
+            {'type': 'gallery', 'title': 'G', 'tags': ['x' * 256]},
+            {'type': 'tag', 'id': 'x' * 256, 'name': 'Tag'},
+        ):
+            res = self.post(ndjson({'type': 'tag', 'name': 'Tag'}, record))
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Record 2', res.data['detail'])
+            self.assertIn('255 characters', res.data['detail'])
+        self.assertFalse(Tag.objects.exists())
+
+    def test_malformed_fields_rejected(self):
+        """Test that fields of the wrong type fail their record"""
+        for record, message in (
+            ({'type': 'gallery', 'title': 'G', 'gallery_items': 5},
+             'gallery_items must be a list'),
+            ({'type': 'gallery', 'title': 'G', 'tags': 7},
+             'tags must be a list'),
+            ({'type': 'gallery', 'title': 'G', 'tags': 'abc'},
+             'tags must be a list'),
+            ({'type': 'gallery', 'title': 'G', 'tags': [['a']]},
+             'tags must be a list'),
+            ({'type': 'gallery_item', 'name': {'x': 1}},
+             'name must be a string'),
+            ({'type': 'tag', 'name': True}, 'name must be a string'),
+            ({'type': ['tag'], 'name': 'Tag'}, 'Unknown type'),
+        ):
+            res = self.post(ndjson({'type': 'tag', 'name': 'Tag'}, record))
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Record 2', res.data['detail'])
+            self.assertIn(message, res.data['detail'])
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(GalleryItem.objects.exists())
+
+    def test_malformed_csv_rejected(self):
+        """Test that CSV the reader cannot parse fails the import"""
+        field = 'x' * (csv.field_size_limit() + 1)
+        res = self.post(
+            f'type,name\ntag,Tag\ntag,{field}\n'.encode(),
+            content_type='text/csv'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_duplicate_id_rejected(self):
+        """Test that an import ID used twice for one type is rejected"""
+        res = self.post(ndjson(
+            {'type': 'gallery_item', 'id': 'a', 'name': 'Item'},
+            {'type': 'tag', 'id': 'a', 'name': 'Tag'},
+            {'type': 'gallery_item', 'id': 'a', 'name': 'Other'},
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Record 3', res.data['detail'])
+        self.assertIn('Duplicate', res.data['detail'])
+        self.assertFalse(GalleryItem.objects.exists())
+
+    def test_duplicate_id_in_later_chunk_rejected(self):
+        """Test that an import ID committed in an earlier chunk is taken"""
+        job = ImportJob.objects.create(user=self.user)
+        importer = imports.LibraryImporter(job, chunk_size=1)
+
+        with self.assertRaisesMessage(imports.ImportFailed, 'Record 2'):
+            importer.run([
+                {'type': 'gallery_item', 'id': 'a', 'name': 'Item'},
+                {'type': 'gallery_item', 'id': 'a', 'name': 'Other'},
+            ])
+        self.assertEqual(job.records, 1)
+
+    def test_database_error_reported(self):
+        """Test that a chunk the database rejects fails with its offset"""
+        with patch('gallery.imports.insert', side_effect=DataError), \
+                self.assertLogs('gallery.imports', 'ERROR'):
+            res = self.post(ndjson({'type': 'tag', 'name': 'Tag'}))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Records 1 to 1', res.data['detail'])
+        self.assertEqual(res.data['records'], 0)
+        self.assertEqual(ImportJob.objects.get().records, 0)
+
+    def test_resume_other_users_job(self):
+        """Test that another user's job cannot be resumed"""
+        other = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        job = ImportJob.objects.create(user=other)
+
+        res = self.post(b'', job=job.id)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
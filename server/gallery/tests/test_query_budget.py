@@ -0,0 +1,109 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Gallery, GalleryItem, Tag
+
+
+TAGS_URL = reverse('gallery:tag-list')
+GALLERY_ITEM_URL = reverse('gallery:galleryitem-list')
+GALLERY_URL = reverse('gallery:gallery-list')
+
+
+def detail_url(gallery_id):
+    """Return gallery detail URL"""
+    return reverse('gallery:gallery-detail', args=[gallery_id])
+
+
+class QueryBudgetMixin:
+    """Assertions that an endpoint issues a fixed number of queries"""
+
+    def assertQueryBudget(self, budget, url, grow, params=None):
+        """Assert a GET on url stays within budget as grow adds data"""
+        counts = []
+        for _ in range(2):
+            grow()
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1], 'query count grows with data')
+        self.assertLessEqual(counts[1], budget)
+
+
+class GalleryQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Test the gallery API query counts are independent of data size"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.gallery = Gallery.objects.create(
+            user=self.user,
+            title='Test gallery',
+            description='Test description'
+        )
+
+    def add_gallery_contents(self, gallery, count=3):
+        """Attach new tags and gallery items to a gallery"""
+        for i in range(count):
+            gallery.tags.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+            gallery.gallery_items.add(GalleryItem.objects.create(
+                user=self.user,
+                name=f'Item {i}',
+                blurb=f'Blurb {i}'
+            ))
+
+    def add_galleries(self, count=5):
+        """Create galleries that each have tags and gallery items"""
+        for i in range(count):
+            gallery = Gallery.objects.create(
+                user=self.user,
+                title=f'Gallery {i}',
+                description='Description'
+            )
+            self.add_gallery_contents(gallery)
+
+    def test_list_tags_budget(self):
+        """Test listing tags uses a fixed number of queries"""
+        self.assertQueryBudget(1, TAGS_URL, self.add_galleries)
+        self.assertQueryBudget(
+            1, TAGS_URL, self.add_galleries, {'assigned_only': 1}
+        )
+
+    def test_list_gallery_items_budget(self):
+        """Test listing gallery items uses a fixed number of queries"""
+        self.assertQueryBudget(2, GALLERY_ITEM_URL, self.add_galleries)
+        self.assertQueryBudget(
+            2, GALLERY_ITEM_URL, self.add_galleries, {'assigned_only': 1}
+        )
+
+    def test_list_galleries_budget(self):
+        """Test listing galleries uses a fixed number of queries"""
+        self.assertQueryBudget(3, GALLERY_URL, self.add_galleries)
+
+    def test_filter_galleries_budget(self):
+        """Test filtering galleries uses a fixed number of queries"""
+        tag = Tag.objects.create(user=self.user, name='Filter')
+        self.gallery.tags.add(tag)
+
+        self.assertQueryBudget(
+            3, GALLERY_URL, self.add_galleries, {'tags': str(tag.id)}
+        )
+
+    def test_retrieve_gallery_budget(self):
+        """Test retrieving a gallery uses a fixed number of queries"""
+        self.assertQueryBudget(
+            4,
+            detail_url(self.gallery.id),
+            lambda: self.add_gallery_contents(self.gallery)
+        )
@@ -0,0 +1,119 @@
+import random
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.test import SimpleTestCase
+
+from gallery import imaging
+from gallery.similarity import HASH_MASK, HashIndex, hamming, popcount
+
+
+class HashIndexTests(SimpleTestCase):
+    """Test the hash distance index"""
+
+    def random_rows(self, count, seed=0):
+        """Return (id, hash) rows with near and exact copies mixed in"""
+        rng = random.Random(seed)
+        rows = []
+        for item_id in range(1, count + 1):
+            if item_id % 7 == 0:
+                value = rows[-1][1] ^ (1 << rng.randrange(64))
+            elif item_id % 11 == 0:
+                value = rows[-1][1]
+            else:
+                value = rng.getrandbits(64) - (1 << 63)
+            rows.append((item_id, value))
+        return rows
+
+    def scan_groups(self, rows, radius):
+        """Return the duplicate groups of rows found by comparing all pairs"""
+        parents = {item_id: item_id for item_id, _ in rows}
+
+        def find(item_id):
+            while parents[item_id] != item_id:
+                item_id = parents[item_id]
+            return item_id
+
+        for i, (item_id, value) in enumerate(rows):
+            for other_id, other in rows[i + 1:]:
+                if hamming(value & HASH_MASK, other & HASH_MASK) <= radius:
+                    parents[find(other_id)] = find(item_id)
+
+        groups = {}
+        for item_id in parents:
+            groups.setdefault(find(item_id), []).append(item_id)
+        return sorted(
+            sorted(group) for group in groups.values() if len(group) > 1
+        )
+
+    def test_search_matches_scan(self):
+        """Test that similar items are exactly those a full scan finds"""
+        rows = self.random_rows(300)
+        index = HashIndex(rows)
+        hashes = {item_id: value & HASH_MASK for item_id, value in rows}
+
+        for item_id in (1, 6, 7, 11):
+            expected = sorted(
+                (hamming(hashes[item_id], value), other_id)
+                for other_id, value in hashes.items()
+                if other_id != item_id and
+                hamming(hashes[item_id], value) <= 20
+            )
+            self.assertEqual(index.similar(item_id, 20), expected)
+
+    def test_duplicates_match_scan(self):
+        """Test that duplicate groups are those a full scan finds"""
+        rows = self.random_rows(300)
+        index = HashIndex(rows)
+
+        for radius in (0, 1, 4, 10, 20):
+            self.assertEqual(
+                index.duplicates(radius),
+                self.scan_groups(rows, radius)
+            )
+
+    def test_duplicates_scale(self):
+        """Test that finding duplicates does not compare every pair"""
+        rows = self.random_rows(20000)
+        compared = []
+
+        def counted(values):
+            compared.append(len(values))
+            return popcount(values)
+
+        with patch('gallery.similarity.popcount', side_effect=counted):
+            groups = HashIndex(rows).duplicates(4)
+
+        self.assertIn([6, 7], groups)
+        self.assertIn([20, 21, 22], groups)
+        # Comparing every pair would take 2 * 10 ** 8
+        self.assertLess(sum(compared), 10 ** 6)
+
+    def test_set(self):
+        """Test that changed and removed hashes are not found"""
+        index = HashIndex([(1, 0b1010), (2, 0b1011), (3, 0b1000)])
+        index.set(1, None)
+        index.set(3, 0b0011)
+
+        self.assertEqual(index.similar(2, 1), [(1, 3)])
+        self.assertEqual(index.similar(1, 64), [])
+
+    def test_duplicate_groups(self):
+        """Test that chains of close hashes form one group"""
+        index = HashIndex([(1, 0b0000), (2, 0b0001), (3, 0b0011), (4, -1)])
+
+        self.assertEqual(index.duplicates(1), [[1, 2, 3]])
+        self.assertEqual(index.similar(1, 2), [(1, 2), (2, 3)])
+
+    def test_dhash_survives_resizing(self):
+        """Test that a resized copy of an image hashes nearby"""
+        image = Image.new('RGB', (200, 100))
+        for x in range(200):
+            for y in range(100):
+                image.putpixel((x, y), (x, y * 2, (x * y) % 256))
+
+        original = imaging.dhash(image)
+        resized = imaging.dhash(image.resize((90, 45)))
+
+        self.assertLessEqual(hamming(original, resized), 4)
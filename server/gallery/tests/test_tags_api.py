@@ -3,10 +3,12 @@ from django.urls import reverse
 from django.test import TestCase
 
 from rest_framework import status
+from rest_framework.pagination import Cursor
 from rest_framework.test import APIClient
 
 from core.models import Tag, Gallery
 
+from gallery.pagination import GalleryAttrPagination
 from gallery.serializers import TagSerializer
 
 
@@ -47,7 +49,7 @@ class PrivateTagsApiTests(TestCase):
         tags = Tag.objects.all().order_by('-name')
         serializer = TagSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_tags_limited_to_user(self):
         """Test that tags returned are for authenticated user"""
@@ -61,8 +63,8 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
 
     def test_create_tag_successful(self):
         """Test creating a new tag"""
@@ -97,8 +99,8 @@ class PrivateTagsApiTests(TestCase):
 
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_retrieve_tags_assigned_unique(self):
         """Test filtering tags by assigned returns unique items"""
@@ -119,4 +121,69 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_tags_paginated_by_cursor(self):
+        """Test paging through tags with duplicate names by cursor"""
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Beach', 'Beach', 'Beach', 'Alps', 'Cats')
+        ]
+
+        res = self.client.get(TAGS_URL, {'page_size': 2})
+        ids = [tag['id'] for tag in res.data['results']]
+        pages = [res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            pages.append(res.data['results'])
+            ids.extend(tag['id'] for tag in res.data['results'])
+
+        expected = Tag.objects.filter(
+            id__in=[tag.id for tag in tags]
+        ).order_by('-name', 'id')
+        self.assertEqual(ids, [tag.id for tag in expected])
+        self.assertEqual(len(pages), 3)
+
+        res = self.client.get(res.data['previous'])
+        self.assertEqual(res.data['results'], pages[1])
+        self.assertNotIn('X-Estimated-Total', res)
+
+    def test_tags_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        res = self.client.get(TAGS_URL, {'cursor': 'notacursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tags_cursor_invalid_values(self):
+        """Test that a cursor with values of the wrong type is rejected"""
+        paginator = GalleryAttrPagination()
+        paginator.base_url = f'http://testserver{TAGS_URL}'
+        url = paginator.encode_cursor(
+            Cursor(offset=0, reverse=False, position='["x", "abc"]')
+        )
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_create_tags(self):
+        """Test creating many tags from a list payload"""
+        payload = [{'name': f'Tag {i}'} for i in range(20)]
+
+        with self.assertNumQueries(3):
+            res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 20)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 20)
+
+    def test_bulk_create_tags_invalid(self):
+        """Test that one invalid tag rejects the batch with its error"""
+        payload = [{'name': 'Valid'}, {'name': ''}, {'name': 'Also valid'}]
+
+        res = self.client.post(TAGS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('name', res.data[1])
+        self.assertFalse(Tag.objects.filter(user=self.user).exists())
@@ -0,0 +1,185 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import GalleryItem, UploadSession
+
+
+def sessions_url(gallery_item_id):
+    """Return URL for starting an upload session"""
+    return reverse(
+        'gallery:galleryitem-upload-sessions',
+        args=[gallery_item_id]
+    )
+
+
+def session_url(session_id):
+    """Return URL for an upload session"""
+    return reverse('gallery:uploadsession-detail', args=[session_id])
+
+
+def finalize_url(session_id):
+    """Return URL for finalizing an upload session"""
+    return reverse('gallery:uploadsession-finalize', args=[session_id])
+
+
+def sample_image_bytes():
+    """Return the bytes of a small JPEG"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (20, 20)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class UploadSessionApiTests(TestCase):
+    """Test resumable chunked image uploads"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@email.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.gallery_item = GalleryItem.objects.create(user=self.user)
+        self.data = sample_image_bytes()
+
+    def tearDown(self):
+        self.gallery_item.refresh_from_db()
+        self.gallery_item.image.delete()
+
+    def start_session(self, size=None):
+        """Start an upload session and return its ID"""
+        res = self.client.post(
+            sessions_url(self.gallery_item.id),
+            {'size': size or len(self.data)}
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def put_chunk(self, session_id, start, end):
+        """Send bytes start-end of the sample image"""
+        return self.client.generic(
+            'PUT',
+            session_url(session_id),
+            self.data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}'
+        )
+
+    def test_chunked_upload(self):
+        """Test uploading an image in chunks and finalizing it"""
+        session_id = self.start_session()
+        middle = len(self.data) // 2
+
+        res = self.put_chunk(session_id, 0, middle)
+        self.assertEqual(res.data['offset'], middle)
+        res = self.client.get(session_url(session_id))
+        self.assertEqual(res.data['offset'], middle)
+        res = self.put_chunk(session_id, middle, len(self.data))
+        self.assertEqual(res.data['offset'], len(self.data))
+
+        res = self.client.post(finalize_url(session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.gallery_item.refresh_from_db()
+        with open(self.gallery_item.image.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(self.gallery_item.image_width, 20)
+        self.assertEqual(self.gallery_item.image_size, len(self.data))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunk_at_wrong_offset(self):
+        """Test that a chunk not starting at the offset is rejected"""
+        session_id = self.start_session()
+
+        res = self.put_chunk(session_id, 10, 20)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 0)
+
+    def test_finalize_incomplete_upload(self):
+        """Test that an incomplete upload cannot be finalized"""
+        session_id = self.start_session()
+        self.put_chunk(session_id, 0, 10)
+
+        res = self.client.post(finalize_url(session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 10)
+
+    def test_finalize_invalid_image(self):
+        """Test that an upload that is not an image is rejected"""
+        self.data = b'notimage' * 10
+        session_id = self.start_session()
+        self.put_chunk(session_id, 0, len(self.data))
+
+        res = self.client.post(finalize_url(session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_session_removes_file(self):
+        """Test that deleting a session removes its partial file"""
+        session_id = self.start_session()
+        self.put_chunk(session_id, 0, 10)
+        session = UploadSession.objects.get(id=session_id)
+        path = session.gallery_item.image.storage.path(session.file_name)
+
+        res = self.client.delete(session_url(session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(path))
+
+    def expire(self, session_id):
+        """Backdate a session past UPLOAD_SESSION_TTL"""
+        UploadSession.objects.filter(id=session_id).update(
+            created=timezone.now() - timedelta(seconds=61)
+        )
+
+    @override_settings(UPLOAD_SESSION_TTL=60)
+    def test_expired_session_not_found(self):
+        """Test that chunks cannot be sent to an expired session"""
+        session_id = self.start_session()
+        self.expire(session_id)
+
+        res = self.put_chunk(session_id, 0, 10)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(UPLOAD_SESSION_TTL=60)
+    def test_expire_upload_sessions(self):
+        """Test that the command deletes only expired sessions and files"""
+        expired_id = self.start_session()
+        self.put_chunk(expired_id, 0, 10)
+        self.expire(expired_id)
+        expired = UploadSession.objects.get(id=expired_id)
+        path = self.gallery_item.image.storage.path(expired.file_name)
+        fresh_id = self.start_session()
+
+        call_command('expire_upload_sessions', stdout=io.StringIO())
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(
+            [str(pk) for pk in UploadSession.objects.values_list(
+                'id', flat=True
+            )],
+            [fresh_id]
+        )
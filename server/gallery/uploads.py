@@ -0,0 +1,108 @@
+import fcntl
+import os
+import re
+
+from PIL import Image
+
+from django.core.files.storage import default_storage
+
+from core.models import gallery_item_image_file_path
+
+
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class UploadError(Exception):
+    """A chunk or finalize request that does not fit the session"""
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+def parse_content_range(header):
+    """Return (start, end, total) from a Content-Range header
+
+    end is exclusive and total is None for an unknown length.
+    """
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise UploadError('Content-Range must be "bytes <start>-<end>/<size>"')
+    start, end = int(match.group(1)), int(match.group(2)) + 1
+    total = None if match.group(3) == '*' else int(match.group(3))
+    if end <= start:
+        raise UploadError('Content-Range end is before its start')
+
+    return start, end, total
+
+
+def get_offset(session):
+    """Return the number of bytes received so far"""
+    try:
+        return os.path.getsize(default_storage.path(session.file_name))
+    except FileNotFoundError:
+        return 0
+
+
+def append_chunk(session, start, end, stream):
+    """Append bytes start-end read from stream to the session's file
+
+    The file on disk is the source of truth for the offset, so a chunk cut
+    short by a dropped connection can be resumed from wherever it stopped.
+    Returns the new offset.
+    """
+    if end > session.size:
+        raise UploadError('Chunk extends past the upload size')
+
+    path = default_storage.path(session.file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            offset = os.fstat(f.fileno()).st_size
+            raise UploadError('Another chunk is being written', offset)
+
+        offset = os.fstat(f.fileno()).st_size
+        if start != offset:
+            raise UploadError('Chunk does not start at the offset', offset)
+
+        remaining = end - start
+        while remaining:
+            data = stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+        f.flush()
+
+        return end - remaining
+
+
+def finalize(session):
+    """Validate the uploaded file and move it into place as the image
+
+    The file is renamed into its final location on the same volume, so it
+    is never copied. Returns the new image's storage name.
+    """
+    storage = session.gallery_item.image.storage
+    path = default_storage.path(session.file_name)
+    if get_offset(session) != session.size:
+        raise UploadError('Upload is incomplete', get_offset(session))
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            ext = image.format.lower()
+    except Exception:
+        raise UploadError('Upload a valid image.')
+
+    name = gallery_item_image_file_path(session.gallery_item, f'image.{ext}')
+    return storage.ingest(path, name)
+
+
+def discard(session):
+    """Delete the session's partial file"""
+    default_storage.delete(session.file_name)
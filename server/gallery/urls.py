@@ -8,9 +8,12 @@ router = DefaultRouter()
 router.register('tags', views.TagViewSet)
 router.register('gallery-items', views.GalleryItemViewSet)
 router.register('galleries', views.GalleryViewSet)
+router.register('upload-sessions', views.UploadSessionViewSet)
 
 app_name = 'gallery'
 
 urlpatterns = [
+    path('export/', views.ExportView.as_view(), name='export'),
+    path('import/', views.ImportView.as_view(), name='import'),
     path('', include(router.urls))
 ]
@@ -1,35 +1,88 @@
+import csv
+import io
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Count, Exists, IntegerField, OuterRef, Prefetch, Subquery
+)
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.http.multipartparser import parse_header
+from django.shortcuts import get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
+from rest_framework import viewsets, mixins, status, HTTP_HEADER_ENCODING
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 
-from core.models import Tag, GalleryItem, Gallery
+from core import metrics
+from core.instrumentation import TimedSerializationMixin
+from core.models import Tag, GalleryItem, Gallery, ImportJob, UploadSession
+from core.storage import gallery_item_image_storage
 
-from gallery import serializers
+from gallery import (
+    colors, derivatives, export, imaging, imports, pagination, relations,
+    serializers, similarity, uploads
+)
+from gallery.image_cache import DiskLRUCache
+from user.authentication import (
+    CachedTokenAuthentication, SignedTokenAuthentication
+)
 
 
-class BaseGalleryAttr(viewsets.GenericViewSet,
+class BaseGalleryAttr(TimedSerializationMixin,
+                      viewsets.GenericViewSet,
                       mixins.ListModelMixin,
                       mixins.CreateModelMixin):
     """Base viewset for user owned gallery attributes"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
     permission_classes = (IsAuthenticated,)
+    pagination_class = pagination.GalleryAttrPagination
+    max_bulk_create = 1000
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         if assigned_only:
-            queryset = queryset.filter(
-               gallery__isnull=False
+            relation = getattr(Gallery, self.gallery_relation)
+            links = relation.through.objects.filter(**{
+                relation.field.m2m_reverse_field_name(): OuterRef('pk')
+            })
+            queryset = queryset.annotate(
+                _assigned=Exists(links)
+            ).filter(_assigned=True)
+
+        return queryset.order_by('-name', 'id')
+
+    def create(self, request, *args, **kwargs):
+        """Create an object, or every object in a list payload"""
+        many = isinstance(request.data, list)
+        if many and len(request.data) > self.max_bulk_create:
+            raise ValidationError(
+                f'At most {self.max_bulk_create} objects can be created.'
             )
-        return queryset.filter(
-            user=self.request.user
-            ).order_by('-name').distinct()
+
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED,
+            headers=headers
+        )
 
     def perform_create(self, serializer):
         """Create a new object"""
@@ -40,12 +93,45 @@ class TagViewSet(BaseGalleryAttr):
     """Manage tags in the database"""
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    gallery_relation = 'tags'
 
 
 class GalleryItemViewSet(BaseGalleryAttr):
     """Manage gallery item in the database"""
     queryset = GalleryItem.objects.all()
     serializer_class = serializers.GalleryItemSerializer
+    gallery_relation = 'gallery_items'
+
+    def get_queryset(self):
+        """Return gallery items, loading what the list renders"""
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return self.serializer_class.setup_eager_loading(queryset)
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """List gallery items, nearest first when a colour is given"""
+        if 'color' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        query = serializers.ColorQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ranked = colors.indexes.get(request.user.id).search(
+            colors.parse_hex(query.validated_data['color']),
+            query.validated_data['tolerance']
+        )[:self.paginator.get_page_size(request)]
+
+        items = self.get_queryset().in_bulk(
+            [item_id for _, item_id in ranked]
+        )
+        serializer = self.get_serializer(
+            [items[item_id] for _, item_id in ranked if item_id in items],
+            many=True
+        )
+        return Response(
+            {'next': None, 'previous': None, 'results': serializer.data}
+        )
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
@@ -53,6 +139,8 @@ class GalleryItemViewSet(BaseGalleryAttr):
             return serializers.GalleryItemSerializer
         elif self.action == 'upload_image':
             return serializers.GalleryItemImageSerializer
+        elif self.action == 'upload_sessions':
+            return serializers.UploadSessionSerializer
 
         return self.serializer_class
 
@@ -65,7 +153,14 @@ class GalleryItemViewSet(BaseGalleryAttr):
             data=request.data
         )
         if serializer.is_valid():
-            serializer.save()
+            # A stored blob's reference is rolled back with a failed save
+            with transaction.atomic():
+                gallery_item = serializer.save()
+            derivatives.schedule(gallery_item)
+            metrics.upload_bytes.inc(
+                gallery_item.image_size or 0,
+                kind='image'
+            )
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -76,31 +171,230 @@ class GalleryItemViewSet(BaseGalleryAttr):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(methods=['POST'], detail=True, url_path='upload-sessions')
+    def upload_sessions(self, request, pk=None):
+        """Start a resumable upload of a gallery item image"""
+        gallery_item = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user, gallery_item=gallery_item)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _hash_distance(self, default, serializer_class):
+        """Return the validated distance query parameter"""
+        distance = self.request.query_params.get('distance', default)
+        serializer = serializer_class(data={'distance': distance})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['distance']
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """List gallery items whose images look like this one's"""
+        gallery_item = self.get_object()
+        distance = self._hash_distance(
+            similarity.SIMILAR_DISTANCE,
+            serializers.SimilarityQuerySerializer
+        )
+        index = similarity.indexes.get(request.user.id)
+        return Response([
+            {'id': item_id, 'distance': item_distance}
+            for item_distance, item_id
+            in index.similar(gallery_item.id, distance)
+        ])
+
+    @action(methods=['GET'], detail=False)
+    def duplicates(self, request):
+        """List groups of gallery items with near identical images"""
+        distance = self._hash_distance(
+            similarity.DUPLICATE_DISTANCE,
+            serializers.DuplicateQuerySerializer
+        )
+        index = similarity.indexes.get(request.user.id)
+        return Response(index.duplicates(distance))
+
+
+class UploadSessionViewSet(TimedSerializationMixin,
+                           viewsets.GenericViewSet,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin):
+    """Upload gallery item images in resumable chunks"""
+    queryset = UploadSession.objects.all()
+    serializer_class = serializers.UploadSessionSerializer
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        """Return the current user's unexpired upload sessions"""
+        return self.queryset.filter(
+            user=self.request.user,
+            created__gte=UploadSession.expiry_cutoff()
+        )
+
+    def get_serializer_class(self):
+        """Return appropriate serializer class"""
+        if self.action == 'finalize':
+            return serializers.GalleryItemImageSerializer
+
+        return self.serializer_class
+
+    def _upload_error(self, error):
+        """Return a response for an upload error"""
+        if error.offset is None:
+            return Response(
+                {'detail': str(error)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            {'detail': str(error), 'offset': error.offset},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    def update(self, request, pk=None):
+        """Append the byte range in Content-Range to the upload"""
+        session = self.get_object()
+        try:
+            start, end, total = uploads.parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE')
+            )
+            if total is not None and total != session.size:
+                raise uploads.UploadError(
+                    'Content-Range size does not match the upload size'
+                )
+            offset = uploads.append_chunk(
+                session, start, end, request.stream or io.BytesIO()
+            )
+        except uploads.UploadError as error:
+            return self._upload_error(error)
+
+        metrics.upload_bytes.inc(offset - start, kind='chunk')
+        return Response({'offset': offset})
+
+    @action(methods=['POST'], detail=True)
+    def finalize(self, request, pk=None):
+        """Attach the completed upload to its gallery item"""
+        session = self.get_object()
+        gallery_item = session.gallery_item
+        try:
+            with transaction.atomic():
+                gallery_item.image = uploads.finalize(session)
+                with gallery_item.image.open('rb') as image_file:
+                    derivatives.describe(gallery_item, image_file)
+                gallery_item.save(
+                    update_fields=['image', *derivatives.METADATA_FIELDS]
+                )
+                session.delete()
+        except uploads.UploadError as error:
+            return self._upload_error(error)
+
+        derivatives.schedule(gallery_item)
+
+        serializer = self.get_serializer(gallery_item)
+        return Response(serializer.data)
+
+    def perform_destroy(self, instance):
+        """Delete the session and its partial file"""
+        uploads.discard(instance)
+        instance.delete()
 
-class GalleryViewSet(viewsets.ModelViewSet):
+
+class GalleryViewSet(TimedSerializationMixin, viewsets.ModelViewSet):
     """Manage gallery in the database"""
     serializer_class = serializers.GallerySerializer
     queryset = Gallery.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
     permission_classes = (IsAuthenticated,)
+    pagination_class = pagination.GalleryPagination
+    max_filter_ids = 100
+
+    def _params_to_ints(self, qs, param):
+        """Convert a list of string IDs to a set of integers"""
+        str_ids = qs.split(',')
+        if len(str_ids) > self.max_filter_ids:
+            raise ValidationError(
+                {param: f'At most {self.max_filter_ids} IDs are allowed.'}
+            )
+        if not all(serializers.DIGITS.fullmatch(str_id) for str_id in str_ids):
+            raise ValidationError(
+                {param: 'Must be a comma separated list of IDs.'}
+            )
+
+        return {int(str_id) for str_id in str_ids}
+
+    def _filter_related(self, queryset, through, column, ids, match):
+        """Filter galleries linked to any or all ids via a through table"""
+        links = through.objects.filter(
+            gallery_id=OuterRef('pk'),
+            **{f'{column}__in': ids}
+        )
+        alias = f'_{column}_match'
+        if match == 'any':
+            return queryset.annotate(
+                **{alias: Exists(links)}
+            ).filter(**{alias: True})
 
-    def _params_to_ints(self, qs):
-        """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+        matches = links.order_by().values('gallery_id').annotate(
+            count=Count('pk')
+        ).values('count')
+        return queryset.annotate(
+            **{alias: Subquery(matches, output_field=IntegerField())}
+        ).filter(**{alias: len(ids)})
+
+    def _get_prefetches(self):
+        """Return prefetches loading only the columns the action renders"""
+        item_serializer = serializers.GalleryItemSerializer
+        if self.action == 'retrieve':
+            gallery_items = item_serializer.setup_eager_loading(
+                GalleryItem.objects.all()
+            )
+            tags = Tag.objects.only(*serializers.TagSerializer.Meta.fields)
+        elif self.action == 'list':
+            gallery_items = GalleryItem.objects.only('id')
+            tags = Tag.objects.only('id')
+        else:
+            return ()
+
+        return (
+            Prefetch('gallery_items', queryset=gallery_items.order_by('id')),
+            Prefetch('tags', queryset=tags.order_by('id')),
+        )
 
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
         tags = self.request.query_params.get('tags')
         gallery_items = self.request.query_params.get('gallery_items')
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': 'Must be "any" or "all".'})
+
         queryset = self.queryset.filter(user=self.request.user)
         if tags:
-            tags_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tags_ids)
+            tags_ids = self._params_to_ints(tags, 'tags')
+            queryset = self._filter_related(
+                queryset, Gallery.tags.through, 'tag_id', tags_ids, match
+            )
         if gallery_items:
-            gallery_items_ids = self._params_to_ints(gallery_items)
-            queryset = queryset.filter(gallery_items__id__in=gallery_items_ids)
+            gallery_items_ids = self._params_to_ints(
+                gallery_items,
+                'gallery_items'
+            )
+            queryset = self._filter_related(
+                queryset,
+                Gallery.gallery_items.through,
+                'galleryitem_id',
+                gallery_items_ids,
+                match
+            )
 
-        return queryset.filter(user=self.request.user)
+        return queryset.prefetch_related(
+            *self._get_prefetches()
+        ).order_by('-id')
 
     def perform_create(self, serializer):
         """Create a new object"""
@@ -110,5 +404,270 @@ class GalleryViewSet(viewsets.ModelViewSet):
         """Return appropriate serializer class"""
         if self.action == 'retrieve':
             return serializers.GalleryDetailSerializer
+        elif self.action in ('add_items', 'remove_items',
+                             'add_tags', 'remove_tags'):
+            return serializers.GalleryRelationSerializer
 
         return self.serializer_class
+
+    def _change_related(self, request, field_name, add):
+        """Add or remove the IDs in the payload on a gallery relation"""
+        gallery = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+
+        if not add:
+            relations.remove_related(gallery, field_name, ids)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        model = getattr(Gallery, field_name).field.related_model
+        owned = model.objects.filter(
+            user=self.request.user,
+            id__in=ids
+        ).values_list('id', flat=True)
+        missing = sorted(ids - set(owned))
+        if missing:
+            raise ValidationError(
+                {'ids': [f'Invalid pk "{pk}" - object does not exist.'
+                         for pk in missing]}
+            )
+        relations.add_related(gallery, field_name, ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['POST'], detail=True, url_path='add-items')
+    def add_items(self, request, pk=None):
+        """Add gallery items to a gallery"""
+        return self._change_related(request, 'gallery_items', add=True)
+
+    @action(methods=['POST'], detail=True, url_path='remove-items')
+    def remove_items(self, request, pk=None):
+        """Remove gallery items from a gallery"""
+        return self._change_related(request, 'gallery_items', add=False)
+
+    @action(methods=['POST'], detail=True, url_path='add-tags')
+    def add_tags(self, request, pk=None):
+        """Add tags to a gallery"""
+        return self._change_related(request, 'tags', add=True)
+
+    @action(methods=['POST'], detail=True, url_path='remove-tags')
+    def remove_tags(self, request, pk=None):
+        """Remove tags from a gallery"""
+        return self._change_related(request, 'tags', add=False)
+
+
+image_cache = DiskLRUCache(
+    root=os.path.join(settings.MEDIA_ROOT, 'cache', 'transforms'),
+    max_bytes=getattr(settings, 'IMAGE_CACHE_MAX_BYTES', 1024 ** 3)
+)
+
+
+class GalleryItemImageView(APIView):
+    """Serve a gallery item image resized and transcoded on demand"""
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
+    permission_classes = (IsAuthenticated,)
+    widths = (160, 320, 640, 1024, 1600, 2048)
+    formats = {
+        'webp': ('WEBP', 'image/webp'),
+        'jpeg': ('JPEG', 'image/jpeg'),
+    }
+    quality = 80
+
+    def perform_content_negotiation(self, request, force=False):
+        """Accept image-only Accept headers, rendering errors as JSON"""
+        return super().perform_content_negotiation(request, force=True)
+
+    def _get_width(self, request):
+        """Return the smallest allowed width covering the requested one"""
+        width = request.query_params.get('w')
+        if width is None:
+            return self.widths[-1]
+        if not serializers.DIGITS.fullmatch(width) or int(width) == 0:
+            raise ValidationError({'w': 'Must be a positive integer.'})
+
+        return next(
+            (allowed for allowed in self.widths if allowed >= int(width)),
+            self.widths[-1]
+        )
+
+    def _get_format(self, request):
+        """Return the requested format, or the best one the client accepts"""
+        fmt = request.query_params.get('fmt')
+        if fmt is not None:
+            if fmt not in self.formats:
+                raise ValidationError(
+                    {'fmt': f'Must be one of {", ".join(self.formats)}.'}
+                )
+            return fmt, False
+
+        ranges = self._parse_accept(request.META.get('HTTP_ACCEPT', ''))
+        # JPEG first, so it wins ties such as a bare */*
+        candidates = sorted(self.formats, key=lambda fmt: fmt != 'jpeg')
+        preferences = {
+            fmt: self._preference(ranges, self.formats[fmt][1])
+            for fmt in candidates
+        }
+        fmt = max(candidates, key=preferences.get)
+        if preferences[fmt][0] > 0:
+            return fmt, True
+        return 'jpeg', True
+
+    @staticmethod
+    def _parse_accept(accept):
+        """Return the (type, subtype, q) of each Accept media range"""
+        ranges = []
+        for media_range in accept.split(','):
+            full_type, params = parse_header(
+                media_range.strip().encode(HTTP_HEADER_ENCODING)
+            )
+            main_type, _, sub_type = full_type.partition('/')
+            try:
+                q = float(params.get('q', b'1'))
+            except ValueError:
+                continue
+            if sub_type and 0 <= q <= 1:
+                ranges.append((main_type, sub_type, q))
+        return ranges
+
+    @staticmethod
+    def _preference(ranges, content_type):
+        """Return the (q, specificity) of the range matching content_type
+
+        The most specific matching range sets the q, as RFC 7231 section
+        5.3.2 specifies, so image/webp;q=0 refuses WebP despite image/*.
+        """
+        main_type, sub_type = content_type.split('/')
+        best = (0, -1)
+        for range_type, range_sub_type, q in ranges:
+            if range_type == '*' and range_sub_type == '*':
+                specificity = 0
+            elif range_type != main_type:
+                continue
+            elif range_sub_type == '*':
+                specificity = 1
+            elif range_sub_type == sub_type:
+                specificity = 2
+            else:
+                continue
+            if specificity > best[1]:
+                best = (q, specificity)
+        return best
+
+    def get(self, request, pk):
+        """Return the transformed image, generating it on a cache miss"""
+        gallery_item = get_object_or_404(
+            GalleryItem.objects.only('id', 'user_id', 'image'),
+            pk=pk,
+            user=request.user
+        )
+        if not gallery_item.image:
+            raise NotFound()
+
+        width = self._get_width(request)
+        fmt, negotiated = self._get_format(request)
+        pil_format, content_type = self.formats[fmt]
+
+        def create(path):
+            return derivatives.get_executor().submit(
+                imaging.render_transform,
+                gallery_item.image.path,
+                path,
+                width,
+                pil_format,
+                self.quality
+            ).result()
+
+        image = image_cache.get_or_create(
+            f'{gallery_item.image.name}:{width}:{fmt}',
+            imaging.FORMAT_EXTENSIONS[pil_format],
+            create
+        )
+        response = FileResponse(image, content_type=content_type)
+        response['Cache-Control'] = 'private, max-age=86400'
+        if negotiated:
+            response['Vary'] = 'Accept'
+
+        return response
+
+
+class ExportView(APIView):
+    """Stream the authenticated user's whole library as NDJSON"""
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Return the tags, gallery items and galleries, one per line"""
+        response = StreamingHttpResponse(
+            export.export_library(request.user),
+            content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="library.ndjson"'
+        )
+        return response
+
+
+class ImportView(APIView):
+    """Import a library from NDJSON or CSV in the request body"""
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        """Import the records, resuming the job given as ?job= if any"""
+        query = serializers.ImportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        if 'job' in query.validated_data:
+            job = get_object_or_404(
+                ImportJob,
+                id=query.validated_data['job'],
+                user=request.user
+            )
+        else:
+            job = ImportJob.objects.create(user=request.user)
+
+        if request.content_type.startswith('text/csv'):
+            records = imports.read_csv(request.stream or io.BytesIO())
+        else:
+            records = imports.read_ndjson(request.stream or io.BytesIO())
+        importer = imports.LibraryImporter(job)
+        try:
+            importer.run(records)
+        except (imports.ImportFailed, ValueError, csv.Error) as error:
+            return Response(
+                {'detail': str(error), 'job': job.id, 'records': job.records},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'job': job.id,
+            'records': job.records,
+            'created': importer.created,
+        })
+
+
+def _image_blob_etag(request, path):
+    """Return the strong ETag of a blob, which is its digest"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@require_safe
+@cache_control(public=True, max_age=365 * 24 * 3600, immutable=True)
+@condition(etag_func=_image_blob_etag)
+def image_blob(request, path):
+    """Serve a content addressed image blob, which never changes"""
+    name = f'{gallery_item_image_storage.blob_dir}/{path}'
+    try:
+        image = gallery_item_image_storage.open(name)
+    except FileNotFoundError:
+        raise Http404()
+
+    return FileResponse(image)
@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model, authenticate
+from django.core import signing
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers
 
+from user import tokens
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for the users object"""
@@ -52,3 +55,29 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs['user'] = user
         return attrs
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    """Serializer for exchanging a refresh token for a new token pair"""
+    refresh = serializers.CharField()
+
+    def validate(self, attrs):
+        """Validate the refresh token and look up its user"""
+        try:
+            payload = tokens.read_token(attrs['refresh'], tokens.REFRESH)
+        except signing.BadSignature:
+            payload = None
+
+        user = None
+        if payload:
+            user = get_user_model().objects.filter(
+                pk=payload['u'],
+                is_active=True
+            ).first()
+        if not user:
+            msg = _('Invalid or expired refresh token')
+            raise serializers.ValidationError(msg, code='authentication')
+
+        attrs['payload'] = payload
+        attrs['user'] = user
+        return attrs
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from user import tokens
+from user.authentication import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    """Drop a deleted token from the token cache"""
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def evict_user_tokens(sender, instance, created, **kwargs):
+    """Drop a user's cached tokens whenever the user changes
+
+    Covers deactivation and password changes, and keeps the cached user
+    from going stale after profile updates.
+    """
+    if created:
+        return
+
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    for key in keys:
+        token_cache.delete(key)
+
+
+@receiver(post_save, sender=get_user_model())
+def revoke_signed_tokens(sender, instance, created, **kwargs):
+    """Revoke a user's signed tokens on password change or deactivation"""
+    if created:
+        return
+
+    # set_password() leaves the raw password on _password until save()
+    # has finished, so it is still set while post_save runs
+    if instance._password is not None or not instance.is_active:
+        tokens.revoke_user_tokens(instance)
+
+
+@receiver(post_delete, sender=get_user_model())
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    """Revoke the signed tokens of a deleted user"""
+    tokens.revoke_user_tokens(instance)
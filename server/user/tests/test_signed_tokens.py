@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import RevokedToken
+
+from user.tokens import revocations
+
+
+TOKEN_URL = reverse('user:token')
+REFRESH_URL = reverse('user:token-refresh')
+ME_URL = reverse('user:me')
+
+
+@override_settings(AUTH_SIGNED_TOKENS=True)
+class SignedTokenApiTests(TestCase):
+    """Test issuing and using signed access tokens"""
+
+    def setUp(self):
+        revocations.clear()
+        self.payload = {'email': 'test@email.com', 'password': 'testpass'}
+        self.user = get_user_model().objects.create_user(**self.payload)
+        self.client = APIClient()
+
+    def obtain_tokens(self):
+        """Log in and return the issued token pair"""
+        res = self.client.post(TOKEN_URL, self.payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def authenticate(self, token):
+        """Send the signed access token on following requests"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_access_token_authenticates(self):
+        """Test that a signed access token authenticates the user"""
+        tokens = self.obtain_tokens()
+        self.authenticate(tokens['token'])
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_tampered_token_rejected(self):
+        """Test that a modified token is rejected"""
+        tokens = self.obtain_tokens()
+        self.authenticate(tokens['token'][:-1] + 'x')
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_access_token_not_accepted_as_refresh(self):
+        """Test that an access token cannot be used to refresh"""
+        tokens = self.obtain_tokens()
+
+        res = self.client.post(REFRESH_URL, {'refresh': tokens['token']})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_refresh_rotates_token(self):
+        """Test that refreshing issues new tokens and spends the old one"""
+        tokens = self.obtain_tokens()
+
+        res = self.client.post(REFRESH_URL, {'refresh': tokens['refresh']})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.authenticate(res.data['token'])
+        self.assertEqual(
+            self.client.get(ME_URL).status_code,
+            status.HTTP_200_OK
+        )
+
+        res = self.client.post(REFRESH_URL, {'refresh': tokens['refresh']})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_password_change_revokes_tokens(self):
+        """Test that changing password revokes existing signed tokens"""
+        tokens = self.obtain_tokens()
+        self.user.set_password('newpass')
+        self.user.save()
+        self.authenticate(tokens['token'])
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        res = self.client.post(REFRESH_URL, {'refresh': tokens['refresh']})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_late_committed_revocation_loaded(self):
+        """Test that a revocation with a lower ID than rows read is loaded"""
+        tokens = self.obtain_tokens()
+        self.authenticate(tokens['token'])
+        other = get_user_model().objects.create_user(
+            'other@email.com',
+            'testpass'
+        )
+        later = RevokedToken.objects.create(
+            user=other,
+            expires=datetime.now(timezone.utc) + timedelta(days=1)
+        )
+        self.assertEqual(
+            self.client.get(ME_URL).status_code,
+            status.HTTP_200_OK
+        )
+
+        # Committed after the row above was read, with an earlier ID
+        RevokedToken.objects.create(
+            id=later.id - 1,
+            user=self.user,
+            expires=later.expires
+        )
+        revocations._next_reload = 0
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_deletion_revokes_tokens(self):
+        """Test that tokens of a deleted user stay revoked"""
+        tokens = self.obtain_tokens()
+        user_id = self.user.id
+        self.user.delete()
+        revocations.clear()
+        self.authenticate(tokens['token'])
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(RevokedToken.objects.filter(user_id=user_id).exists())
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -5,6 +7,8 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.hashing import HashingPool
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -107,6 +111,20 @@ class PublicUserApiTests(TestCase):
         self.assertNotIn('token', res.data)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_token_hashing_pool_full(self):
+        """Test that logins are rejected while the hashing pool is full"""
+        payload = {'email': 'user@test.com', 'password': 'testpass'}
+        create_user(**payload)
+
+        with patch('core.hashing.hashing_pool', HashingPool(1, 0)):
+            res = self.client.post(TOKEN_URL, payload)
+
+        self.assertNotIn('token', res.data)
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
     def test_retrieve_user_unauthorized(self):
         """Test that authentication required for users"""
         res = self.client.get(ME_URL)
@@ -0,0 +1,145 @@
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core import signing
+
+from core.models import RevokedToken
+
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+TOKEN_TTLS = {
+    ACCESS: getattr(settings, 'AUTH_SIGNED_ACCESS_TTL', 300),
+    REFRESH: getattr(settings, 'AUTH_SIGNED_REFRESH_TTL', 7 * 24 * 3600),
+}
+
+
+def issue_token(user, kind):
+    """Return a signed token of the given kind for user"""
+    payload = {
+        'u': user.pk,
+        'j': secrets.token_hex(8),
+        'i': int(time.time() * 1000),
+    }
+    return signing.dumps(payload, salt=f'user.tokens.{kind}')
+
+
+def issue_token_pair(user):
+    """Return a new access and refresh token for user"""
+    return {
+        'token': issue_token(user, ACCESS),
+        'refresh': issue_token(user, REFRESH),
+        'expires_in': TOKEN_TTLS[ACCESS],
+    }
+
+
+def read_token(value, kind):
+    """Return the payload of a valid, unrevoked token or raise BadSignature"""
+    payload = signing.loads(
+        value,
+        salt=f'user.tokens.{kind}',
+        max_age=TOKEN_TTLS[kind]
+    )
+    if revocations.is_revoked(payload):
+        raise signing.BadSignature('Token has been revoked')
+
+    return payload
+
+
+def revoke_token(payload, kind):
+    """Revoke a single token by its payload"""
+    expires = payload['i'] / 1000 + TOKEN_TTLS[kind]
+    revocation = RevokedToken.objects.create(
+        user_id=payload['u'],
+        jti=payload['j'],
+        expires=datetime.fromtimestamp(expires, timezone.utc)
+    )
+    revocations.add(revocation)
+
+
+def revoke_user_tokens(user):
+    """Revoke every token issued to user so far"""
+    expires = datetime.now(timezone.utc) + timedelta(
+        seconds=max(TOKEN_TTLS.values())
+    )
+    revocation = RevokedToken.objects.create(user=user, expires=expires)
+    revocations.add(revocation)
+
+
+class RevocationSet:
+    """In-memory copy of the unexpired rows of the revocations table
+
+    Single revocations are kept in a set of token IDs and user wide ones as
+    a per-user cut-off time. The unexpired rows are read again at most once
+    per reload interval, so verifying a token normally touches no database
+    at all. Rows are not read from an ID onwards: IDs are drawn before
+    commit, so a revocation committed late can have a lower ID than rows
+    already read. Revocations are never undone, so each reload only adds
+    to what is known and expired entries are dropped.
+    """
+
+    def __init__(self, reload_interval):
+        self.reload_interval = reload_interval
+        self._jtis = {}
+        self._users = {}
+        self._next_reload = 0
+        self._lock = threading.Lock()
+
+    def add(self, revocation):
+        """Record a revocation row"""
+        expires = revocation.expires.timestamp()
+        with self._lock:
+            if revocation.jti:
+                self._jtis[revocation.jti] = expires
+            else:
+                revoked_at = revocation.revoked_at.timestamp()
+                current = self._users.get(revocation.user_id, (0, 0))
+                self._users[revocation.user_id] = (
+                    max(current[0], revoked_at),
+                    max(current[1], expires)
+                )
+
+    def is_revoked(self, payload):
+        """Return True if the token payload has been revoked"""
+        self._maybe_reload()
+        if payload['j'] in self._jtis:
+            return True
+        revoked_at = self._users.get(payload['u'], (0, 0))[0]
+        return payload['i'] <= revoked_at * 1000
+
+    def clear(self):
+        """Forget everything so the next check reloads from the table"""
+        with self._lock:
+            self._jtis.clear()
+            self._users.clear()
+            self._next_reload = 0
+
+    def _maybe_reload(self):
+        now = time.time()
+        if now < self._next_reload:
+            return
+        self._next_reload = now + self.reload_interval
+
+        for revocation in RevokedToken.objects.filter(
+            expires__gt=datetime.fromtimestamp(now, timezone.utc)
+        ).only('user_id', 'jti', 'revoked_at', 'expires').iterator():
+            self.add(revocation)
+
+        with self._lock:
+            self._jtis = {
+                jti: expires for jti, expires in self._jtis.items()
+                if expires > now
+            }
+            self._users = {
+                user_id: times for user_id, times in self._users.items()
+                if times[1] > now
+            }
+
+
+revocations = RevocationSet(
+    reload_interval=getattr(settings, 'AUTH_SIGNED_REVOCATION_RELOAD', 30)
+)
@@ -1,11 +1,25 @@
-from rest_framework import generics, authentication, permissions
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
-from user.serializers import UserSerializer, AuthTokenSerializer
+from core.instrumentation import TimedSerializationMixin
+
+from user import tokens
+from user.authentication import (
+    CachedTokenAuthentication, SignedTokenAuthentication
+)
+from user.serializers import (
+    UserSerializer, AuthTokenSerializer, RefreshTokenSerializer
+)
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(TimedSerializationMixin, generics.CreateAPIView):
     """Create a new user in the system"""
     serializer_class = UserSerializer
 
@@ -15,13 +29,60 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Return an auth token, or a signed token pair when enabled"""
+        if not settings.AUTH_SIGNED_TOKENS:
+            return super().post(request, *args, **kwargs)
+
+        serializer = self.serializer_class(
+            data=request.data,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return Response(
+            tokens.issue_token_pair(serializer.validated_data['user'])
+        )
+
+
+class RefreshTokenView(generics.GenericAPIView):
+    """Exchange a signed refresh token for a new token pair"""
+    serializer_class = RefreshTokenSerializer
+    authentication_classes = ()
 
-class ManagerUserView(generics.RetrieveUpdateAPIView):
+    def post(self, request, *args, **kwargs):
+        """Revoke the refresh token and return a new token pair"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            with transaction.atomic():
+                tokens.revoke_token(
+                    serializer.validated_data['payload'],
+                    tokens.REFRESH
+                )
+        except IntegrityError:
+            raise ValidationError(
+                {'refresh': [_('Refresh token has already been used')]}
+            )
+
+        return Response(
+            tokens.issue_token_pair(serializer.validated_data['user'])
+        )
+
+
+class ManagerUserView(TimedSerializationMixin,
+                      generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (
+        CachedTokenAuthentication,
+        SignedTokenAuthentication
+    )
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         """Retrieve and return authenticated user"""
-        return self.request.user
+        user = self.request.user
+        if user.get_deferred_fields():
+            user.refresh_from_db()
+
+        return user